@@ -44,3 +44,80 @@ class SecretsManager:
 
 secrets_manager = SecretsManager()
 
+
+# ==================================== Inference settings ========================================================
+
+class InferenceSettings:
+    def __init__(self):
+        default_model_dir = os.path.normpath(os.path.join(os.path.dirname(__file__), '../../ml_models'))
+        self.model_dir = os.getenv("MODEL_DIR", default_model_dir)
+        # Single-file bundle of all checkpoints (python -m ml_models.bundle build), read instead of the .pth files
+        self.model_bundle = os.getenv("MODEL_BUNDLE", "")
+
+        # Inference backend ("torch" or "onnxruntime")
+        self.inference_backend = os.getenv("INFERENCE_BACKEND", "torch")
+        self.onnx_intra_op_threads = int(os.getenv("ONNX_INTRA_OP_THREADS", str(os.cpu_count() or 1)))
+        self.onnx_inter_op_threads = int(os.getenv("ONNX_INTER_OP_THREADS", "1"))
+        self.onnx_graph_optimization = os.getenv("ONNX_GRAPH_OPTIMIZATION", "all")
+
+        # Torch backend runtime ("eager" or "torchscript"), TorchScript and ONNX artifacts are cached in artifact_dir
+        self.model_runtime = os.getenv("MODEL_RUNTIME", "eager")
+        self.artifact_dir = os.getenv("ARTIFACT_DIR", os.path.join(default_model_dir, "compiled"))
+
+        # Models served as verified INT8 artifacts (comma separated names), and the
+        # minimum top-1 agreement with fp32 they need before they are enabled
+        self.int8_models = [name.strip() for name in os.getenv("INT8_MODELS", "").split(",") if name.strip()]
+        self.int8_min_agreement = float(os.getenv("INT8_MIN_AGREEMENT", "0.98"))
+
+        # Models run in bfloat16 on CPUs with AVX512-BF16/AMX (comma separated names),
+        # through CPU autocast ("autocast") or with bf16-converted weights ("weights")
+        self.bf16_models = [name.strip() for name in os.getenv("BF16_MODELS", "").split(",") if name.strip()]
+        self.bf16_mode = os.getenv("BF16_MODE", "autocast")
+
+        # Early exit of the fold votes ("off", "majority" or "confidence", see ensemble.EarlyExit)
+        self.early_exit = os.getenv("EARLY_EXIT", "off")
+        self.early_exit_confidence = float(os.getenv("EARLY_EXIT_CONFIDENCE", "0.95"))
+        self.early_exit_min_folds = int(os.getenv("EARLY_EXIT_MIN_FOLDS", "2"))
+
+        # Distilled single-model students (python -m ml_models.distillation) answer first,
+        # samples below this student confidence fall back to the fold ensemble
+        self.student_models = os.getenv("STUDENT_MODELS", "false").lower() == "true"
+        self.student_min_confidence = float(os.getenv("STUDENT_MIN_CONFIDENCE", "0.9"))
+        # A student is only served if, with that fallback, it agreed with its ensemble on
+        # at least this share of the held-out windows in the distillation report
+        self.student_min_agreement = float(os.getenv("STUDENT_MIN_AGREEMENT", "0.98"))
+
+        # Frames whose per-fold CNN features each species ensemble keeps (0 disables it),
+        # so a window that slid forward by one frame only runs the CNN on the new frame
+        self.feature_cache_frames = int(os.getenv("FEATURE_CACHE_FRAMES", "2048"))
+
+        # Threads decoding the frames of a series, shared by every request (1 decodes them one by one)
+        self.decode_workers = int(os.getenv("DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+        # Decode each uploaded frame of a local series once, into a uint8 array memory-mapped next to its uploads
+        self.frame_store = os.getenv("FRAME_STORE", "true").lower() == "true"
+
+        # Keep the max ROI delta-E of every frame of each local series next to its uploads, updated at upload,
+        # so the stopping point is a lookup instead of a scan of the series
+        self.incremental_stopping_point = os.getenv("INCREMENTAL_STOPPING_POINT", "true").lower() == "true"
+
+        # Memo of each series' prediction once its stopping point is found ("off", "disk" or "redis"),
+        # stored per qr_data, date and model version together with the stopping point
+        self.prediction_memo = os.getenv("PREDICTION_MEMO", "off")
+        self.prediction_memo_dir = os.getenv("PREDICTION_MEMO_DIR", "storage/memo")
+        self.prediction_memo_redis_url = os.getenv("PREDICTION_MEMO_REDIS_URL", "redis://localhost:6379/0")
+
+        # Micro-batching of concurrent prediction requests
+        self.micro_batching = os.getenv("MICRO_BATCHING", "true").lower() == "true"
+        self.batch_max_size = int(os.getenv("BATCH_MAX_SIZE", "16"))
+        self.batch_max_wait_ms = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+
+        # Execution backend for CPU-bound prediction work ("thread" or "process")
+        self.executor_kind = os.getenv("EXECUTOR_KIND", "thread")
+        self.executor_workers = int(os.getenv("EXECUTOR_WORKERS", "2"))
+        self.executor_max_pending = int(os.getenv("EXECUTOR_MAX_PENDING", "64"))
+        self.load_timeout_s = float(os.getenv("LOAD_TIMEOUT_S", "60"))
+        self.predict_timeout_s = float(os.getenv("PREDICT_TIMEOUT_S", "60"))
+
+
+inference_settings = InferenceSettings()
@@ -1,7 +1,12 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
 from app.routers.api import api_router
+from app.ml_pipeline.registry import model_registry
+from app.ml_pipeline.batching import start_batchers, stop_batchers
+from app.ml_pipeline.executor import inference_executor
+from app.ml_pipeline.memo import start_prediction_memo
 import logging
 
 #==================================== Lifespan events ========================================================
@@ -9,10 +14,26 @@ import logging
 logger = logging.getLogger("uvicorn")
 logger.setLevel(logging.INFO)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load every model once per process, predictions only look them up.
+    # Process pool workers load their own copy instead.
+    if not inference_executor.preloads_models:
+        model_registry.load()
+    inference_executor.start()
+    start_batchers()
+    await start_prediction_memo(inference_executor)
+    yield
+    await stop_batchers()
+    inference_executor.shutdown()
+
+
 app = FastAPI(
     title="ML BugSense API",
     description="API for ML BugSense", 
     version="1", 
+    lifespan=lifespan,
     )
 
 #==================================== Middleware ========================================================
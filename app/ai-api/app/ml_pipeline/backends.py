@@ -0,0 +1,359 @@
+import os
+import logging
+import numpy as np
+import torch
+from ml_models.model_registry.CNN_LSTM import CNNLSTMModel
+from ml_models.model_registry.CNN_concentration import ConcentrationClassifier
+from ml_models.artifacts import (
+    load_or_build_artifact,
+    species_example_inputs,
+    concentration_example_inputs,
+    onnx_artifact_path,
+    export_onnx,
+)
+from ml_models.quantization import load_int8_artifact, int8_rejection_reason
+from ml_models.distillation import student_checkpoint_path, student_rejection_reason
+from ml_models.bfloat16 import BFloat16Model, bf16_supported
+from ml_models.bundle import open_bundle, model_key
+from app.ml_pipeline.ensemble import FoldEnsemble
+from app.core.config import inference_settings
+
+logger = logging.getLogger("uvicorn")
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+TORCH_RUNTIMES = ("eager", "torchscript")
+
+
+def ensemble_checkpoint_paths(mode, num_folds=5):
+    return [
+        os.path.join(inference_settings.model_dir, "species_models", f"{mode}_fold{fold}.pth")
+        for fold in range(1, num_folds + 1)
+    ]
+
+
+def student_name(mode):
+    return f"{mode}_student"
+
+
+def student_path(mode):
+    return student_checkpoint_path(inference_settings.model_dir, mode)
+
+
+def concentration_checkpoint_path():
+    return os.path.join(inference_settings.model_dir, "concentration_models", "binary_concentration_classifier.pth")
+
+
+def load_checkpoint(build_model, model_path):
+    """
+    Builds a model straight from its checkpoint, in eval mode on `device`.
+
+    The module is constructed on the meta device, so no weights are allocated or
+    initialized, and the memory-mapped checkpoint tensors are then assigned as its
+    parameters and buffers instead of being copied into them. With a model bundle
+    configured the tensors are views on the bundle file instead of the .pth.
+    """
+    with torch.device("meta"):
+        model = build_model()
+    if inference_settings.model_bundle:
+        bundle = open_bundle(inference_settings.model_bundle)
+        state_dict = bundle.state_dict(model_key(model_path, inference_settings.model_dir))
+        state_dict = {name: tensor.to(device) for name, tensor in state_dict.items()}
+    else:
+        state_dict = torch.load(model_path, weights_only=True, mmap=True, map_location=device)
+    model.load_state_dict(state_dict, strict=True, assign=True)
+    return model.eval()
+
+
+def load_ensemble_models(mode, num_folds=5, model_class=CNNLSTMModel, num_classes=5, runtime="eager"):
+    """
+    Load the ensemble models for a given mode and number of folds.
+    With runtime="torchscript" the cached TorchScript artifact of each fold is returned,
+    with runtime="int8" its verified quantized artifact, with runtime="bf16" the eager
+    model running in bfloat16.
+    """
+    fold_models = []
+
+    ######################################################
+    # This is the inference method for the moodels. We
+    # load the models and have a two tier classification.
+    # First a rough classification is done into the main
+    # color groups and then a second classification is done
+    # for the subgroups. The results are saved in a confusion
+    # matrix and the accuracy is printed.
+    ######################################################
+    for model_path in ensemble_checkpoint_paths(mode, num_folds):
+
+        fold_models.append(load_species_model(model_path, model_class, num_classes, runtime))
+
+    return fold_models
+
+
+def load_species_model(model_path, model_class=CNNLSTMModel, num_classes=5, runtime="eager"):
+    """One species checkpoint (a fold or a distilled student) on the given runtime."""
+    if runtime == "int8":
+        return load_int8_artifact(model_path, inference_settings.artifact_dir)
+
+    model = load_checkpoint(
+        lambda: model_class(cnn_feature_size=64, hidden_size=128, num_classes=num_classes), model_path
+    )
+    if runtime == "torchscript":
+        model = load_or_build_artifact(
+            model, model_path, species_example_inputs(device), inference_settings.artifact_dir, device
+        )
+    elif runtime == "bf16":
+        model = BFloat16Model(model, inference_settings.bf16_mode)
+    return model
+
+
+def load_concentration_model(model_class=ConcentrationClassifier, num_classes=2, runtime="eager"):
+
+    model_path = concentration_checkpoint_path()
+    if runtime == "int8":
+        return load_int8_artifact(model_path, inference_settings.artifact_dir)
+
+    model = load_checkpoint(lambda: model_class(num_classes=num_classes, pretrained=False), model_path)
+    if runtime == "torchscript":
+        model = load_or_build_artifact(
+            model, model_path, concentration_example_inputs(device), inference_settings.artifact_dir, device
+        )
+    elif runtime == "bf16":
+        model = BFloat16Model(model, inference_settings.bf16_mode)
+
+    return model
+
+
+class InferenceBackend:
+    """
+    Turns the checkpoints into the callables inference.predict runs.
+
+    `load_species_ensemble` returns a FoldEnsemble, whose fold_logits(images)
+    gives the (num_folds, batch_size, num_classes) logits of a (B, T, C, H, W)
+    batch. `load_concentration_model` returns a callable mapping a (B, C, H, W)
+    batch to (B, num_classes) logits, and `load_student` the same for a (B, T, C, H, W)
+    batch. Inputs and outputs are torch tensors for every backend, so voting and
+    the result dicts do not depend on the backend. `runtimes` records what each
+    loaded model actually runs on.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.runtimes = {}
+
+    def load_species_ensemble(self, mode, num_classes) -> FoldEnsemble:
+        raise NotImplementedError
+
+    def load_concentration_model(self, name, num_classes):
+        raise NotImplementedError
+
+    def load_student(self, mode, num_classes):
+        """
+        The distilled student of ensemble `mode`, or None (with a warning) if it
+        is missing, was not distilled from the current fold checkpoints or did
+        not reach `student_min_agreement` on the held-out series.
+        """
+        reason = student_rejection_reason(
+            mode,
+            ensemble_checkpoint_paths(mode, num_folds=5),
+            inference_settings.model_dir,
+            inference_settings.student_min_agreement,
+            inference_settings.student_min_confidence,
+        )
+        if reason is not None:
+            logger.warning(f"Student of {mode} not enabled: {reason}")
+            return None
+        return self._load_student(student_name(mode), student_path(mode), num_classes)
+
+    def _load_student(self, name, path, num_classes):
+        raise NotImplementedError
+
+
+class TorchBackend(InferenceBackend):
+    """
+    PyTorch modules on `device`: eager, or the TorchScript artifacts with
+    runtime="torchscript".
+
+    Models listed in `int8_models` are served from their INT8 artifacts, but only
+    if `tests.verify_quantization` measured at least `int8_min_agreement` top-1
+    agreement with fp32 for the current checkpoints. Models listed in
+    `bf16_models` run in bfloat16 if the CPU has native bf16 arithmetic (check
+    `tests.verify_bf16` first). Otherwise they keep `runtime`.
+    """
+
+    name = "torch"
+
+    def __init__(self, runtime="eager", int8_models=(), int8_min_agreement=1.0, bf16_models=()):
+        super().__init__()
+        if runtime not in TORCH_RUNTIMES:
+            raise ValueError(f"Unknown model runtime: {runtime}")
+
+        self.runtime = runtime
+        self.int8_models = set(int8_models)
+        self.int8_min_agreement = int8_min_agreement
+        self.bf16_models = set(bf16_models)
+
+    def load_species_ensemble(self, mode, num_classes):
+        runtime = self._runtime_for(mode, ensemble_checkpoint_paths(mode, num_folds=5))
+        self.runtimes[mode] = runtime
+        return FoldEnsemble(load_ensemble_models(mode, num_folds=5, num_classes=num_classes, runtime=runtime))
+
+    def load_concentration_model(self, name, num_classes):
+        runtime = self._runtime_for(name, [concentration_checkpoint_path()])
+        self.runtimes[name] = runtime
+        return load_concentration_model(num_classes=num_classes, runtime=runtime)
+
+    def _load_student(self, name, path, num_classes):
+        # students are served on the fp32 runtime, they have no verified INT8 artifacts
+        self.runtimes[name] = self.runtime
+        return load_species_model(path, num_classes=num_classes, runtime=self.runtime)
+
+    def _runtime_for(self, name, checkpoint_paths):
+        # a verified INT8 artifact wins, bf16 is the next choice for models listed in both
+        if name not in self.int8_models:
+            return self._bf16_runtime_for(name)
+
+        if device.type != "cpu":
+            reason = f"quantized models do not run on {device}"
+        else:
+            reason = int8_rejection_reason(
+                name, checkpoint_paths, inference_settings.artifact_dir, self.int8_min_agreement
+            )
+        if reason is not None:
+            logger.warning(f"INT8 not enabled for {name}: {reason}")
+            return self._bf16_runtime_for(name)
+        return "int8"
+
+    def _bf16_runtime_for(self, name):
+        if name not in self.bf16_models:
+            return self.runtime
+
+        if device.type != "cpu":
+            reason = f"the bf16 mode is for CPU inference, not {device}"
+        elif not bf16_supported():
+            reason = "the CPU has no native bf16 arithmetic (AVX512-BF16 / AMX), it would be slower than fp32"
+        else:
+            return "bf16"
+        logger.warning(f"bf16 not enabled for {name}: {reason}")
+        return self.runtime
+
+
+class OnnxModel:
+    """
+    One exported model in an onnxruntime CPU session.
+
+    Inputs and outputs are bound to torch tensors (IO binding), so onnxruntime
+    reads the batch and writes the logits in place without numpy copies.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.output_name = session.get_outputs()[0].name
+        self.num_classes = session.get_outputs()[0].shape[1]
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        images = images.to(device="cpu", dtype=torch.float32).contiguous()
+        logits = torch.empty((images.size(0), self.num_classes), dtype=torch.float32)
+
+        binding = self.session.io_binding()
+        binding.bind_input(self.input_name, "cpu", 0, np.float32, tuple(images.shape), images.data_ptr())
+        binding.bind_output(self.output_name, "cpu", 0, np.float32, tuple(logits.shape), logits.data_ptr())
+        self.session.run_with_iobinding(binding)
+        return logits
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """
+    The models exported to ONNX (cached in the artifact dir by checkpoint hash)
+    and run by onnxruntime on CPU, with graph optimizations and explicit
+    intra-op / inter-op thread counts.
+    """
+
+    name = "onnxruntime"
+
+    GRAPH_OPTIMIZATION_LEVELS = {
+        "disabled": "ORT_DISABLE_ALL",
+        "basic": "ORT_ENABLE_BASIC",
+        "extended": "ORT_ENABLE_EXTENDED",
+        "all": "ORT_ENABLE_ALL",
+    }
+
+    def __init__(self, intra_op_threads=1, inter_op_threads=1, graph_optimization="all"):
+        super().__init__()
+        if graph_optimization not in self.GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Unknown graph optimization level: {graph_optimization}")
+
+        # onnxruntime is only required when this backend is selected
+        import onnxruntime
+
+        self._ort = onnxruntime
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph_optimization = graph_optimization
+
+    def _session_options(self):
+        options = self._ort.SessionOptions()
+        options.graph_optimization_level = getattr(
+            self._ort.GraphOptimizationLevel, self.GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization]
+        )
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        if self.inter_op_threads > 1:
+            options.execution_mode = self._ort.ExecutionMode.ORT_PARALLEL
+        return options
+
+    def _load(self, checkpoint_path, load_model, example_input):
+        path = onnx_artifact_path(checkpoint_path, inference_settings.artifact_dir)
+        if not os.path.exists(path):
+            export_onnx(load_model(), example_input, path)
+        session = self._ort.InferenceSession(path, self._session_options(), providers=["CPUExecutionProvider"])
+        return OnnxModel(session)
+
+    def load_species_ensemble(self, mode, num_classes):
+        self.runtimes[mode] = self.name
+        example_input = species_example_inputs()["forward"]
+
+        # the torch models are only loaded if an artifact has to be exported
+        torch_models = []
+
+        def load_fold(fold):
+            if not torch_models:
+                torch_models.extend(load_ensemble_models(mode, num_folds=5, num_classes=num_classes))
+            return torch_models[fold]
+
+        fold_models = []
+        for fold, checkpoint_path in enumerate(ensemble_checkpoint_paths(mode, num_folds=5)):
+            fold_models.append(self._load(checkpoint_path, lambda: load_fold(fold), example_input))
+        return FoldEnsemble(fold_models)
+
+    def _load_student(self, name, path, num_classes):
+        self.runtimes[name] = self.name
+        return self._load(
+            path, lambda: load_species_model(path, num_classes=num_classes), species_example_inputs()["forward"]
+        )
+
+    def load_concentration_model(self, name, num_classes):
+        self.runtimes[name] = self.name
+        return self._load(
+            concentration_checkpoint_path(),
+            lambda: load_concentration_model(num_classes=num_classes),
+            concentration_example_inputs()["forward"],
+        )
+
+
+def create_backend(settings=inference_settings) -> InferenceBackend:
+    if settings.inference_backend == "torch":
+        return TorchBackend(
+            runtime=settings.model_runtime,
+            int8_models=settings.int8_models,
+            int8_min_agreement=settings.int8_min_agreement,
+            bf16_models=settings.bf16_models,
+        )
+    if settings.inference_backend == "onnxruntime":
+        return OnnxRuntimeBackend(
+            intra_op_threads=settings.onnx_intra_op_threads,
+            inter_op_threads=settings.onnx_inter_op_threads,
+            graph_optimization=settings.onnx_graph_optimization,
+        )
+    raise ValueError(f"Unknown inference backend: {settings.inference_backend}")
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import torch
+from app.core.config import inference_settings
+from app.ml_pipeline.inference import predict_per_sample
+from app.ml_pipeline.executor import inference_executor
+
+logger = logging.getLogger("uvicorn")
+
+
+class BatcherStoppedError(RuntimeError):
+    """Raised to requests that were queued or batched when their batcher stopped."""
+
+
+class MicroBatcher:
+    """
+    Collects prediction inputs from concurrent requests and runs them as one batch.
+
+    A batch is dispatched as soon as `max_batch_size` samples are pending or
+    `max_wait_ms` after its first sample arrived, whichever comes first. Every
+    request gets back only the result dicts of its own samples.
+
+    Requests that are still queued or in the current batch when the batcher is
+    stopped get a BatcherStoppedError instead of waiting for their timeout.
+    """
+
+    def __init__(self, task: str, max_batch_size: int = 16, max_wait_ms: float = 10):
+        self.task = task
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue = None
+        self._worker = None
+        self._batch = []
+
+        self._batches = 0
+        self._samples = 0
+        self._last_batch_size = 0
+        self._max_batch_size_seen = 0
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        pending = self._batch
+        self._batch = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(BatcherStoppedError(f"{self.task} batcher stopped"))
+
+    async def submit(self, inputs: torch.Tensor) -> list:
+        """Queues a batch of inputs and waits for one result dict per sample."""
+        if not self.running:
+            raise BatcherStoppedError(f"{self.task} batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((inputs, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+
+        # kept on the batcher, so stop() can fail the requests of a batch it interrupts
+        self._batch = batch = [await self._queue.get()]
+        size = batch[0][0].size(0)
+        deadline = loop.time() + self.max_wait_ms / 1000
+
+        while size < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            size += item[0].size(0)
+
+        # requests cancelled while waiting (client went away) are not run
+        self._batch = [(inputs, future) for inputs, future in batch if not future.cancelled()]
+        return self._batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            try:
+                inputs = torch.cat([inputs for inputs, _ in batch])
+                results = await inference_executor.run("predict", predict_per_sample, inputs, self.task)
+            except Exception as e:
+                logger.error(f"{self.task} batch of {len(batch)} request(s) failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                self._batch = []
+                continue
+
+            start = 0
+            for request_inputs, future in batch:
+                end = start + request_inputs.size(0)
+                if not future.done():
+                    future.set_result(results[start:end])
+                start = end
+
+            self._batch = []
+            self._batches += 1
+            self._samples += inputs.size(0)
+            self._last_batch_size = inputs.size(0)
+            self._max_batch_size_seen = max(self._max_batch_size_seen, inputs.size(0))
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": self._batches,
+            "samples": self._samples,
+            "mean_batch_size": round(self._samples / self._batches, 2) if self._batches else 0,
+            "last_batch_size": self._last_batch_size,
+            "max_batch_size_seen": self._max_batch_size_seen,
+        }
+
+
+batchers = {
+    task: MicroBatcher(task, inference_settings.batch_max_size, inference_settings.batch_max_wait_ms)
+    for task in ("species", "concentration")
+}
+
+
+def start_batchers():
+    if inference_settings.micro_batching:
+        for batcher in batchers.values():
+            batcher.start()
+
+
+async def stop_batchers():
+    for batcher in batchers.values():
+        await batcher.stop()
+
+
+async def batched_predict(inputs: torch.Tensor, task: str) -> dict:
+    """
+    predict() for a single-sample input, batched together with concurrent
+    requests when the task's batcher is running. Either way the forward runs
+    on the inference executor, never on the event loop.
+    """
+    batcher = batchers.get(task)
+    if batcher is None or not batcher.running:
+        results = await inference_executor.run("predict", predict_per_sample, inputs, task)
+    else:
+        results = await batcher.submit(inputs)
+    return results[0]
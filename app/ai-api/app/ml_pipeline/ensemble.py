@@ -0,0 +1,185 @@
+import torch
+import torch.nn.functional as F
+
+
+class FoldEnsemble:
+    """
+    The cross-validation fold models of one classification tier.
+
+    All folds see the same batch, and their outputs are stacked into a single
+    (num_folds, batch_size, num_classes) tensor so voting never leaves torch.
+
+    With a `feature_cache` (see feature_cache.FrameFeatureCache) the folds only
+    run their CNN on frames whose features are not cached yet.
+    """
+
+    def __init__(self, fold_models, feature_cache=None):
+        self.fold_models = list(fold_models)
+        self.feature_cache = feature_cache
+
+    def __len__(self):
+        return len(self.fold_models)
+
+    def __iter__(self):
+        return iter(self.fold_models)
+
+    def fold_outputs(self, images: torch.Tensor):
+        """Logits of each fold in turn, computed as they are consumed."""
+        if self.feature_cache is None:
+            for model in self.fold_models:
+                yield model(images)
+            return
+
+        frame_ids = self.feature_cache.frame_ids(images)
+        for fold, model in enumerate(self.fold_models):
+            yield model.classify_features(self.feature_cache.features(fold, model, images, frame_ids))
+
+    def fold_logits(self, images: torch.Tensor) -> torch.Tensor:
+        return torch.stack(list(self.fold_outputs(images)))
+
+
+def tensor_majority_vote(fold_preds: torch.Tensor, num_classes: int, fold_confs: torch.Tensor = None):
+    """
+    Majority vote over the fold dimension.
+
+    Args:
+        fold_preds (torch.Tensor): (num_folds, batch_size) predicted class per fold
+        num_classes (int): Number of classes of the ensemble
+        fold_confs (torch.Tensor, optional): (num_folds, batch_size) confidence per fold
+
+    Returns:
+        voted_preds (torch.Tensor): (batch_size,) winning class per sample
+        mean_confs (torch.Tensor or None): (batch_size,) mean confidence of the folds
+                                           that voted for the winning class
+    """
+    counts = F.one_hot(fold_preds, num_classes).sum(dim=0)  # (B, K)
+    is_top = counts == counts.max(dim=1, keepdim=True).values
+
+    # Counter.most_common breaks ties by first occurrence, so the winner is the
+    # class of the first fold that voted for one of the top classes
+    fold_is_top = is_top.gather(1, fold_preds.t()).int()  # (B, F)
+    first_top_fold = fold_is_top.argmax(dim=1, keepdim=True)
+    voted_preds = fold_preds.t().gather(1, first_top_fold).squeeze(1)
+
+    if fold_confs is None:
+        return voted_preds, None
+
+    agrees = fold_preds == voted_preds.unsqueeze(0)  # (F, B)
+
+    # accumulate in fold order, which is exactly how np.mean sums a handful of float32 values
+    conf_sum = torch.zeros_like(fold_confs[0])
+    for fold in range(fold_confs.size(0)):
+        conf_sum = conf_sum + torch.where(agrees[fold], fold_confs[fold], torch.zeros_like(fold_confs[fold]))
+    mean_confs = conf_sum / agrees.sum(dim=0).to(conf_sum.dtype)
+
+    return voted_preds, mean_confs
+
+
+class EarlyExit:
+    """
+    When a fold ensemble may stop evaluating its folds in sequence.
+
+    With policy "majority" the vote of a sample stops once the remaining folds
+    can no longer change its winner, nor, if a confidence `gate` is given,
+    which side of the gate the mean confidence of the winner ends up on. The
+    voted class and the gate decision are then always those of the full
+    ensemble. Policy "confidence" also stops once the first `min_folds` or more
+    folds agree with a mean confidence of at least `confidence`, which may
+    differ from the full vote. In both cases the mean confidence is taken over
+    the folds evaluated for that sample only.
+    """
+
+    POLICIES = ("majority", "confidence")
+
+    # margin around the gate within which a bound counts as crossing it
+    GATE_TOLERANCE = 1e-6
+
+    def __init__(self, policy="majority", confidence=0.95, min_folds=2):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown early exit policy {policy!r}, expected one of {self.POLICIES}")
+        self.policy = policy
+        self.confidence = confidence
+        self.min_folds = min_folds
+
+    def decided(self, fold_preds, fold_confs, num_classes, remaining_folds, gate=None):
+        """(batch_size,) whether the vote of each sample is final after the evaluated folds."""
+        counts = F.one_hot(fold_preds, num_classes).sum(dim=0)  # (B, K)
+        top = counts.topk(min(2, num_classes), dim=1).values
+        runner_up = top[:, 1] if num_classes > 1 else torch.zeros_like(top[:, 0])
+        # strictly ahead: a tie would be broken by first occurrence, which the
+        # remaining folds could still hand to the runner-up
+        decided = top[:, 0] > runner_up + remaining_folds
+        if gate is not None:
+            decided &= self.gate_fixed(fold_preds, fold_confs, num_classes, remaining_folds, gate)
+
+        if self.policy == "confidence" and fold_preds.size(0) >= self.min_folds:
+            unanimous = (fold_preds == fold_preds[:1]).all(dim=0)
+            decided |= unanimous & (fold_confs.mean(dim=0) >= self.confidence)
+        return decided
+
+    def gate_fixed(self, fold_preds, fold_confs, num_classes, remaining_folds, gate):
+        """
+        (batch_size,) whether the mean confidence of the leading class is on the
+        same side of `gate` whatever the remaining folds vote. A remaining fold
+        either votes for another class and leaves the mean as it is, or votes
+        for the leader with a confidence between 1 / num_classes and 1.
+        """
+        voted_preds, mean_confs = tensor_majority_vote(fold_preds, num_classes, fold_confs)
+        if remaining_folds == 0:
+            return torch.ones_like(voted_preds, dtype=torch.bool)
+        agreeing = (fold_preds == voted_preds.unsqueeze(0)).sum(dim=0).to(mean_confs.dtype)
+        conf_sum = mean_confs * agreeing
+        lowest = torch.minimum(mean_confs, (conf_sum + remaining_folds / num_classes) / (agreeing + remaining_folds))
+        highest = torch.maximum(mean_confs, (conf_sum + remaining_folds) / (agreeing + remaining_folds))
+        return (lowest >= gate + self.GATE_TOLERANCE) | (highest < gate - self.GATE_TOLERANCE)
+
+    def vote(self, fold_models, images, gate=None):
+        """
+        Majority vote of the folds, evaluated one at a time until every sample
+        of the batch is decided. Each sample is voted on by the folds up to the
+        one that decided it, so its result does not depend on the rest of the batch.
+
+        Args:
+            gate (float, optional): confidence threshold the caller compares the
+                                    mean confidence against, see decided()
+
+        Returns:
+            voted_preds (torch.Tensor): (batch_size,) winning class per sample
+            mean_confs (torch.Tensor): (batch_size,) mean confidence of the evaluated
+                                       folds that voted for the winning class
+            folds_evaluated (torch.Tensor): (batch_size,) folds that ran for each sample
+        """
+        if not isinstance(fold_models, FoldEnsemble):
+            fold_models = FoldEnsemble(fold_models)
+        fold_probs = []
+        folds_evaluated = None
+        for fold, logits in enumerate(fold_models.fold_outputs(images)):
+            fold_probs.append(F.softmax(logits, dim=1))
+            fold_confs, fold_preds = torch.max(torch.stack(fold_probs), 2)
+            remaining = len(fold_models) - fold - 1
+            if folds_evaluated is None:
+                folds_evaluated = torch.zeros(fold_preds.size(1), dtype=torch.long)
+            # 0 until the sample is decided, then the number of folds that decided it
+            newly_decided = folds_evaluated == 0
+            if remaining > 0:
+                newly_decided &= self.decided(fold_preds, fold_confs, fold_probs[0].size(1), remaining, gate).cpu()
+            folds_evaluated[newly_decided] = fold + 1
+            if (folds_evaluated > 0).all():
+                break
+
+        num_classes = fold_probs[0].size(1)
+        voted_preds = torch.empty_like(fold_preds[0])
+        mean_confs = torch.empty_like(fold_confs[0])
+        for folds in folds_evaluated.unique().tolist():
+            samples = (folds_evaluated == folds).nonzero().squeeze(1).to(fold_preds.device)
+            preds, confs = tensor_majority_vote(fold_preds[:folds, samples], num_classes, fold_confs[:folds, samples])
+            voted_preds[samples] = preds
+            mean_confs[samples] = confs
+        return voted_preds, mean_confs, folds_evaluated
+
+
+def create_early_exit(settings):
+    """The EarlyExit configured by EARLY_EXIT, or None when every fold always runs."""
+    if settings.early_exit == "off":
+        return None
+    return EarlyExit(settings.early_exit, settings.early_exit_confidence, settings.early_exit_min_folds)
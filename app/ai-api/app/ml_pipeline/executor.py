@@ -0,0 +1,140 @@
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from app.core.config import inference_settings
+
+logger = logging.getLogger("uvicorn")
+
+
+class InferenceQueueFullError(RuntimeError):
+    """Raised when more prediction work is pending than the executor accepts."""
+
+
+def _preload_models():
+    # process pool initializer: every worker holds its own model registry
+    from app.ml_pipeline.registry import model_registry
+    model_registry.load()
+
+
+def _worker_ready():
+    return True
+
+
+class InferenceExecutor:
+    """
+    Runs the CPU-bound prediction stages (image decoding, stopping point, forwards)
+    outside the event loop, on a thread pool or on a process pool whose workers
+    preload the models.
+
+    At most `max_pending` submissions are queued or running at any time, and each
+    stage has its own timeout. A timed out stage is reported to the caller, the
+    worker still finishes it in the background.
+    """
+
+    def __init__(self, kind="thread", max_workers=2, max_pending=64, timeouts=None):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeouts = timeouts or {}
+
+        self._pool = None
+        self._pending = 0
+        self._stages = {}
+
+    @property
+    def preloads_models(self) -> bool:
+        return self.kind == "process"
+
+    def start(self):
+        if self._pool is not None:
+            return
+
+        if self.kind == "process":
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_preload_models,
+            )
+            # start the workers now so the models are loaded before the first request
+            for _ in range(self.max_workers):
+                self._pool.submit(_worker_ready)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _stage_stats(self, stage):
+        return self._stages.setdefault(stage, {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "total_time_s": 0.0,
+            "max_time_s": 0.0,
+        })
+
+    async def run(self, stage: str, fn, *args):
+        """Runs fn(*args) on the pool and waits for it for at most the stage's timeout."""
+        if self._pool is None:
+            self.start()
+
+        stats = self._stage_stats(stage)
+        if self._pending >= self.max_pending:
+            stats["rejected"] += 1
+            raise InferenceQueueFullError(f"{self._pending} prediction tasks pending, try again later")
+
+        stats["submitted"] += 1
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+            result = await asyncio.wait_for(future, self.timeouts.get(stage))
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            raise TimeoutError(f"{stage} stage timed out after {self.timeouts.get(stage)}s")
+        except Exception:
+            stats["failed"] += 1
+            raise
+        finally:
+            self._pending -= 1
+
+        elapsed = time.perf_counter() - start
+        stats["completed"] += 1
+        stats["total_time_s"] += elapsed
+        stats["max_time_s"] = max(stats["max_time_s"], elapsed)
+        return result
+
+    def stats(self) -> dict:
+        stages = {}
+        for stage, stats in self._stages.items():
+            stages[stage] = dict(stats)
+            stages[stage]["mean_time_s"] = stats["total_time_s"] / stats["completed"] if stats["completed"] else 0.0
+
+        return {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "stages": stages,
+        }
+
+
+inference_executor = InferenceExecutor(
+    kind=inference_settings.executor_kind,
+    max_workers=inference_settings.executor_workers,
+    max_pending=inference_settings.executor_max_pending,
+    timeouts={
+        "load": inference_settings.load_timeout_s,
+        "index": inference_settings.load_timeout_s,
+        "predict": inference_settings.predict_timeout_s,
+    },
+)
@@ -0,0 +1,125 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import torch
+
+
+class FrameFeatureCache:
+    """
+    Bounded cache of the per-frame CNN features of every fold of one species
+    ensemble, keyed by (frame id, fold).
+
+    While no stopping point is found the prediction window slides forward by one
+    frame per upload, so 4 of its 5 frames already went through the CNN of
+    every fold. With the cache only new frames run the CNN, and the LSTM and FC
+    heads run on the cached features.
+
+    A frame is identified by a digest of its pixels, which is the same in every
+    request without frame names having to be passed through the batcher and the
+    executor. Frames are grouped into series by the windows they arrive in: a
+    window that shares a frame with a cached series extends that series. Above
+    `max_frames` cached frames, whole series are evicted, the one extended
+    longest ago first.
+    """
+
+    def __init__(self, num_folds, max_frames=2048):
+        self.num_folds = num_folds
+        self.max_frames = max_frames
+        self._frames = {}               # frame id -> [features of each fold or None]
+        self._series = OrderedDict()    # series id -> ordered set (dict) of its frame ids, oldest series first
+        self._frame_series = {}         # frame id -> series id
+        self._next_series = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evicted_series = 0
+
+    @staticmethod
+    def frame_id(frame: torch.Tensor) -> bytes:
+        return hashlib.blake2b(frame.detach().cpu().contiguous().numpy().tobytes(), digest_size=16).digest()
+
+    def frame_ids(self, windows: torch.Tensor) -> list:
+        """
+        Ids of the frames of a (B, T, C, H, W) batch of windows, as a flat list of
+        B * T ids. Registers every frame with its window's series.
+        """
+        batch_size, sequence_length = windows.shape[:2]
+        frames = windows.reshape(batch_size * sequence_length, *windows.shape[2:])
+        ids = [self.frame_id(frame) for frame in frames]
+
+        with self._lock:
+            for start in range(0, len(ids), sequence_length):
+                self._register(ids[start:start + sequence_length])
+            self._evict()
+        return ids
+
+    def _register(self, window_ids):
+        series = next((self._frame_series[i] for i in window_ids if i in self._frame_series), None)
+        if series is None:
+            series = self._next_series
+            self._next_series += 1
+            self._series[series] = {}
+        self._series.move_to_end(series)
+        for frame_id in window_ids:
+            if frame_id not in self._frame_series:
+                self._frame_series[frame_id] = series
+                self._series[series][frame_id] = None
+                self._frames[frame_id] = [None] * self.num_folds
+
+    def _evict(self):
+        while len(self._frames) > self.max_frames:
+            if len(self._series) > 1:
+                _, frame_ids = self._series.popitem(last=False)
+                self._evicted_series += 1
+            else:
+                # a single series longer than the cache loses its oldest frame
+                (series_frames,) = self._series.values()
+                oldest = next(iter(series_frames))
+                del series_frames[oldest]
+                frame_ids = [oldest]
+            for frame_id in frame_ids:
+                del self._frames[frame_id]
+                del self._frame_series[frame_id]
+
+    def features(self, fold, model, windows: torch.Tensor, ids) -> torch.Tensor:
+        """
+        (B, T, cnn_feature_size) features of `windows` under fold `fold`, running
+        model.extract_features only on the frames whose features are not cached.
+        """
+        batch_size, sequence_length = windows.shape[:2]
+        with self._lock:
+            cached = {i: self._frames[i][fold] for i in ids if i in self._frames and self._frames[i][fold] is not None}
+
+        missing = {}
+        for position, frame_id in enumerate(ids):
+            if frame_id not in cached and frame_id not in missing:
+                missing[frame_id] = position
+
+        if missing:
+            frames = windows.reshape(batch_size * sequence_length, *windows.shape[2:])
+            new_frames = frames[list(missing.values())].unsqueeze(0)
+            new_features = model.extract_features(new_frames)[0].detach()
+            computed = dict(zip(missing, new_features))
+            cached.update(computed)
+            with self._lock:
+                for frame_id, features in computed.items():
+                    if frame_id in self._frames:
+                        self._frames[frame_id][fold] = features
+
+        with self._lock:
+            self._hits += len(ids) - len(missing)
+            self._misses += len(missing)
+        return torch.stack([cached[i] for i in ids]).view(batch_size, sequence_length, -1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "frames": len(self._frames),
+                "series": len(self._series),
+                "max_frames": self.max_frames,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evicted_series": self._evicted_series,
+            }
@@ -1,42 +1,144 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import torch
 from torchvision import transforms
 from torchvision.transforms import InterpolationMode
-from app.utils.stopping_point import find_stopping_point
+from app.core.config import inference_settings
+from app.utils.stopping_point import find_stopping_point, DeltaEProfile
+from app.utils.frame_store import FrameStore
 from app.utils.upload import list_images_gcs, extract_timestamp
 from PIL import Image
 from io import BytesIO
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# (height, width) of every frame fed to the models
+FRAME_SIZE = (190, 40)
 
-def load_image_from_source(source_path: str, gcs_blob=None):
-    
-    transform = transforms.Compose([
-        transforms.CenterCrop((143, 40)),
-        transforms.Resize((190, 40), interpolation=InterpolationMode.BICUBIC, antialias=True),
-        transforms.ToTensor()
-    ])
-    
+
+# crop and resize of every frame, built once (the transforms hold no state)
+FRAME_TRANSFORM = transforms.Compose([
+    transforms.CenterCrop((143, 40)),
+    transforms.Resize(FRAME_SIZE, interpolation=InterpolationMode.BICUBIC, antialias=True),
+    transforms.PILToTensor()
+])
+
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
+
+def load_frame_from_source(source_path: str, gcs_blob=None) -> torch.Tensor:
+    """The (C, H, W) uint8 frame of load_image_from_source, before it is scaled to [0, 1]."""
     if gcs_blob:
         image_bytes = gcs_blob.download_as_bytes()
         img = Image.open(BytesIO(image_bytes)).convert("RGB")
     else:
         img = Image.open(source_path).convert("RGB")
-    return transform(img)
+    return FRAME_TRANSFORM(img)
 
 
-def load_image_series_from_folder(folder_path: str, cloud: bool = False, min_hours: int = 6) -> torch.Tensor:
-    
+def decode_pool():
+    """Threads shared by every request to decode frames, started on first use, or None with DECODE_WORKERS=1."""
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None and inference_settings.decode_workers > 1:
+            _decode_pool = ThreadPoolExecutor(max_workers=inference_settings.decode_workers, thread_name_prefix="decode")
+        return _decode_pool
+
+
+def decode_frames(sources, cloud: bool = False, out=None, dtype=torch.float32) -> torch.Tensor:
+    """
+    Decodes the frames at `sources` (file paths, or GCS blobs if cloud) straight
+    into one (T, C, H, W) tensor, `out` if given. uint8 tensors get the frames
+    of load_frame_from_source, float tensors those of load_image_from_source.
+
+    The frames are decoded on the decode pool: PIL releases the GIL while it
+    decodes and resizes, so DECODE_WORKERS frames are decoded at a time.
+    """
+    if out is None:
+        out = torch.empty((len(sources), 3, *FRAME_SIZE), dtype=dtype)
+
+    def decode_into(index):
+        frame = load_frame_from_source(None, gcs_blob=sources[index]) if cloud else load_frame_from_source(sources[index])
+        if out.dtype == torch.uint8:
+            out[index].copy_(frame)
+        else:
+            torch.div(frame, 255, out=out[index])
+
+    pool = decode_pool()
+    if pool is None or len(sources) < 2:
+        for index in range(len(sources)):
+            decode_into(index)
+    else:
+        # waits for every frame, and raises the first decoding error
+        list(pool.map(decode_into, range(len(sources))))
+    return out
+
+
+def frames_to_float(frames: torch.Tensor) -> torch.Tensor:
+    """uint8 frames as the float frames in [0, 1] the models take (what ToTensor does)."""
+    return frames.to(torch.float32).div(255)
+
+
+def load_image_from_source(source_path: str, gcs_blob=None):
+    return frames_to_float(load_frame_from_source(source_path, gcs_blob=gcs_blob))
+
+
+def list_image_entries(folder_path: str, cloud: bool = False) -> list:
+    """The frames of a series in upload order: GCS blobs, or file names in folder_path."""
     if cloud:
         # Extract bucket and prefix
         path = folder_path[5:]
         print("path", path)
         bucket_name, prefix = path.split("/", 1)
-        img_entries = list_images_gcs(bucket_name, prefix)
-    else:
-        img_entries = [img for img in os.listdir(folder_path) if img.endswith(".png")]
-        img_entries.sort(key=extract_timestamp)
+        return list_images_gcs(bucket_name, prefix)
+
+    img_entries = [img for img in os.listdir(folder_path) if img.endswith(".png")]
+    img_entries.sort(key=extract_timestamp)
+    return img_entries
+
+
+class FrameSeries:
+    """
+    The uint8 frames of a series, e.g. a view on its frame store, indexed like
+    the float series of load_image_series_from_folder: indexing or slicing it
+    returns float frames in [0, 1], built for the selected frames only.
+
+    A prediction only takes the 5-frame window before the stopping point
+    (species) or the frame at it (concentration), and find_stopping_point
+    converts the frames a batch at a time, so the float version of the whole
+    series, 4 times the size of its uint8 frames, is never built.
+    """
+
+    def __init__(self, frames: torch.Tensor):
+        self.frames = frames
+
+    def __len__(self):
+        return self.frames.size(0)
+
+    @property
+    def shape(self):
+        return self.frames.shape
+
+    def size(self, dim=None):
+        return self.frames.size() if dim is None else self.frames.size(dim)
+
+    def __getitem__(self, index) -> torch.Tensor:
+        return frames_to_float(self.frames[index])
+
+    def frames_from(self, start) -> "FrameSeries":
+        return FrameSeries(self.frames[start:])
+
+    def to_tensor(self) -> torch.Tensor:
+        """All frames as one float (T, C, H, W) tensor."""
+        return frames_to_float(self.frames)
+
+
+def load_frame_series(folder_path: str, cloud: bool = False, min_hours: int = 6, img_entries=None) -> FrameSeries:
+    """The series of load_image_series_from_folder as a FrameSeries, or None if it is too short."""
+    if img_entries is None:
+        img_entries = list_image_entries(folder_path, cloud=cloud)
        
     print(f"Found {len(img_entries)} images in {folder_path}.")
 
@@ -45,35 +147,69 @@ def load_image_series_from_folder(folder_path: str, cloud: bool = False, min_hou
         print(f"Not enough images for {min_hours} hours (need >{min_index}, got {len(img_entries)}).")
         return None
 
-    images = []
+    if not cloud and inference_settings.frame_store:
+        # frames decoded at upload are read from the series' frame store
+        return FrameSeries(series_frame_store(folder_path, img_entries).frames())
+
     if cloud:
-        for blob in img_entries:
-            img = load_image_from_source(None, gcs_blob=blob)
-            images.append(img)
-    else:
-        for img_name in img_entries:
-            img_path = os.path.join(folder_path, img_name)
-            img = load_image_from_source(img_path)
-            images.append(img)
-            
-            
-    return torch.stack(images)
+        return FrameSeries(decode_frames(img_entries, cloud=True, dtype=torch.uint8))
+    return FrameSeries(decode_frames([os.path.join(folder_path, img_name) for img_name in img_entries], dtype=torch.uint8))
+
+
+def load_image_series_from_folder(folder_path: str, cloud: bool = False, min_hours: int = 6, img_entries=None) -> torch.Tensor:
+    frame_series = load_frame_series(folder_path, cloud=cloud, min_hours=min_hours, img_entries=img_entries)
+    return frame_series.to_tensor() if frame_series is not None else None
+
+
+def series_frame_store(folder_path: str, img_entries=None) -> FrameStore:
+    """The frame store of a local series, after decoding the frames it does not have yet."""
+    if img_entries is None:
+        img_entries = list_image_entries(folder_path)
+    store = FrameStore(folder_path, (3, *FRAME_SIZE))
+    return store.sync(
+        img_entries,
+        lambda names: decode_frames([os.path.join(folder_path, name) for name in names], dtype=torch.uint8).numpy(),
+    )
+
+
+def update_series_profile(folder_path: str, img_entries=None) -> DeltaEProfile:
+    """Brings the delta-E profile of a local series up to date, decoding only the frames it does not have yet."""
+    if img_entries is None:
+        img_entries = list_image_entries(folder_path)
+
+    def load_frames(start):
+        if inference_settings.frame_store:
+            return FrameSeries(series_frame_store(folder_path, img_entries).frames(start))
+        return FrameSeries(decode_frames([os.path.join(folder_path, name) for name in img_entries[start:]], dtype=torch.uint8))
+
+    return DeltaEProfile(folder_path).update(img_entries, load_frames)
+
+
+def index_uploaded_series(folder_path: str):
+    """Adds the frames uploaded to a local series to its frame store and delta-E profile."""
+    img_entries = list_image_entries(folder_path)
+    if inference_settings.frame_store:
+        series_frame_store(folder_path, img_entries)
+    if inference_settings.incremental_stopping_point:
+        update_series_profile(folder_path, img_entries)
 
 
-def prepare_input_tensor(images: torch.Tensor, method="sliding_window") -> torch.Tensor:
+def prepare_input_tensor(images: torch.Tensor, method="sliding_window", stopping_point=None) -> torch.Tensor:
     """
     Prepares the input tensor for prediction.
 
     Args:
-        images (torch.Tensor): A tensor of shape (T, C, H, W)
+        images (torch.Tensor or FrameSeries): A series of shape (T, C, H, W)
         method (str): Either 'sliding_window' or 'image'
+        stopping_point (int, optional): find_stopping_point of images, computed if not given
 
     Returns:
         torch.Tensor or None: A tensor of shape (1, 5, C, H, W) for 'sliding_window',
                               or (1, C, H, W) for 'image', or None if not enough data.
     """
     
-    stopping_point = find_stopping_point(images, threshold=23, mode="sliding_window")
+    if stopping_point is None:
+        stopping_point = find_stopping_point(images, threshold=23, mode="sliding_window")
     
     # dont make prediction before 6 hours
     if stopping_point < 24: 
@@ -98,3 +234,41 @@ def prepare_input_tensor(images: torch.Tensor, method="sliding_window") -> torch
 
     else:
         raise ValueError(f"Unknown method: {method}")
+
+
+def load_prediction_input_with_stopping_point(folder_path: str, cloud: bool = False, method="sliding_window"):
+    """
+    Like load_prediction_input, but also returns where the input was taken from.
+
+    Returns:
+        tuple: (model input or None, stopping point or None, number of frames in the series)
+    """
+    img_entries = list_image_entries(folder_path, cloud=cloud)
+    # float frames are only built for the stopping point scan, a batch at a time, and the model input
+    image_series = load_frame_series(folder_path, cloud=cloud, img_entries=img_entries)
+    if image_series is None:
+        return None, None, 0
+
+    if cloud or not inference_settings.incremental_stopping_point:
+        stopping_point = find_stopping_point(image_series, threshold=23, mode="sliding_window")
+    else:
+        # the upload already added its frame to the profile, so this is a lookup
+        profile = DeltaEProfile(folder_path).update(img_entries, image_series.frames_from)
+        stopping_point = profile.stopping_point(threshold=23)
+    input_tensor = prepare_input_tensor(image_series, method=method, stopping_point=stopping_point)
+    return input_tensor, stopping_point, len(image_series)
+
+
+def load_prediction_input(folder_path: str, cloud: bool = False, method="sliding_window"):
+    """
+    Loads a stored image series and prepares the model input for it.
+
+    Args:
+        folder_path (str): Local folder or gs:// prefix of the series
+        cloud (bool): Whether folder_path is in Google Cloud Storage
+        method (str): Either 'sliding_window' or 'image', see prepare_input_tensor
+
+    Returns:
+        torch.Tensor or None: The model input, or None if there is not enough data yet.
+    """
+    return load_prediction_input_with_stopping_point(folder_path, cloud=cloud, method=method)[0]
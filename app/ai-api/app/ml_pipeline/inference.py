@@ -1,48 +1,76 @@
+import threading
 import torch
-from collections import Counter
-from ml_models.model_registry.CNN_LSTM import CNNLSTMModel
-from ml_models.model_registry.CNN_concentration import ConcentrationClassifier
+from app.core.config import inference_settings
+from app.ml_pipeline.registry import model_registry, CONCENTRATION_MODEL
+from app.ml_pipeline.features import FRAME_SIZE
+from app.ml_pipeline.ensemble import FoldEnsemble, tensor_majority_vote, create_early_exit
 import torch.nn.functional as F
-import numpy as np
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# below this first tier confidence a sample gets no second tier prediction
+FIRST_TIER_MIN_CONFIDENCE = 0.6
 
-def load_ensemble_models(mode, num_folds=5, model_class=None, num_classes=5):
+# first tier class -> (second tier ensemble, offset into the final label map)
+SECOND_TIER_ENSEMBLES = {
+    1: ("ef_kp", 1),      # efaecalis/kpneumoniae
+    2: ("eh_ss", 3),      # ssaprophyticus/ehormaechei
+    3: ("pa_pm_sa", 5),   # paeruginosa/pmirabilis/saureus
+}
+
+# first tier classes that are already final
+SECOND_TIER_FIXED = {
+    0: 0,   # sterile
+    4: 8,   # Ecoli
+}
+
+# policy under which the fold votes stop before the last fold, None runs every fold
+early_exit = create_early_exit(inference_settings)
+
+# samples a student predicts with less confidence are voted on by its fold ensemble
+student_min_confidence = inference_settings.student_min_confidence
+
+
+class InputBuffers(threading.local):
     """
-    Load the ensemble models for a given mode and number of folds.
+    Per-thread preallocated input tensors for the fixed frame shape.
+
+    Batches that need a copy before a forward (second tier groups, inputs on
+    another device) are written into these buffers instead of a fresh
+    allocation. A buffer grows to the largest batch seen and is only valid
+    until the next call with the same name on the same thread, so nothing that
+    comes out of predict() may reference it.
     """
-    fold_models = []
-    map_location = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    
-    ######################################################
-    # This is the inference method for the moodels. We 
-    # load the models and have a two tier classification. 
-    # First a rough classification is done into the main 
-    # color groups and then a second classification is done
-    # for the subgroups. The results are saved in a confusion
-    # matrix and the accuracy is printed.
-    ######################################################
-    for fold in range(1, num_folds + 1):
-        
-        model_path =  f"/app/ml_models/species_models/{mode}_fold{fold}.pth"
-        model = model_class(cnn_feature_size=64, hidden_size=128, num_classes=num_classes).to(map_location)
-        model.load_state_dict(torch.load(model_path, weights_only=True, map_location=map_location), strict=True)
-        model.eval()
-        fold_models.append(model)
-        
-    return fold_models
 
+    def __init__(self, batch_size=8, sequence_length=5):
+        self._buffers = {
+            "input_window": torch.empty((batch_size, sequence_length, 3, *FRAME_SIZE), device=device),
+            "group_window": torch.empty((batch_size, sequence_length, 3, *FRAME_SIZE), device=device),
+            "input_image": torch.empty((batch_size, 3, *FRAME_SIZE), device=device),
+        }
+
+    def get(self, name, shape):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape[1:] != shape[1:] or buffer.size(0) < shape[0]:
+            capacity = max(shape[0], buffer.size(0)) if buffer is not None and buffer.shape[1:] == shape[1:] else shape[0]
+            buffer = torch.empty((capacity, *shape[1:]), device=device)
+            self._buffers[name] = buffer
+        return buffer[:shape[0]]
 
-def load_concentration_model(model_class=ConcentrationClassifier, num_classes=2):
-   
-    map_location = torch.device("cuda" if torch.cuda.is_available() else "cpu") 
-    model_path =  f"/app/ml_models/concentration_models/binary_concentration_classifier.pth"
-    model = model_class(num_classes=num_classes).to(map_location)
-    model.load_state_dict(torch.load(model_path, weights_only=True, map_location=map_location), strict=True)
-    model.eval()
+    def stage(self, name, images):
+        """Returns `images` on the inference device, copied into a buffer if it lives elsewhere."""
+        if images.device == device:
+            return images
+        return self.get(name, images.shape).copy_(images)
 
-    return model
+    def gather(self, name, images, indices):
+        """images[indices] written into a buffer instead of a new tensor."""
+        buffer = self.get(name, (len(indices), *images.shape[1:]))
+        index = torch.tensor(indices, device=images.device)
+        return torch.index_select(images, 0, index, out=buffer)
+
+
+input_buffers = InputBuffers()
 
 
 def majority_vote_with_confidence(fold_models, images):
@@ -53,65 +81,109 @@ def majority_vote_with_confidence(fold_models, images):
         voted_preds: List[int] - the final predicted class per sample
         confidences: List[float] - the confidence (probability) of that prediction
     """
-    fold_predictions = []
-    fold_confidences = []
+    if not isinstance(fold_models, FoldEnsemble):
+        fold_models = FoldEnsemble(fold_models)
 
-    for model in fold_models:
-        outputs = model(images)  # shape: (batch_size, num_classes)
-        probs = F.softmax(outputs, dim=1)  # get probability distribution
+    fold_logits = fold_models.fold_logits(images)  # shape: (num_folds, batch_size, num_classes)
+    probs = F.softmax(fold_logits, dim=2)  # get probability distribution
 
-        # Predictions and confidences
-        confs, preds = torch.max(probs, 1)  # max confidence and corresponding class
+    # Predictions and confidences per fold
+    fold_confs, fold_preds = torch.max(probs, 2)
 
-        fold_predictions.append([int(p) for p in preds.cpu().numpy()])
-        fold_confidences.append(confs.detach().cpu().numpy())  # still float32
+    # majority vote, confidence = mean of the confidence scores for the winning class
+    voted_preds, avg_confidences = tensor_majority_vote(fold_preds, fold_logits.size(2), fold_confs)
 
-    batch_size = images.size(0)
-    voted_preds = []
-    avg_confidences = []
+    return voted_preds.tolist(), avg_confidences.tolist()
 
-    for j in range(batch_size):
-        # gather predictions for this sample from all folds
-        sample_preds = [fold_predictions[f][j] for f in range(len(fold_models))]
 
-        # majority vote
-        most_common = Counter(sample_preds).most_common(1)[0][0]
-        voted_preds.append(int(most_common))
-
-        # confidence = average of the confidence scores for the predicted class
-        confidences_for_most_common = [
-            fold_confidences[f][j]
-            for f in range(len(fold_models))
-            if fold_predictions[f][j] == most_common
-        ]
+def majority_vote(fold_models, images):
+    """
+    Perform majority voting on the predictions from the ensemble of models.
+    """
+    if not isinstance(fold_models, FoldEnsemble):
+        fold_models = FoldEnsemble(fold_models)
 
-        # mean confidence for the winning class
-        mean_conf = float(np.mean(confidences_for_most_common))
-        avg_confidences.append(mean_conf)
+    fold_logits = fold_models.fold_logits(images)
+    _, fold_preds = torch.max(fold_logits, 2)
 
-    return voted_preds, avg_confidences
+    voted_preds, _ = tensor_majority_vote(fold_preds, fold_logits.size(2))
+    return voted_preds.tolist()
 
 
-def majority_vote(fold_models, images):
+def early_exit_vote_with_confidence(fold_models, images, policy, gate=None):
     """
-    Perform majority voting on the predictions from the ensemble of models.
+    majority_vote_with_confidence() with the folds evaluated in sequence only
+    until `policy` decides the vote, and the side of the confidence `gate` if
+    one is given. Also returns how many folds ran per sample.
     """
-    fold_predictions = []
-    for model in fold_models:
-        outputs = model(images)
-        _, predicted = torch.max(outputs, 1)
-        # Convert to list of native Python ints
-        native_int_preds = [int(p) for p in predicted.cpu().numpy()]
-        fold_predictions.append(native_int_preds)
+    voted_preds, mean_confs, folds_evaluated = policy.vote(fold_models, images, gate)
+    return voted_preds.tolist(), mean_confs.tolist(), folds_evaluated.tolist()
 
+
+def tier_vote(mode, images, policy=None, with_confidence=True, gate=None):
+    """
+    Vote of one classification tier for every sample of `images`.
+
+    If the registry holds a student of ensemble `mode`, the student answers every
+    sample it predicts with at least `student_min_confidence`, and only the other
+    samples are voted on by the fold ensemble, under the early exit `policy` if
+    one is set. Early exit also waits until the confidence of a sample is
+    fixed on one side of `gate`, the threshold the caller compares it against.
+
+    Returns:
+        preds: List[int] - the predicted class per sample
+        confidences: List[float] - the confidence of that prediction, None without `with_confidence`
+        folds_evaluated: List[int] - ensemble folds that ran per sample, 0 where the student answered
+        exited_early: List[bool] - whether the ensemble vote stopped before its last fold
+        fell_back: List[bool] - whether a student was loaded but the ensemble had to vote
+    """
     batch_size = images.size(0)
-    voted_preds = []
-    for j in range(batch_size):
-        sample_preds = [fold_predictions[f][j] for f in range(len(fold_models))]
-        most_common = Counter(sample_preds).most_common(1)[0][0]
-        
-        voted_preds.append(int(most_common))
-    return voted_preds
+    preds = [None] * batch_size
+    confidences = [None] * batch_size
+    folds_evaluated = [0] * batch_size
+    exited_early = [False] * batch_size
+    fell_back = [False] * batch_size
+
+    ensemble_samples = list(range(batch_size))
+    student = model_registry.get_student(mode)
+    if student is not None:
+        student_confs, student_preds = torch.max(F.softmax(student(images), dim=1), 1)
+        for i, (pred, conf) in enumerate(zip(student_preds.tolist(), student_confs.tolist())):
+            if conf >= student_min_confidence:
+                preds[i], confidences[i] = pred, conf
+            else:
+                fell_back[i] = True
+        ensemble_samples = [i for i in range(batch_size) if fell_back[i]]
+        if not ensemble_samples:
+            return preds, confidences, folds_evaluated, exited_early, fell_back
+        if len(ensemble_samples) < batch_size:
+            images = input_buffers.gather("fallback_window", images, ensemble_samples)
+
+    fold_models = model_registry.get(mode)
+    if policy is not None:
+        ensemble_preds, ensemble_confs, folds = early_exit_vote_with_confidence(fold_models, images, policy, gate)
+    elif with_confidence:
+        ensemble_preds, ensemble_confs = majority_vote_with_confidence(fold_models, images)
+        folds = [len(fold_models)] * len(ensemble_preds)
+    else:
+        ensemble_preds = majority_vote(fold_models, images)
+        ensemble_confs = [None] * len(ensemble_preds)
+        folds = [len(fold_models)] * len(ensemble_preds)
+
+    for j, i in enumerate(ensemble_samples):
+        preds[i], confidences[i] = ensemble_preds[j], ensemble_confs[j]
+        folds_evaluated[i] = folds[j]
+        exited_early[i] = folds[j] < len(fold_models)
+    return preds, confidences, folds_evaluated, exited_early, fell_back
+
+
+def add_vote_flags(result, policy, exited_early, folds_evaluated, fell_back):
+    if policy is not None:
+        result["early_exit"] = unwrap_if_singleton(exited_early)
+        result["folds_evaluated"] = unwrap_if_singleton(folds_evaluated)
+    if model_registry.students:
+        result["student_fallback"] = unwrap_if_singleton(fell_back)
+    return result
 
 
 def unwrap_if_singleton(x):
@@ -120,9 +192,12 @@ def unwrap_if_singleton(x):
     return x
 
 
+@torch.inference_mode()
 def predict(images: torch.Tensor, task="species", use_two_stage: bool = True):
     """
     Predicts using either only the first-tier or both tiers of the classification model.
+    The whole call runs in a single torch.inference_mode context, so no autograd
+    graph is recorded for any of the forwards.
     
     Args:
         images (torch.Tensor): A batch of images for classification.
@@ -131,6 +206,9 @@ def predict(images: torch.Tensor, task="species", use_two_stage: bool = True):
                               
     Returns:
         dict: Dictionary containing predictions from the first tier, and optionally from the second tier.
+              With early exit enabled it also flags whether a vote stopped before its last
+              fold ("early_exit") and how many folds ran over both tiers ("folds_evaluated"),
+              with students enabled whether a student fell back to its ensemble ("student_fallback").
     """
     if task == "species":
         
@@ -154,66 +232,63 @@ def predict(images: torch.Tensor, task="species", use_two_stage: bool = True):
             8: 'Ecoli'
         }
             
-        # Load First-tier models
-        first_models = load_ensemble_models(mode='first_classification', num_folds=5, model_class=CNNLSTMModel, num_classes=5)
-        first_preds, first_preds_conf = majority_vote_with_confidence(first_models, images)
+        images = input_buffers.stage("input_window", images)
+
+        # First-tier models
+        policy = early_exit
+        first_preds, first_preds_conf, folds_evaluated, exited_early, fell_back = tier_vote(
+            "first_classification", images, policy, gate=FIRST_TIER_MIN_CONFIDENCE
+        )
     
-        # check if the first tier confidence is too low
-        if first_preds_conf and first_preds_conf[0] < 0.6:
-            return {
-                "first_tier_preds": unwrap_if_singleton(first_preds),
-                "second_tier_preds":  None,
-                "first_tier_labels": unwrap_if_singleton([first_label_map[pred] for pred in first_preds]),
-                "final_preds": None 
-            }
+        # the second tier only runs for samples whose first tier confidence is high enough
+        confident = [conf >= FIRST_TIER_MIN_CONFIDENCE for conf in first_preds_conf]
 
         if not use_two_stage:
-            return {
+            result = {
                 "first_tier_preds": unwrap_if_singleton(first_preds),
                 "second_tier_preds":  None,
                 "first_tier_labels": unwrap_if_singleton([first_label_map[pred] for pred in first_preds]),
                 "final_preds": None 
             }
+            return add_vote_flags(result, policy, exited_early, folds_evaluated, fell_back)
 
-        # Load Second-tier models
-        ef_kp_models = load_ensemble_models('ef_kp', num_folds=5, model_class=CNNLSTMModel, num_classes=2)
-        eh_ss_models = load_ensemble_models('eh_ss', num_folds=5, model_class=CNNLSTMModel, num_classes=2)
-        pa_pm_sa_models = load_ensemble_models('pa_pm_sa', num_folds=5, model_class=CNNLSTMModel, num_classes=3)
-
-        second_preds = []
+        second_preds = [None] * len(first_preds)
         
         for i, first_pred in enumerate(first_preds):
-            img = images[i].unsqueeze(0).to(device)
-
-            if first_pred == 1:   # efaecalis/kpneumoniea
-                second = majority_vote(ef_kp_models, img)[0] + 1
-            elif first_pred == 2: # ssaprophyticus/ehormaechei
-                second = majority_vote(eh_ss_models, img)[0] + 3
-            elif first_pred == 3: # paeruginosa/pmirabilis/saureus
-                second = majority_vote(pa_pm_sa_models, img)[0] + 5
-            elif first_pred == 0:
-                second = 0        # sterile
-            elif first_pred == 4:
-                second = 8        # Ecoli
-            else:
+            if not confident[i]:
+                continue
+            if first_pred in SECOND_TIER_FIXED:
+                second_preds[i] = SECOND_TIER_FIXED[first_pred]
+            elif first_pred not in SECOND_TIER_ENSEMBLES:
                 raise ValueError("Invalid first-tier prediction")
 
-            second_preds.append(second)
+        # Second-tier: every sub-ensemble runs once over all samples routed to it
+        for first_class, (mode, offset) in SECOND_TIER_ENSEMBLES.items():
+            group = [i for i, first_pred in enumerate(first_preds) if confident[i] and first_pred == first_class]
+            if not group:
+                continue
+
+            group_images = input_buffers.gather("group_window", images, group)
+            group_preds, _, group_folds, group_exited_early, group_fell_back = tier_vote(
+                mode, group_images, policy, with_confidence=False
+            )
+
+            for j, i in enumerate(group):
+                second_preds[i] = group_preds[j] + offset
+                folds_evaluated[i] += group_folds[j]
+                exited_early[i] = exited_early[i] or group_exited_early[j]
+                fell_back[i] = fell_back[i] or group_fell_back[j]
             
-        return {
+        result = {
             "first_tier_preds": unwrap_if_singleton(first_preds),
             "second_tier_preds": unwrap_if_singleton(second_preds),
             "first_tier_labels": unwrap_if_singleton([first_label_map[pred] for pred in first_preds]),
-            "final_preds": unwrap_if_singleton([final_label_map[pred] for pred in second_preds])   
+            "final_preds": unwrap_if_singleton([final_label_map.get(pred) for pred in second_preds])   
         }
+        return add_vote_flags(result, policy, exited_early, folds_evaluated, fell_back)
         
     elif task == "concentration":
         
-        concentration_map = {
-            1: "high",
-            0: "low"
-        }
-        
         # If a batch of images is passed, select the last one
         if images.dim() == 4:  # Shape: [N, C, H, W]
             image = images[-1]  # Last image in the sequence
@@ -222,30 +297,53 @@ def predict(images: torch.Tensor, task="species", use_two_stage: bool = True):
         else:
             raise ValueError("Expected image tensor with shape [C, H, W] or [N, C, H, W].")
 
-        model = load_concentration_model(num_classes=2)
+        return predict_concentration(image.unsqueeze(0))[0]  # Add batch dimension
+
 
-        img = image.unsqueeze(0).to(device)  # Add batch dimension
+@torch.inference_mode()
+def predict_concentration(images: torch.Tensor) -> list:
+    """
+    Concentration prediction for every image of a [N, C, H, W] batch.
 
-        output = model(img)  # Raw logits
+    Returns:
+        list: One {"concentration", "confidence"} dict per image.
+    """
+    concentration_map = {
+        1: "high",
+        0: "low"
+    }
 
-        probs = torch.softmax(output, dim=1)
-        confidence, predicted = torch.max(probs, 1)
-        
-        native_int_preds = predicted.cpu().item() 
-        confidence_score = confidence.cpu().item()
-     
-        return {
-            "concentration": concentration_map.get(native_int_preds),
-            "confidence": confidence_score
-        }
+    model = model_registry.get(CONCENTRATION_MODEL)
 
+    img = input_buffers.stage("input_image", images)
 
-        
-        
-        
+    output = model(img)  # Raw logits
 
+    probs = torch.softmax(output, dim=1)
+    confidence, predicted = torch.max(probs, 1)
 
+    return [
+        {
+            "concentration": concentration_map.get(native_int_pred),
+            "confidence": confidence_score
+        }
+        for native_int_pred, confidence_score in zip(predicted.cpu().tolist(), confidence.cpu().tolist())
+    ]
 
 
+def predict_per_sample(images: torch.Tensor, task="species", use_two_stage: bool = True) -> list:
+    """
+    Same predictions as predict(), but as one result dict per sample of the batch:
+    species windows of shape [N, 5, C, H, W] or concentration images of shape [N, C, H, W].
+    """
+    if task == "concentration":
+        return predict_concentration(images)
 
+    result = predict(images, task=task, use_two_stage=use_two_stage)
+    if images.size(0) == 1:
+        return [result]
 
+    return [
+        {key: value[i] if isinstance(value, list) else value for key, value in result.items()}
+        for i in range(images.size(0))
+    ]
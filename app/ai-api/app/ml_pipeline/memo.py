@@ -0,0 +1,215 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from app.core.config import inference_settings
+from app.ml_pipeline.backends import ensemble_checkpoint_paths, concentration_checkpoint_path, student_path, student_name
+from app.ml_pipeline.registry import model_registry, SPECIES_ENSEMBLES
+from ml_models.artifacts import checkpoint_hash
+from ml_models.bundle import open_bundle, model_key
+
+logger = logging.getLogger("uvicorn")
+
+# Memo of finished predictions, one entry per series (qr_data, date) and task.
+#
+# find_stopping_point returns the first frame that differs from the first frame
+# of the series, and the last frame when none does yet. Once it has returned a
+# frame before the last one, frames uploaded later can no longer move it, so
+# the window (species) or frame (concentration) that is predicted and the
+# prediction itself are final for the models that made it. From then on the
+# series does not have to be decoded or predicted again: its response is stored
+# together with the stopping point, under the model version, and returned as is.
+#
+# The model version is a hash of the checkpoints, of the runtime each loaded
+# model is served on and of every other setting that changes predictions, so
+# retrained models or a different runtime, early exit or student setting never
+# see responses memoized by other models. It is computed once at startup, on
+# the inference executor, where the models are loaded.
+
+
+def _checkpoint_digest(path, settings):
+    """SHA-256 of a checkpoint, or None if it is missing (its model is unavailable)."""
+    if settings.model_bundle:
+        entry = open_bundle(settings.model_bundle).header["models"].get(model_key(path, settings.model_dir))
+        return entry["sha256"] if entry is not None else None
+    return checkpoint_hash(path) if os.path.exists(path) else None
+
+
+def model_version(settings=inference_settings, runtimes=None) -> str:
+    """
+    Short hash of the model checkpoints, of the runtime of every loaded model
+    (`runtimes`, by default those of the model registry, so INT8, bf16 and
+    student models only count if they are actually served) and of the other
+    settings that affect predictions.
+    """
+    if runtimes is None:
+        runtimes = model_registry.backend.runtimes
+    paths = [path for mode in SPECIES_ENSEMBLES for path in ensemble_checkpoint_paths(mode)]
+    paths.append(concentration_checkpoint_path())
+    paths.extend(student_path(mode) for mode in SPECIES_ENSEMBLES if student_name(mode) in runtimes)
+
+    payload = {
+        "checkpoints": {os.path.relpath(path, settings.model_dir): _checkpoint_digest(path, settings) for path in paths},
+        "backend": settings.inference_backend,
+        "runtimes": dict(runtimes),
+        "bf16_mode": settings.bf16_mode,
+        "early_exit": [settings.early_exit, settings.early_exit_confidence, settings.early_exit_min_folds],
+        "student_min_confidence": settings.student_min_confidence,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def stopping_point_is_final(stopping_point, num_frames) -> bool:
+    """Whether later frames can no longer move the stopping point (it is not the last frame)."""
+    return stopping_point is not None and stopping_point < num_frames - 1
+
+
+class DiskMemoStore:
+    """One JSON file per memo key in `directory`."""
+
+    name = "disk"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{hashlib.sha256(key.encode()).hexdigest()}.json")
+
+    def _read(self, key):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    # file I/O runs on a thread, off the event loop
+    async def get(self, key):
+        return await asyncio.to_thread(self._read, key)
+
+    async def set(self, key, entry):
+        await asyncio.to_thread(self._write, key, entry)
+
+
+class RedisMemoStore:
+    """Memo entries as JSON strings in redis, shared by every worker and node using it."""
+
+    name = "redis"
+
+    def __init__(self, url, prefix="prediction_memo:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise ImportError("PREDICTION_MEMO=redis needs the redis package (pip install redis)") from e
+        self.client = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+        self.prefix = prefix
+
+    async def get(self, key):
+        value = await self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key, entry):
+        await self.client.set(self.prefix + key, json.dumps(entry))
+
+
+class PredictionMemo:
+    """
+    Final prediction responses per task and series, see the module comment.
+
+    A memo that cannot be read or written only costs the prediction it would
+    have saved: store errors are logged and counted, never raised. Until its
+    model `version` is set (see start_prediction_memo) nothing is looked up or
+    stored.
+    """
+
+    def __init__(self, store, version=None):
+        self.store = store
+        self.version = version
+        self._stats = {}
+
+    def key(self, task, storage, qr_data, date) -> str:
+        return f"{self.version}:{task}:{storage}:{qr_data}:{date}"
+
+    def _task_stats(self, task):
+        return self._stats.setdefault(task, {"hits": 0, "misses": 0, "stores": 0, "errors": 0})
+
+    async def get(self, task, storage, qr_data, date):
+        """The memoized response of the series, or None."""
+        if self.version is None:
+            return None
+        stats = self._task_stats(task)
+        try:
+            entry = await self.store.get(self.key(task, storage, qr_data, date))
+        except Exception as e:
+            logger.warning(f"Prediction memo lookup failed: {e}")
+            stats["errors"] += 1
+            entry = None
+
+        if entry is None:
+            stats["misses"] += 1
+            return None
+        stats["hits"] += 1
+        return entry["response"]
+
+    async def put(self, task, storage, qr_data, date, stopping_point, num_frames, response) -> bool:
+        """Memoizes `response` if it was predicted at a final stopping point, returns whether it did."""
+        if self.version is None or not stopping_point_is_final(stopping_point, num_frames):
+            return False
+
+        stats = self._task_stats(task)
+        try:
+            await self.store.set(
+                self.key(task, storage, qr_data, date), {"stopping_point": stopping_point, "response": response}
+            )
+        except Exception as e:
+            logger.warning(f"Prediction memo store failed: {e}")
+            stats["errors"] += 1
+            return False
+        stats["stores"] += 1
+        return True
+
+    def stats(self) -> dict:
+        tasks = {}
+        for task, stats in self._stats.items():
+            lookups = stats["hits"] + stats["misses"]
+            tasks[task] = dict(stats, hit_rate=stats["hits"] / lookups if lookups else 0.0)
+        return {"store": self.store.name, "tasks": tasks}
+
+
+def create_prediction_memo(settings=inference_settings):
+    """The PredictionMemo configured by PREDICTION_MEMO, or None when predictions are not memoized."""
+    if settings.prediction_memo == "off":
+        return None
+    if settings.prediction_memo == "disk":
+        return PredictionMemo(DiskMemoStore(settings.prediction_memo_dir))
+    if settings.prediction_memo == "redis":
+        return PredictionMemo(RedisMemoStore(settings.prediction_memo_redis_url))
+    raise ValueError(f"Unknown prediction memo {settings.prediction_memo!r}, expected off, disk or redis")
+
+
+prediction_memo = create_prediction_memo()
+
+
+async def start_prediction_memo(executor):
+    """
+    Sets the model version of the prediction memo, hashed on `executor` after
+    the models are loaded there. If it cannot be computed the memo is disabled.
+    """
+    global prediction_memo
+    if prediction_memo is None or prediction_memo.version is not None:
+        return
+    try:
+        prediction_memo.version = await executor.run("memo_version", model_version)
+    except Exception as e:
+        logger.error(f"Prediction memo disabled, the model version could not be computed: {e}")
+        prediction_memo = None
+        return
+    logger.info(f"Prediction memo ({prediction_memo.store.name}) for model version {prediction_memo.version}")
@@ -0,0 +1,188 @@
+import os
+import time
+import threading
+import logging
+import torch
+from app.ml_pipeline.ensemble import FoldEnsemble
+from app.ml_pipeline.feature_cache import FrameFeatureCache
+from app.ml_pipeline.backends import InferenceBackend, create_backend, device, student_name
+from app.core.config import inference_settings
+
+logger = logging.getLogger("uvicorn")
+
+# ensemble name -> number of output classes
+SPECIES_ENSEMBLES = {
+    "first_classification": 5,
+    "ef_kp": 2,
+    "eh_ss": 2,
+    "pa_pm_sa": 3,
+}
+
+CONCENTRATION_MODEL = "concentration"
+
+
+class ModelUnavailableError(RuntimeError):
+    """A model was requested whose checkpoint could not be loaded at startup."""
+
+
+def _current_rss_bytes():
+    """Resident set size of this process, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _tensor_bytes(models):
+    total = 0
+    for model in models:
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelRegistry:
+    """
+    Process-wide store of every model used by the prediction pipeline.
+
+    The species ensembles and the concentration classifier are deserialized
+    once (normally from the FastAPI lifespan) and kept in eval mode, so a
+    prediction only has to look them up. How they are loaded and run is up to
+    the backend (see backends.py). Load time and resident memory are recorded
+    per model and exposed through `report()`.
+
+    Each model is loaded on its own: one that fails to load (e.g. a checkpoint
+    that is not deployed) is logged and reported, and only get() of that model
+    raises ModelUnavailableError, so the other models keep serving.
+
+    With `students` set, the distilled single-model student of each species
+    ensemble is loaded as well, where one was distilled from the current folds.
+
+    With `feature_cache_frames` > 0 each species ensemble whose folds expose
+    their CNN features caches them for that many frames (see feature_cache.py).
+    """
+
+    def __init__(self, backend: InferenceBackend, students=False, feature_cache_frames=0):
+        self.backend = backend
+        self.students = students
+        self.feature_cache_frames = feature_cache_frames
+        self._models = {}
+        self._errors = {}
+        self._stats = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self):
+        # a lazy load from inside predict() must not create the weights as inference
+        # tensors, exporting or tracing them would fail
+        with self._lock, torch.inference_mode(False):
+            if self._loaded:
+                return
+
+            models = {}
+            for mode, num_classes in SPECIES_ENSEMBLES.items():
+                models[mode] = self._timed_load(
+                    mode, lambda: self.backend.load_species_ensemble(mode, num_classes=num_classes)
+                )
+                if models[mode] is not None:
+                    self._attach_feature_cache(mode, models[mode])
+            models[CONCENTRATION_MODEL] = self._timed_load(
+                CONCENTRATION_MODEL, lambda: self.backend.load_concentration_model(CONCENTRATION_MODEL, num_classes=2)
+            )
+            if self.students:
+                for mode, num_classes in SPECIES_ENSEMBLES.items():
+                    if mode in self._errors:
+                        continue
+                    models[student_name(mode)] = self._timed_load(
+                        student_name(mode), lambda: self.backend.load_student(mode, num_classes=num_classes)
+                    )
+            self._models = {name: model for name, model in models.items() if model is not None}
+            self._loaded = True
+
+    def _attach_feature_cache(self, mode, ensemble):
+        if self.feature_cache_frames <= 0:
+            return
+        # TorchScript, INT8 and onnxruntime folds only run end to end
+        if not all(hasattr(model, "extract_features") and hasattr(model, "classify_features") for model in ensemble):
+            logger.info(f"No feature cache for {mode}: its {self.backend.runtimes.get(mode)} folds do not expose CNN features")
+            return
+        ensemble.feature_cache = FrameFeatureCache(len(ensemble), max_frames=self.feature_cache_frames)
+
+    def _timed_load(self, name, loader):
+        rss_before = _current_rss_bytes()
+        start = time.perf_counter()
+        try:
+            loaded = loader()
+        except Exception as e:
+            logger.error(f"Could not load {name}, requests for it will fail: {e}")
+            self._errors[name] = e
+            return None
+        elapsed = time.perf_counter() - start
+        if loaded is None:
+            return None
+        rss_after = _current_rss_bytes()
+        runtime = self.backend.runtimes.get(name)
+
+        models = list(loaded) if isinstance(loaded, FoldEnsemble) else [loaded]
+        self._stats[name] = {
+            "runtime": runtime,
+            "num_models": len(models),
+            "load_time_s": round(elapsed, 4),
+            # INT8 and onnxruntime weights are not exposed as tensors
+            "weights_bytes": _tensor_bytes(models) if runtime in ("eager", "torchscript", "bf16") else None,
+            "rss_delta_bytes": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+        }
+        weights_bytes = self._stats[name]["weights_bytes"]
+        logger.info(
+            f"Loaded {name} ({len(models)} {runtime} model(s)) in {elapsed:.2f}s"
+            + (f", {weights_bytes / 2**20:.1f} MiB of weights" if weights_bytes is not None else "")
+        )
+        return loaded
+
+    def get(self, name):
+        if not self._loaded:
+            self.load()
+        if name in self._errors:
+            raise ModelUnavailableError(f"{name} could not be loaded: {self._errors[name]}") from self._errors[name]
+        return self._models[name]
+
+    def get_student(self, mode):
+        """The student of ensemble `mode`, or None if students are off or it has none (or failed to load)."""
+        if not self._loaded:
+            self.load()
+        return self._models.get(student_name(mode))
+
+    def models(self) -> list:
+        """Every loaded model, with the species ensembles flattened into their folds."""
+        models = []
+        for loaded in self._models.values():
+            models.extend(loaded if isinstance(loaded, FoldEnsemble) else [loaded])
+        return models
+
+    def report(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "device": str(device),
+            "backend": self.backend.name,
+            "rss_bytes": _current_rss_bytes(),
+            "models": dict(self._stats),
+            "unavailable": {name: str(error) for name, error in self._errors.items()},
+            "feature_caches": {
+                name: loaded.feature_cache.stats()
+                for name, loaded in self._models.items()
+                if isinstance(loaded, FoldEnsemble) and loaded.feature_cache is not None
+            },
+        }
+
+
+model_registry = ModelRegistry(
+    create_backend(),
+    students=inference_settings.student_models,
+    feature_cache_frames=inference_settings.feature_cache_frames,
+)
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends
 from app.routers import (
-     prediction, upload
+     prediction, upload, metrics
 )
 from app.core.security import get_api_key
 
@@ -13,3 +13,4 @@ api_router = APIRouter(
 
 api_router.include_router(prediction.router)
 api_router.include_router(upload.router)
+api_router.include_router(metrics.router)
@@ -0,0 +1,55 @@
+from fastapi import APIRouter, status
+from app.ml_pipeline.registry import model_registry
+from app.ml_pipeline.batching import batchers
+from app.ml_pipeline.executor import inference_executor
+from app.ml_pipeline import memo
+from app.utils.memory import process_memory
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+@router.get(
+    "/models/",
+    summary="Load time and resident memory of the loaded models",
+    status_code=status.HTTP_200_OK,
+)
+async def get_model_metrics():
+    return model_registry.report()
+
+
+@router.get(
+    "/batching/",
+    summary="Queue depth and achieved batch sizes of the prediction micro-batchers",
+    status_code=status.HTTP_200_OK,
+)
+async def get_batching_metrics():
+    return {task: batcher.stats() for task, batcher in batchers.items()}
+
+
+@router.get(
+    "/executor/",
+    summary="Pending work, latency, timeouts and rejections of the inference executor",
+    status_code=status.HTTP_200_OK,
+)
+async def get_executor_metrics():
+    return inference_executor.stats()
+
+
+@router.get(
+    "/memory/",
+    summary="Resident memory of this worker, split into pages unique to it and pages shared with other processes",
+    status_code=status.HTTP_200_OK,
+)
+async def get_memory_metrics():
+    return process_memory()
+
+
+@router.get(
+    "/memo/",
+    summary="Hits, misses and stores of the prediction memo",
+    status_code=status.HTTP_200_OK,
+)
+async def get_memo_metrics():
+    if memo.prediction_memo is None:
+        return {"store": None, "tasks": {}}
+    return memo.prediction_memo.stats()
@@ -2,8 +2,10 @@ from fastapi import APIRouter, HTTPException, status, Request, Query
 from app.core.security import get_current_user
 from datetime import datetime
 from fastapi.responses import JSONResponse
-from app.ml_pipeline.inference import predict
-from app.ml_pipeline.features import load_image_series_from_folder, prepare_input_tensor
+from app.ml_pipeline.batching import batched_predict
+from app.ml_pipeline.executor import inference_executor, InferenceQueueFullError
+from app.ml_pipeline.features import load_prediction_input_with_stopping_point
+from app.ml_pipeline import memo
 from app.core.config import secrets_manager
 from typing import Optional
 
@@ -27,22 +29,23 @@ async def predict_species_core(qr_data: str, storage: str = "local", date: Optio
                     
         if storage == "local":
             folder_path = f"storage/uploads/{qr_data}/{input_date}/"
-            image_series = load_image_series_from_folder(folder_path, cloud=False)
+            cloud = False
             
         elif storage == "gcs":
             bucket_name = secrets_manager.security_secrets.get("GCS_BUCKET_NAME")
             folder_path = f"gs://{bucket_name}/uploads/{qr_data}/{input_date}/"
-            image_series = load_image_series_from_folder(folder_path, cloud=True)
-        
-        if image_series is None:
-            return {
-                "message": "Not enough images to make a prediction.",
-                "qr_data": qr_data,
-                "date": input_date,
-                "species": None
-            }
+            cloud = True
+
+        # a series whose stopping point is final keeps its prediction (PREDICTION_MEMO)
+        if memo.prediction_memo is not None:
+            memoized = await memo.prediction_memo.get("species", storage, qr_data, input_date)
+            if memoized is not None:
+                return memoized
 
-        window_input_tensor = prepare_input_tensor(image_series, method="sliding_window")
+        # decoding and the stopping point run on the inference executor
+        window_input_tensor, stopping_point, num_frames = await inference_executor.run(
+            "load", load_prediction_input_with_stopping_point, folder_path, cloud, "sliding_window"
+        )
         
         if window_input_tensor is None:
             return {
@@ -52,11 +55,11 @@ async def predict_species_core(qr_data: str, storage: str = "local", date: Optio
                 "species": None
             }
 
-        result = predict(window_input_tensor, task="species", use_two_stage=True)
+        result = await batched_predict(window_input_tensor, task="species")
         
         species = result.get("final_preds")
         
-        return {
+        response = {
             "first_tier_preds": result.get("first_tier_preds"),
             "first_tier_labels": result.get("first_tier_labels"),
             "second_tier_preds": result.get("second_tier_preds"),
@@ -65,6 +68,14 @@ async def predict_species_core(qr_data: str, storage: str = "local", date: Optio
             "date": input_date,
             "species": species if species else None
         }
+        # only present with EARLY_EXIT / STUDENT_MODELS enabled
+        for key in ("early_exit", "folds_evaluated", "student_fallback"):
+            if key in result:
+                response[key] = result[key]
+
+        if memo.prediction_memo is not None:
+            await memo.prediction_memo.put("species", storage, qr_data, input_date, stopping_point, num_frames, response)
+        return response
         
     except Exception as e:
         print(f"Species prediction error: {e}")
@@ -87,23 +98,22 @@ async def predict_concentration_core(qr_data: str, storage: str = "local", date:
                     
         if storage == "local":
             folder_path = f"storage/uploads/{qr_data}/{input_date}/"
-            image_series = load_image_series_from_folder(folder_path, cloud=False)
+            cloud = False
             
         elif storage == "gcs":
             bucket_name = secrets_manager.security_secrets.get("GCS_BUCKET_NAME")
             folder_path = f"gs://{bucket_name}/uploads/{qr_data}/{input_date}/"
-            image_series = load_image_series_from_folder(folder_path, cloud=True)
-        
-        if image_series is None:
-            return {
-                "message": "Not enough images to make a prediction.",
-                "qr_data": qr_data,
-                "date": input_date,
-                "confidence": None,
-                "concentration": None,
-            }
+            cloud = True
 
-        image_input_tensor = prepare_input_tensor(image_series, method="image")
+        if memo.prediction_memo is not None:
+            memoized = await memo.prediction_memo.get("concentration", storage, qr_data, input_date)
+            if memoized is not None:
+                return memoized
+
+        # decoding and the stopping point run on the inference executor
+        image_input_tensor, stopping_point, num_frames = await inference_executor.run(
+            "load", load_prediction_input_with_stopping_point, folder_path, cloud, "image"
+        )
         
         if image_input_tensor is None:
             return {
@@ -114,18 +124,22 @@ async def predict_concentration_core(qr_data: str, storage: str = "local", date:
                 "concentration": None,
             }
 
-        result = predict(image_input_tensor, task="concentration")
+        result = await batched_predict(image_input_tensor, task="concentration")
         
         confidence = result.get("confidence")
         concentration = result.get("concentration")
 
-        return {
+        response = {
             "message": "Prediction successful",
             "qr_data": qr_data,
             "date": input_date,
             "confidence": confidence,
             "concentration": concentration if concentration else None,
         }
+
+        if memo.prediction_memo is not None:
+            await memo.prediction_memo.put("concentration", storage, qr_data, input_date, stopping_point, num_frames, response)
+        return response
         
     except Exception as e:
         print(f"Concentration prediction error: {e}")
@@ -155,6 +169,10 @@ async def get_species_prediction(
         
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
     except Exception as e:
        print(f"error {e}")
        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
@@ -183,6 +201,10 @@ async def get_concentration_prediction(
         
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e))
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
     except Exception as e:
        print(f"error {e}")
        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
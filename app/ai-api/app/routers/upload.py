@@ -1,8 +1,11 @@
 from fastapi import UploadFile, File, Query, APIRouter, status, Request
 from fastapi.responses import JSONResponse
 from app.core.security import get_current_user
-from app.core.config import secrets_manager
+from app.core.config import secrets_manager, inference_settings
 from app.utils.upload import save_file_locally, upload_image_to_gcs
+from app.ml_pipeline.executor import inference_executor
+from app.ml_pipeline.features import index_uploaded_series
+import os
 from typing import Optional
 from fastapi import Request, HTTPException  
 
@@ -69,6 +72,14 @@ async def upload_image(
             )
             
             message = "Image uploaded locally."
+
+            # decodes the new frame into the series' frame store and adds its delta-E
+            # to the profile, a failure only leaves it to the next prediction request
+            if inference_settings.frame_store or inference_settings.incremental_stopping_point:
+                try:
+                    await inference_executor.run("index", index_uploaded_series, os.path.dirname(file_path))
+                except Exception as e:
+                    print("Frame indexing error:", e)
             
         # try to predict and send results to main backend
         results = await get_results(qr_data, storage=storage)
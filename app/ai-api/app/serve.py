@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import signal
+import ctypes
+import socket
+import logging
+import argparse
+from collections import deque
+import torch
+import uvicorn
+from app.core.config import inference_settings
+from app.utils.memory import memory_report, format_memory_report
+
+# Pre-fork server: the parent loads every model once, binds the listening socket
+# and forks the uvicorn workers, which inherit the loaded models copy-on-write
+# instead of each deserializing its own copy. Workers that exit are replaced.
+#
+#   python -m app.serve --workers 4 [--host 0.0.0.0] [--port 8080] [--share-memory]
+#   python -m app.serve report --pid <parent pid>     # unique vs shared memory per worker
+
+logger = logging.getLogger("uvicorn")
+
+
+def can_preload():
+    """
+    Whether the models can be loaded before forking. onnxruntime sessions and
+    process pools own threads/processes, which a forked worker does not inherit,
+    so with those every worker loads its own models after the fork. The same
+    goes for TorchScript: missing artifacts are traced with a forward, which
+    starts the OpenMP / intra-op thread pools that a forked worker inherits in
+    a broken state.
+    """
+    if inference_settings.inference_backend != "torch":
+        return False, f"the {inference_settings.inference_backend} backend"
+    if inference_settings.executor_kind != "thread":
+        return False, f"the {inference_settings.executor_kind} executor"
+    if inference_settings.model_runtime == "torchscript":
+        return False, "the torchscript runtime"
+    return True, None
+
+
+def preload_models(share_memory=False):
+    from app.ml_pipeline.registry import model_registry
+
+    model_registry.load()
+    if share_memory:
+        # moves the weights into shared memory, so that even pages written after
+        # the fork stay shared (mmap'd checkpoints are shared by the page cache already)
+        for model in model_registry.models():
+            model.share_memory()
+
+
+def warm_up():
+    # Run each model once so first requests do not pay for lazy initialization,
+    # and the worker's memory report reflects the pages inference touches.
+    from app.ml_pipeline.inference import predict
+    from app.ml_pipeline.registry import ModelUnavailableError
+
+    for task, inputs in (("species", torch.zeros(1, 5, 3, 190, 40)), ("concentration", torch.zeros(1, 3, 190, 40))):
+        try:
+            predict(inputs, task=task)
+        except ModelUnavailableError:
+            pass  # logged when the models were loaded
+
+
+PR_SET_PDEATHSIG = 1
+
+
+def run_worker(app, sock, warmup):
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+    # a worker must not outlive the parent that would replace or stop it
+    try:
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    except (OSError, AttributeError):
+        pass
+    if warmup:
+        warm_up()
+    server = uvicorn.Server(uvicorn.Config(app, lifespan="on", log_level="info"))
+    server.run(sockets=[sock])
+
+
+class RespawnPolicy:
+    """
+    How long to wait before replacing a worker that exited: twice as long for
+    every other exit in the last `window_s` seconds, from `first_delay_s` up to
+    `max_delay_s`. After more than `max_crashes` exits in the window (e.g. a
+    worker that fails at startup), None: the server gives up instead of forking
+    in a loop.
+    """
+
+    def __init__(self, max_crashes=5, window_s=60.0, first_delay_s=1.0, max_delay_s=30.0):
+        self.max_crashes = max_crashes
+        self.window_s = window_s
+        self.first_delay_s = first_delay_s
+        self.max_delay_s = max_delay_s
+        self._exits = deque()
+
+    def delay_after_exit(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._exits.append(now)
+        while now - self._exits[0] > self.window_s:
+            self._exits.popleft()
+        if len(self._exits) > self.max_crashes:
+            return None
+        return min(self.first_delay_s * 2 ** (len(self._exits) - 1), self.max_delay_s)
+
+
+def serve(host="0.0.0.0", port=8080, workers=2, preload=True, share_memory=False, warmup=True, respawn=None) -> int:
+    """Runs the pre-fork server until it is stopped, returns its exit status."""
+    from app.main import app
+
+    if preload:
+        preload, reason = can_preload()
+        if not preload:
+            logger.warning(f"Models are loaded per worker with {reason}")
+    if preload:
+        preload_models(share_memory)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = set()
+    stopping = False
+    status_code = 0
+    respawn = respawn or RespawnPolicy()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(app, sock, warmup)
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+    logger.info(f"Pre-fork server {os.getpid()} listening on {host}:{port} with {workers} workers")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if stopping:
+            continue
+
+        delay = respawn.delay_after_exit()
+        if delay is None:
+            logger.error(
+                f"Worker {pid} exited with status {status}, more than {respawn.max_crashes} worker exits "
+                f"in {respawn.window_s:.0f}s, stopping the server"
+            )
+            status_code = 1
+            stop(None, None)
+            continue
+        logger.warning(f"Worker {pid} exited with status {status}, starting a new one in {delay:.0f}s")
+        time.sleep(delay)
+        if not stopping:
+            spawn()
+
+    sock.close()
+    return status_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the ai-api with pre-forked workers sharing the loaded models")
+    subparsers = parser.add_subparsers(dest="command")
+
+    report_parser = subparsers.add_parser("report", help="print the memory of a running pre-fork server")
+    report_parser.add_argument("--pid", type=int, required=True, help="pid of the pre-fork parent")
+    report_parser.add_argument("--json", action="store_true")
+
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--no-preload", dest="preload", action="store_false", help="load the models in every worker")
+    parser.add_argument("--share-memory", action="store_true", help="move the preloaded weights into shared memory")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        report = memory_report(args.pid)
+        print(json.dumps(report) if args.json else format_memory_report(report))
+        return
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    sys.exit(serve(args.host, args.port, args.workers, args.preload, args.share_memory, args.warmup))
+
+
+if __name__ == "__main__":
+    main()
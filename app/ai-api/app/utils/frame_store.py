@@ -0,0 +1,105 @@
+import os
+import json
+import fcntl
+import contextlib
+import numpy as np
+import torch
+
+# per-series frame store, a directory next to the uploaded frames
+STORE_DIR = ".frames"
+STORE_VERSION = 1
+
+
+class FrameStore:
+    """
+    The decoded, cropped and resized frames of a local series as one uint8
+    (T, 3, H, W) array, in upload order, memory-mapped from `folder`/.frames.
+
+    Each frame is decoded once, when it is added, instead of on every request.
+    frames() returns a view on the mapped file, which the page cache shares
+    between requests and workers.
+
+    Frames are only ever appended: a store whose frames are not the first
+    frames of the series (frames removed or inserted before its last one, other
+    frame shape) is rebuilt in a new file, so arrays already mapped by other
+    requests stay valid. The index (frame names) is written after the frames,
+    and frames past its end are overwritten by the next append. Writers hold an
+    exclusive lock on the store, across threads and worker processes.
+    """
+
+    def __init__(self, folder, frame_shape):
+        self.directory = os.path.join(folder, STORE_DIR)
+        self.frame_shape = tuple(frame_shape)
+        self.frame_bytes = int(np.prod(self.frame_shape))
+        self.names = []
+
+    @property
+    def data_path(self):
+        return os.path.join(self.directory, "frames.u8")
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_index(self) -> list:
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return []
+        if index.get("version") != STORE_VERSION or index.get("frame_shape") != list(self.frame_shape):
+            return []
+        return index["frames"]
+
+    def _write_index(self, names):
+        index = {"version": STORE_VERSION, "frame_shape": list(self.frame_shape), "frames": names}
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def sync(self, names, decode) -> "FrameStore":
+        """
+        Brings the store up to the series whose frames, in upload order, are
+        `names`. decode(new_names) returns the (N, 3, H, W) uint8 frames
+        `new_names`, and is only called for frames that are not stored yet.
+        """
+        with self._locked():
+            stored = self._read_index()
+            if names[:len(stored)] != stored:
+                stored = []
+
+            new_names = names[len(stored):]
+            if new_names:
+                frames = np.asarray(decode(new_names), dtype=np.uint8)
+                if frames.shape[1:] != self.frame_shape:
+                    raise ValueError(f"Frames of shape {frames.shape[1:]} in a store of {self.frame_shape} frames")
+                if stored:
+                    with open(self.data_path, "r+b") as f:
+                        f.seek(len(stored) * self.frame_bytes)
+                        f.write(frames.tobytes())
+                else:
+                    tmp_path = f"{self.data_path}.{os.getpid()}.tmp"
+                    frames.tofile(tmp_path)
+                    os.replace(tmp_path, self.data_path)
+                self._write_index(list(names))
+            self.names = list(names)
+        return self
+
+    def frames(self, start=0, end=None) -> torch.Tensor:
+        """(T, 3, H, W) uint8 view on the stored frames[start:end], without reading or copying them."""
+        if not self.names:
+            return torch.empty((0, *self.frame_shape), dtype=torch.uint8)
+        # copy-on-write, so the array is writable for torch without writing to the file
+        data = np.memmap(self.data_path, dtype=np.uint8, mode="c", shape=(len(self.names), *self.frame_shape))
+        return torch.from_numpy(data[start:end])
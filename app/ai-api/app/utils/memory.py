@@ -0,0 +1,78 @@
+import os
+
+# Fields of /proc/<pid>/smaps_rollup (Linux >= 4.14), in kB
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+
+def smaps_rollup(pid="self") -> dict:
+    """Memory counters of a process in bytes, or {} where smaps_rollup is not available."""
+    counters = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                field, _, value = line.partition(":")
+                if field in SMAPS_FIELDS:
+                    counters[field] = int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return {}
+    return counters
+
+
+def process_memory(pid="self") -> dict:
+    """
+    Resident memory of a process split into pages only it maps (unique) and pages
+    it shares with other processes (shared), e.g. copy-on-write pages inherited
+    from a pre-fork parent, shared memory tensors or the page cache of mmap'd weights.
+    PSS charges every shared page to its processes in equal parts.
+    """
+    counters = smaps_rollup(pid)
+    if not counters:
+        return {"pid": pid}
+
+    return {
+        "pid": os.getpid() if pid == "self" else pid,
+        "rss_bytes": counters["Rss"],
+        "pss_bytes": counters["Pss"],
+        "unique_bytes": counters["Private_Clean"] + counters["Private_Dirty"],
+        "shared_bytes": counters["Shared_Clean"] + counters["Shared_Dirty"],
+    }
+
+
+def child_pids(pid) -> list:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory_report(parent_pid) -> dict:
+    """Memory of a pre-fork parent and of each of its workers, plus totals."""
+    parent = process_memory(parent_pid)
+    workers = [process_memory(pid) for pid in child_pids(parent_pid)]
+    processes = [parent] + workers
+    return {
+        "parent": parent,
+        "workers": workers,
+        "total_rss_bytes": sum(p.get("rss_bytes", 0) for p in processes),
+        "total_pss_bytes": sum(p.get("pss_bytes", 0) for p in processes),
+        "total_unique_bytes": sum(p.get("unique_bytes", 0) for p in processes),
+    }
+
+
+def format_memory_report(report: dict) -> str:
+    lines = [f"{'process':<16}{'pid':>8}{'RSS MB':>10}{'PSS MB':>10}{'unique MB':>11}{'shared MB':>11}"]
+    rows = [("parent", report["parent"])] + [(f"worker {i}", w) for i, w in enumerate(report["workers"], 1)]
+    for name, p in rows:
+        if "rss_bytes" not in p:
+            lines.append(f"{name:<16}{p['pid']:>8}  (not available)")
+            continue
+        lines.append(
+            f"{name:<16}{p['pid']:>8}{p['rss_bytes'] / 2**20:>10.1f}{p['pss_bytes'] / 2**20:>10.1f}"
+            f"{p['unique_bytes'] / 2**20:>11.1f}{p['shared_bytes'] / 2**20:>11.1f}"
+        )
+    lines.append(
+        f"{'total':<24}{report['total_rss_bytes'] / 2**20:>10.1f}{report['total_pss_bytes'] / 2**20:>10.1f}"
+        f"{report['total_unique_bytes'] / 2**20:>11.1f}"
+    )
+    return "\n".join(lines)
@@ -0,0 +1,27 @@
+import os
+import re
+import torch
+from app.ml_pipeline.features import load_image_from_source
+
+# Reference series shipped with the repo in tests/test_data, one folder per species
+TEST_DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "..", "tests", "test_data"))
+
+
+def get_time_from_filename(filename):
+    match = re.search(r'time([0-9\.]+)[._]', filename)
+    return float(match.group(1)) if match else 0.0
+
+
+def list_series_dirs(root=TEST_DATA_DIR):
+    return [os.path.join(root, d) for d in sorted(os.listdir(root)) if os.path.isdir(os.path.join(root, d))]
+
+
+def list_series_images(dir_path):
+    img_names = [img_name for img_name in os.listdir(dir_path) if img_name.endswith('.png')]
+    img_names.sort(key=get_time_from_filename)
+    return [os.path.join(dir_path, f) for f in img_names]
+
+
+def load_series(dir_path) -> torch.Tensor:
+    """Loads a reference series as a (T, C, H, W) tensor, ordered by acquisition time."""
+    return torch.stack([load_image_from_source(path) for path in list_series_images(dir_path)])
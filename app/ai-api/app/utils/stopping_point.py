@@ -1,22 +1,115 @@
+import os
+import json
+import fcntl
+import logging
+import tempfile
+import contextlib
 import numpy as np
+import torch
+import torch.nn.functional as F
 from skimage.color import rgb2lab
 
+logger = logging.getLogger("uvicorn")
+
+# per-series delta-E profile, written next to the uploaded frames
+PROFILE_NAME = ".delta_e_profile.npz"
+PROFILE_LOCK_NAME = ".delta_e_profile.lock"
+PROFILE_VERSION = 3
+
+# linear sRGB -> CIE XYZ and the XYZ of the D65 white point (2 degree observer), as in skimage.color
+XYZ_FROM_RGB = torch.tensor([
+    [0.412453, 0.357580, 0.180423],
+    [0.212671, 0.715160, 0.072169],
+    [0.019334, 0.119193, 0.950227],
+])
+D65_WHITE = torch.tensor([0.95047, 1.0, 1.08883])
+# (f(X), f(Y), f(Z)) -> (L + 16, a, b)
+LAB_FROM_F = torch.tensor([
+    [0.0, 116.0, 0.0],
+    [500.0, -500.0, 0.0],
+    [0.0, 200.0, -200.0],
+])
+
+# frames converted and compared at once by find_stopping_point, small enough
+# that an early stopping point does not convert many frames after it
+SCAN_CHUNK_SIZE = 16
+
+
+def rgb_to_lab(images: torch.Tensor) -> torch.Tensor:
+    """
+    CIELAB of a (N, 3, H, W) batch of sRGB images in [0, 1], computed like
+    skimage.color.rgb2lab (D65, 2 degree observer) but for the whole batch in
+    torch. Returns a (N, 3, H, W) tensor of L, a and b.
+    """
+    n, _, h, w = images.shape
+    linear = torch.where(images > 0.04045, images.add(0.055).div_(1.055).pow_(2.4), images / 12.92)
+    # scaled by the white point, as (N, 3, H * W) so the 3x3 transforms are one batched matmul each
+    xyz = (XYZ_FROM_RGB / D65_WHITE.view(3, 1)).to(images) @ linear.reshape(n, 3, h * w)
+    f = torch.where(xyz > 0.008856, xyz.pow(1.0 / 3.0), xyz.mul(7.787).add_(16.0 / 116.0))
+    lab = LAB_FROM_F.to(images) @ f
+    lab[:, 0] -= 16.0
+    return lab.view(n, 3, h, w)
+
+
+def roi_mean_delta_e_batch(reference: torch.Tensor, lab: torch.Tensor, roi_size=10, stride=5) -> torch.Tensor:
+    """
+    roi_mean_delta_e of every (N, 3, H, W) Lab frame of `lab` against `reference`
+    (one (3, H, W) frame, or one per frame), as a (N, rows, columns) tensor.
+    """
+    if lab.size(2) < roi_size or lab.size(3) < roi_size:
+        return lab.new_empty((lab.size(0), 0, 0))
+    delta_E = (lab - reference).pow(2).sum(dim=1).sqrt()
+    return F.avg_pool2d(delta_E.unsqueeze(1), roi_size, stride).squeeze(1)
+
+
+def max_roi_delta_e(reference: torch.Tensor, images: torch.Tensor, roi_size=10, stride=5, chunk_size=SCAN_CHUNK_SIZE) -> torch.Tensor:
+    """(N,) largest ROI mean delta-E of every (3, H, W) RGB frame of `images` against the Lab `reference`."""
+    maxima = []
+    with torch.inference_mode():
+        for start in range(0, len(images), chunk_size):
+            roi_means = roi_mean_delta_e_batch(reference, rgb_to_lab(images[start:start + chunk_size]), roi_size, stride)
+            maxima.append(roi_means.flatten(1).amax(dim=1) if roi_means.numel() else roi_means.new_zeros(roi_means.size(0)))
+    return torch.cat(maxima) if maxima else torch.empty(0)
+
+
+def first_change(reference: torch.Tensor, images: torch.Tensor, threshold, roi_size=10, stride=5, chunk_size=SCAN_CHUNK_SIZE, start=0):
+    """
+    Index of the first (3, H, W) RGB frame of images[start:] with an ROI whose
+    mean delta-E against the Lab `reference` exceeds `threshold`, or None.
+    `images` is only sliced chunk_size frames at a time.
+    """
+    with torch.inference_mode():
+        for begin in range(start, len(images), chunk_size):
+            roi_means = roi_mean_delta_e_batch(reference, rgb_to_lab(images[begin:begin + chunk_size]), roi_size, stride)
+            changed = (roi_means > threshold).flatten(1).any(dim=1).nonzero()
+            if changed.numel():
+                return begin + changed[0].item()
+    return None
+
+
+def roi_mean_delta_e(reference, image, roi_size=10, stride=5) -> np.ndarray:
+    """
+    Mean delta-E (CIE76) between two Lab images of every roi_size x roi_size
+    ROI taken at a `stride` step, as a (rows, columns) array of ROIs.
+
+    The per-pixel delta-E map is computed once, and the ROIs are strided views
+    on it instead of one slice and numpy call per ROI.
+    """
+    h, w = image.shape[:2]
+    if h < roi_size or w < roi_size:
+        return np.empty((0, 0))
+    delta_E = np.sqrt(np.sum((image - reference) ** 2, axis=2))
+    rois = np.lib.stride_tricks.sliding_window_view(delta_E, (roi_size, roi_size))[::stride, ::stride]
+    return rois.mean(axis=(2, 3))
+
+
 def is_significantly_different(prev_image, image, threshold, mode = "sliding_window", roi_size=10, use_stride_size=5):
 
         image = image.permute(1, 2, 0).numpy()
         image = rgb2lab(image)
        
         if mode == "sliding_window":
-            stride = use_stride_size
-            h, w = image.shape[:2]
-            for i in range(0, h-roi_size+1, stride):
-                for j in range(0, w-roi_size+1, stride):
-                    roi_current = image[i:i+roi_size, j:j+roi_size]
-                    roi_prev = prev_image[i:i+roi_size, j:j+roi_size]
-                    delta_E = np.sqrt(np.sum((roi_current - roi_prev) ** 2, axis=2))
-                    roi_mean_delta_E = np.mean(delta_E)
-                    if roi_mean_delta_E > threshold:
-                        return True
+            return bool((roi_mean_delta_e(prev_image, image, roi_size, use_stride_size) > threshold).any())
                     
         elif mode == "random":
             for i in range(0, 50):
@@ -33,31 +126,146 @@ def is_significantly_different(prev_image, image, threshold, mode = "sliding_win
                     
 
 def find_stopping_point(image_tensor, threshold, mode = "sliding_window", use_roi_size=10, use_stride_size=5, use_prev_image=None):
+    """
+    First frame of a (T, 3, H, W) RGB series with a use_roi_size ROI (taken
+    every use_stride_size pixels) whose mean delta-E against the first frame
+    exceeds `threshold`, or the last frame if there is none (yet).
 
-    for index in range(len(image_tensor)):
-        image = image_tensor[index]
-        image = image.permute(1, 2, 0).numpy()
-        image = rgb2lab(image)
-        if index == 0:
-            prev_image = image
-            continue
-        
-        roi_size = use_roi_size
+    The frames are converted to Lab and compared in batches of SCAN_CHUNK_SIZE
+    (see rgb_to_lab). `image_tensor` is only sliced one batch at a time, so it
+    can also be a FrameSeries (app/ml_pipeline/features.py). With
+    use_prev_image the first row of ROIs of each frame is compared with the
+    previous frame instead.
+    """
+    if len(image_tensor) == 0:
+        raise ValueError("find_stopping_point needs at least one frame")
+    if mode != "sliding_window":
+        return len(image_tensor) - 1
 
-        if mode == "sliding_window":
-            stride = use_stride_size
-            h, w = image.shape[:2]
-            for i in range(0, h-roi_size+1, stride):
-                for j in range(0, w-roi_size+1, stride):
-                    roi_current = image[i:i+roi_size, j:j+roi_size]
-                    roi_prev = prev_image[i:i+roi_size, j:j+roi_size]
-                    delta_E = np.sqrt(np.sum((roi_current - roi_prev) ** 2, axis=2))
-                    roi_mean_delta_E = np.mean(delta_E)
-                    if roi_mean_delta_E > threshold:
-                        return index
-                    
-                # if None we are always comparing to the first image to find the stopping point
-                if use_prev_image:
-                    prev_image = image
-      
-    return index
\ No newline at end of file
+    with torch.inference_mode():
+        if not use_prev_image:
+            reference = rgb_to_lab(image_tensor[:1])[0]
+            changed = first_change(reference, image_tensor, threshold, use_roi_size, use_stride_size, start=1)
+            return changed if changed is not None else len(image_tensor) - 1
+
+        for start in range(1, len(image_tensor), SCAN_CHUNK_SIZE):
+            lab = rgb_to_lab(image_tensor[start - 1:start + SCAN_CHUNK_SIZE])
+            roi_means = roi_mean_delta_e_batch(lab[:-1], lab[1:], use_roi_size, use_stride_size)
+            # the reference used to move to the current frame after the first row of
+            # ROIs, so the other rows were compared with the frame itself
+            roi_means[:, 1:] = 0.0
+            changed = (roi_means > threshold).flatten(1).any(dim=1).nonzero()
+            if changed.numel():
+                return start + changed[0].item()
+    return len(image_tensor) - 1
+
+
+def stopping_point_from_profile(profile, threshold) -> int:
+    """find_stopping_point (mode "sliding_window") of a series, from its max ROI delta-E per frame."""
+    changed = np.flatnonzero(np.asarray(profile)[1:] > threshold)
+    return int(changed[0]) + 1 if changed.size else len(profile) - 1
+
+
+class DeltaEProfile:
+    """
+    The largest ROI mean delta-E of every frame of a series against its first
+    frame, kept up to date as frames are uploaded and persisted in `folder`.
+
+    A frame exceeds a threshold in any ROI exactly when its largest ROI mean
+    does, so the stopping point for any threshold is a lookup in the profile
+    (stopping_point_from_profile) instead of a scan of the frames, and so is a
+    sweep over thresholds for recalibration.
+
+    Next to the profile the file holds the Lab version of the first frame and
+    the names of the frames in the profile. Each new frame costs one conversion
+    and comparison. A profile that does not match the series (frames removed or
+    inserted before its last one, other ROI parameters, unreadable file) is
+    discarded and rebuilt from all frames. Updates hold an exclusive lock on the
+    profile, across threads and worker processes, so the upload and prediction
+    stages can update the same series at the same time.
+    """
+
+    def __init__(self, folder, roi_size=10, stride=5):
+        self.path = os.path.join(folder, PROFILE_NAME)
+        self.lock_path = os.path.join(folder, PROFILE_LOCK_NAME)
+        self.params = {"version": PROFILE_VERSION, "roi_size": roi_size, "stride": stride}
+        self.frames = []
+        self.profile = np.empty(0, dtype=np.float32)
+        self.reference = None
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def load(self) -> bool:
+        """Reads the saved profile, returns whether there was a usable one."""
+        try:
+            with np.load(self.path, allow_pickle=False) as state:
+                meta = json.loads(str(state["meta"]))
+                profile, reference = state["profile"], state["reference"]
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            # a truncated or corrupt file (zipfile.BadZipFile, ...) is rebuilt like a missing one
+            logger.warning(f"Could not read the delta-E profile {self.path}, rebuilding it: {e}")
+            return False
+        if meta.get("params") != self.params:
+            return False
+        self.frames, self.profile = meta["frames"], profile
+        self.reference = reference if reference.size else None
+        return True
+
+    def save(self):
+        meta = {"params": self.params, "frames": self.frames}
+        reference = self.reference if self.reference is not None else np.empty(0, dtype=np.float32)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=f"{PROFILE_NAME}.", suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, meta=np.array(json.dumps(meta)), profile=self.profile, reference=reference)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+    def update(self, frame_names, load_frames) -> "DeltaEProfile":
+        """
+        Extends the profile to the series whose frames, in upload order, are
+        `frame_names`. load_frames(start) returns the (T - start, 3, H, W) RGB
+        frames from index `start` on, as a tensor or a FrameSeries, and is only
+        called for frames that are not in the profile yet.
+        """
+        with self._locked():
+            return self._update(frame_names, load_frames)
+
+    def _update(self, frame_names, load_frames) -> "DeltaEProfile":
+        self.load()
+        if frame_names[:len(self.frames)] != self.frames:
+            logger.info(f"Delta-E profile of {os.path.dirname(self.path)} does not match its frames, rebuilding it")
+            self.frames, self.profile, self.reference = [], np.empty(0, dtype=np.float32), None
+
+        start = len(self.frames)
+        if start >= len(frame_names):
+            return self
+
+        frames = load_frames(start)
+        if self.reference is None:
+            with torch.inference_mode():
+                self.reference = rgb_to_lab(frames[:1])[0].numpy()
+        maxima = max_roi_delta_e(torch.from_numpy(self.reference), frames, self.params["roi_size"], self.params["stride"])
+        self.profile = np.concatenate([self.profile, maxima.numpy().astype(np.float32)])
+        self.frames = list(frame_names)
+
+        try:
+            self.save()
+        except OSError as e:
+            logger.warning(f"Could not save the delta-E profile {self.path}: {e}")
+        return self
+
+    def stopping_point(self, threshold) -> int:
+        return stopping_point_from_profile(self.profile, threshold)
@@ -0,0 +1,13 @@
+import time
+import statistics
+
+
+def median_latency_ms(fn, repeats):
+    """Median wall time of `repeats` calls of fn() in ms, after one warm-up call (TorchScript profiles the first runs)."""
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
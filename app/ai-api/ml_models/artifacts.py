@@ -0,0 +1,154 @@
+import os
+import glob
+import hashlib
+import argparse
+import torch
+from ml_models.model_registry.CNN_LSTM import CNNLSTMModel
+from ml_models.model_registry.CNN_concentration import ConcentrationClassifier
+
+# TorchScript and ONNX artifacts of the trained checkpoints.
+#
+# An artifact is named after the SHA-256 of the .pth it was built from, so a
+# retrained checkpoint never picks up a stale artifact, and building is skipped
+# when an artifact for the current checkpoint already exists.
+#
+#   python -m ml_models.artifacts [--format torchscript|onnx] [--model-dir DIR] [--artifact-dir DIR] [--force]
+
+DEFAULT_MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ARTIFACT_DIR = os.path.join(DEFAULT_MODEL_DIR, "compiled")
+
+SEQUENCE_LENGTH = 5
+FRAME_SHAPE = (3, 190, 40)
+CNN_FEATURE_SIZE = 64
+
+
+def checkpoint_hash(checkpoint_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(checkpoint_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def artifact_path(checkpoint_path: str, artifact_dir: str = DEFAULT_ARTIFACT_DIR, variant: str = "torchscript.pt") -> str:
+    name = os.path.splitext(os.path.basename(checkpoint_path))[0]
+    return os.path.join(artifact_dir, f"{name}-{checkpoint_hash(checkpoint_path)[:16]}.{variant}")
+
+
+def onnx_artifact_path(checkpoint_path: str, artifact_dir: str = DEFAULT_ARTIFACT_DIR) -> str:
+    return artifact_path(checkpoint_path, artifact_dir, variant="onnx")
+
+
+def species_example_inputs(device="cpu") -> dict:
+    """Example inputs for every CNNLSTMModel method the inference pipeline calls."""
+    window = torch.rand(1, SEQUENCE_LENGTH, *FRAME_SHAPE, device=device)
+    return {
+        "forward": window,
+        "extract_features": window,
+        "classify_features": torch.rand(1, SEQUENCE_LENGTH, CNN_FEATURE_SIZE, device=device),
+    }
+
+
+def concentration_example_inputs(device="cpu") -> dict:
+    return {"forward": torch.rand(1, *FRAME_SHAPE, device=device)}
+
+
+def trace_model(model: torch.nn.Module, example_inputs: dict) -> torch.jit.ScriptModule:
+    # Traced, not frozen: freezing folds batch norms into the convolutions, which
+    # changes the outputs in the last bits. A trace replays the eager kernels, so
+    # the artifact returns exactly what the eager model returns.
+    model.eval()
+    with torch.inference_mode():
+        return torch.jit.trace_module(model, example_inputs, check_trace=False)
+
+
+def save_artifact(scripted: torch.jit.ScriptModule, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write next to the target and rename, so concurrent workers never load a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.jit.save(scripted, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def export_onnx(model: torch.nn.Module, example_input: torch.Tensor, path: str):
+    """Exports model.forward to ONNX with a dynamic batch axis, input "images" and output "logits"."""
+    model = model.cpu().eval()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (example_input.cpu(),),
+            tmp_path,
+            input_names=["images"],
+            output_names=["logits"],
+            dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=17,
+            dynamo=False,
+        )
+    os.replace(tmp_path, path)
+
+
+def load_or_build_artifact(model, checkpoint_path, example_inputs, artifact_dir=DEFAULT_ARTIFACT_DIR, device="cpu", force=False):
+    """
+    Returns the TorchScript artifact of `model`, which must hold the weights of
+    `checkpoint_path`. The artifact is traced and written to `artifact_dir` when
+    there is none for this checkpoint yet.
+    """
+    path = artifact_path(checkpoint_path, artifact_dir)
+
+    if force or not os.path.exists(path):
+        save_artifact(trace_model(model, example_inputs), path)
+
+    scripted = torch.jit.load(path, map_location=device)
+    scripted.eval()
+    return scripted
+
+
+def _build(model, checkpoint_path, example_inputs, artifact_dir, fmt, force):
+    if fmt == "onnx":
+        path = onnx_artifact_path(checkpoint_path, artifact_dir)
+        if force or not os.path.exists(path):
+            export_onnx(model, example_inputs["forward"], path)
+        return path
+
+    load_or_build_artifact(model, checkpoint_path, example_inputs, artifact_dir, force=force)
+    return artifact_path(checkpoint_path, artifact_dir)
+
+
+def build_all(model_dir=DEFAULT_MODEL_DIR, artifact_dir=DEFAULT_ARTIFACT_DIR, fmt="torchscript", force=False):
+    """
+    Builds the artifact of every species fold and of the concentration classifier.
+    Returns (checkpoint path, artifact path) pairs.
+    """
+    built = []
+
+    for checkpoint_path in sorted(glob.glob(os.path.join(model_dir, "species_models", "*.pth"))):
+        state_dict = torch.load(checkpoint_path, weights_only=True, map_location="cpu")
+        model = CNNLSTMModel(cnn_feature_size=CNN_FEATURE_SIZE, hidden_size=128, num_classes=state_dict["fc.weight"].size(0))
+        model.load_state_dict(state_dict, strict=True)
+        built.append((checkpoint_path, _build(model, checkpoint_path, species_example_inputs(), artifact_dir, fmt, force)))
+
+    for checkpoint_path in sorted(glob.glob(os.path.join(model_dir, "concentration_models", "*.pth"))):
+        state_dict = torch.load(checkpoint_path, weights_only=True, map_location="cpu")
+        model = ConcentrationClassifier(num_classes=state_dict["classifier.weight"].size(0), pretrained=False)
+        model.load_state_dict(state_dict, strict=True)
+        built.append((checkpoint_path, _build(model, checkpoint_path, concentration_example_inputs(), artifact_dir, fmt, force)))
+
+    return built
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build TorchScript or ONNX artifacts of the model checkpoints")
+    parser.add_argument("--format", choices=["torchscript", "onnx"], default="torchscript")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", DEFAULT_MODEL_DIR))
+    parser.add_argument("--artifact-dir", default=os.getenv("ARTIFACT_DIR", DEFAULT_ARTIFACT_DIR))
+    parser.add_argument("--force", action="store_true", help="rebuild artifacts that already exist")
+    args = parser.parse_args()
+
+    for checkpoint_path, path in build_all(args.model_dir, args.artifact_dir, args.format, args.force):
+        print(f"{checkpoint_path} -> {path}")
+
+
+if __name__ == "__main__":
+    main()
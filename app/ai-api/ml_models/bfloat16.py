@@ -0,0 +1,57 @@
+import torch
+import torch.nn as nn
+
+# bfloat16 execution of the fp32 models on CPU.
+#
+# With mode "autocast" the weights stay fp32 and CPU autocast runs the
+# convolutions, matmuls and the LSTM in bfloat16. With mode "weights" the model
+# is converted to bfloat16 once and every op runs on bf16 tensors. Either way
+# inputs and outputs are float32, so the voting code does not change. Only CPUs
+# with native bf16 arithmetic (AVX512-BF16 or AMX) are faster than fp32, elsewhere
+# bf16 is emulated.
+
+BF16_MODES = ("autocast", "weights")
+BF16_CPU_FLAGS = ("avx512_bf16", "amx_bf16")
+
+
+def bf16_supported() -> bool:
+    """Whether the CPU advertises native bfloat16 arithmetic."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return any(flag in line.split() for flag in BF16_CPU_FLAGS)
+    except OSError:
+        pass
+    return False
+
+
+class BFloat16Model(nn.Module):
+    """
+    Wraps a fp32 CNNLSTMModel or ConcentrationClassifier to run in bfloat16.
+
+    Every method the inference pipeline calls (forward, and extract_features /
+    classify_features of a CNNLSTMModel) takes and returns float32 tensors.
+    """
+
+    def __init__(self, model: nn.Module, mode="autocast"):
+        super().__init__()
+        if mode not in BF16_MODES:
+            raise ValueError(f"Unknown bf16 mode {mode!r}, expected one of {BF16_MODES}")
+        self.mode = mode
+        self.model = model.to(torch.bfloat16) if mode == "weights" else model
+
+    def _run(self, fn, x):
+        if self.mode == "autocast":
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                return fn(x).float()
+        return fn(x.to(torch.bfloat16)).float()
+
+    def forward(self, x):
+        return self._run(self.model, x)
+
+    def extract_features(self, x):
+        return self._run(self.model.extract_features, x)
+
+    def classify_features(self, cnn_features):
+        return self._run(self.model.classify_features, cnn_features)
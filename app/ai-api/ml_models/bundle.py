@@ -0,0 +1,209 @@
+import os
+import sys
+import glob
+import json
+import mmap
+import struct
+import argparse
+import torch
+from ml_models.artifacts import DEFAULT_MODEL_DIR, checkpoint_hash
+
+# Single-file bundle of all model checkpoints.
+#
+#   magic    8 bytes   b"BSMB\x00\x00\x00\x01"
+#   length   8 bytes   little-endian size of the header
+#   header   JSON      {"version": 1, "models": {key: {"source", "sha256", "tensors": {name: {dtype, shape, offset, nbytes}}}}}
+#   data     raw tensor bytes, starting at the first multiple of ALIGNMENT after the header;
+#            tensor offsets are relative to it and multiples of ALIGNMENT as well
+#
+# A model key is its checkpoint path relative to the model dir without ".pth",
+# e.g. "species_models/first_classification_fold1". The file is memory-mapped
+# and tensors are views on the mapping, so loading copies nothing and every
+# process on the node reads the same pages of the page cache.
+#
+#   python -m ml_models.bundle build [--model-dir DIR] [--output FILE]
+#   python -m ml_models.bundle validate [--model-dir DIR] [--bundle FILE]
+
+MAGIC = b"BSMB\x00\x00\x00\x01"
+VERSION = 1
+ALIGNMENT = 64
+DEFAULT_BUNDLE_PATH = os.path.join(DEFAULT_MODEL_DIR, "models.bundle")
+
+
+class BundleError(ValueError):
+    """Raised for a malformed bundle, or one that does not match its checkpoints."""
+
+
+def model_key(checkpoint_path: str, model_dir: str) -> str:
+    return os.path.splitext(os.path.relpath(checkpoint_path, model_dir))[0].replace(os.sep, "/")
+
+
+def list_checkpoints(model_dir: str):
+    return sorted(
+        glob.glob(os.path.join(model_dir, "species_models", "*.pth"))
+        + glob.glob(os.path.join(model_dir, "concentration_models", "*.pth"))
+    )
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _data_start(header_length: int) -> int:
+    return _aligned(len(MAGIC) + 8 + header_length)
+
+
+def build_bundle(model_dir: str = DEFAULT_MODEL_DIR, output: str = DEFAULT_BUNDLE_PATH) -> dict:
+    """Packs every checkpoint under `model_dir` into one bundle file and returns its header."""
+    state_dicts = {}
+    header = {"version": VERSION, "models": {}}
+    for checkpoint_path in list_checkpoints(model_dir):
+        key = model_key(checkpoint_path, model_dir)
+        state_dicts[key] = torch.load(checkpoint_path, weights_only=True, map_location="cpu")
+        header["models"][key] = {
+            "source": os.path.relpath(checkpoint_path, model_dir),
+            "sha256": checkpoint_hash(checkpoint_path),
+            "tensors": {},
+        }
+
+    offset = 0
+    for key, state_dict in state_dicts.items():
+        for name, tensor in state_dict.items():
+            offset = _aligned(offset)
+            nbytes = tensor.numel() * tensor.element_size()
+            header["models"][key]["tensors"][name] = {
+                "dtype": str(tensor.dtype).removeprefix("torch."),
+                "shape": list(tensor.shape),
+                "offset": offset,
+                "nbytes": nbytes,
+            }
+            offset += nbytes
+    header_bytes = json.dumps(header).encode()
+    data_start = _data_start(len(header_bytes))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp_path = f"{output}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for key, state_dict in state_dicts.items():
+            for name, tensor in state_dict.items():
+                f.write(b"\0" * (data_start + header["models"][key]["tensors"][name]["offset"] - f.tell()))
+                f.write(tensor.contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    os.replace(tmp_path, output)
+    return header
+
+
+class ModelBundle:
+    """
+    A bundle file mapped into memory.
+
+    The mapping is private (copy-on-write): the tensors returned by state_dict()
+    share the file's page cache with every other process that maps the bundle,
+    and an accidental in-place write only copies the touched page.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise BundleError(f"{path} is not a model bundle")
+        (header_length,) = struct.unpack("<Q", self._mmap[len(MAGIC):len(MAGIC) + 8])
+        self.header = json.loads(self._mmap[len(MAGIC) + 8:len(MAGIC) + 8 + header_length])
+        self._data_start = _data_start(header_length)
+        if self.header.get("version") != VERSION:
+            raise BundleError(f"{path} has unsupported bundle version {self.header.get('version')}")
+
+    def keys(self):
+        return list(self.header["models"])
+
+    def state_dict(self, key: str) -> dict:
+        try:
+            tensors = self.header["models"][key]["tensors"]
+        except KeyError:
+            raise BundleError(f"{self.path} has no model {key}")
+
+        state_dict = {}
+        for name, entry in tensors.items():
+            dtype = getattr(torch, entry["dtype"])
+            offset = self._data_start + entry["offset"]
+            if offset + entry["nbytes"] > len(self._mmap):
+                raise BundleError(f"{key}.{name} lies outside of {self.path}")
+            count = entry["nbytes"] // torch.empty((), dtype=dtype).element_size()
+            if count == 0:
+                state_dict[name] = torch.empty(entry["shape"], dtype=dtype)
+                continue
+            state_dict[name] = torch.frombuffer(
+                self._mmap, dtype=dtype, count=count, offset=offset
+            ).view(entry["shape"])
+        return state_dict
+
+
+_open_bundles = {}
+
+
+def open_bundle(path: str) -> ModelBundle:
+    """The process-wide ModelBundle of `path`, mapped on first use."""
+    if path not in _open_bundles:
+        _open_bundles[path] = ModelBundle(path)
+    return _open_bundles[path]
+
+
+def validate_bundle(path: str = DEFAULT_BUNDLE_PATH, model_dir: str = DEFAULT_MODEL_DIR) -> list:
+    """
+    Checks that the bundle holds exactly the checkpoints under `model_dir`, with
+    identical tensors. Returns the list of problems, empty if the bundle is valid.
+    """
+    problems = []
+    bundle = ModelBundle(path)
+
+    expected = {model_key(checkpoint_path, model_dir): checkpoint_path for checkpoint_path in list_checkpoints(model_dir)}
+    for key in sorted(set(bundle.keys()) - set(expected)):
+        problems.append(f"{key}: in the bundle but has no checkpoint")
+    for key in sorted(set(expected) - set(bundle.keys())):
+        problems.append(f"{key}: checkpoint missing from the bundle")
+
+    for key in sorted(set(expected) & set(bundle.keys())):
+        if bundle.header["models"][key]["sha256"] != checkpoint_hash(expected[key]):
+            problems.append(f"{key}: checkpoint changed since the bundle was built")
+            continue
+        try:
+            bundled = bundle.state_dict(key)
+        except BundleError as e:
+            problems.append(str(e))
+            continue
+        state_dict = torch.load(expected[key], weights_only=True, map_location="cpu")
+        if bundled.keys() != state_dict.keys():
+            problems.append(f"{key}: tensor names differ from the checkpoint")
+            continue
+        for name, tensor in state_dict.items():
+            if bundled[name].dtype != tensor.dtype or not torch.equal(bundled[name], tensor):
+                problems.append(f"{key}.{name}: differs from the checkpoint")
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or validate the single-file model bundle")
+    parser.add_argument("command", choices=["build", "validate"])
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", DEFAULT_MODEL_DIR))
+    parser.add_argument("--bundle", "--output", dest="bundle", default=os.getenv("MODEL_BUNDLE") or DEFAULT_BUNDLE_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        header = build_bundle(args.model_dir, args.bundle)
+        print(f"{args.bundle}: {len(header['models'])} models, {os.path.getsize(args.bundle) / 2**20:.1f} MiB")
+
+    problems = validate_bundle(args.bundle, args.model_dir)
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+    print(f"{args.bundle} is valid")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import os
+import copy
+import json
+import argparse
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from ml_models.artifacts import SEQUENCE_LENGTH, checkpoint_hash
+from ml_models.quantization import checkpoint_hashes
+from app.utils.timing import median_latency_ms
+
+# Single-model students of the species fold ensembles.
+#
+# A student is a CNNLSTMModel trained to reproduce the averaged, temperature
+# softened softmax of its ensemble's folds (knowledge distillation) on the
+# 5-frame windows of stored series, starting from the weights of the first fold.
+# Students are saved next to the folds as species_models/<ensemble>_student.pth,
+# together with a report that records the fold checkpoints each student was
+# distilled from and, measured on series held out from the distillation, its
+# agreement with the ensemble and its fallback rate.
+#
+#   python -m ml_models.distillation [--models ef_kp,eh_ss] [--epochs 5] [--series-dir DIR ...] [--holdout-every 3] [--evaluate-only]
+
+REPORT_NAME = "distillation_report.json"
+
+
+def student_checkpoint_path(model_dir: str, mode: str) -> str:
+    return os.path.join(model_dir, "species_models", f"{mode}_student.pth")
+
+
+class SeriesWindows:
+    """
+    Every window of `sequence_length` consecutive frames of a list of (T, C, H, W)
+    series, gathered batch by batch instead of being stacked up front.
+    """
+
+    def __init__(self, series, sequence_length=SEQUENCE_LENGTH):
+        self.frames = torch.cat(list(series))
+        starts, offset = [], 0
+        for images in series:
+            starts.extend(range(offset, offset + images.size(0) - sequence_length + 1))
+            offset += images.size(0)
+        self.starts = torch.tensor(starts, dtype=torch.long)
+        self.steps = torch.arange(sequence_length)
+
+    def __len__(self):
+        return self.starts.numel()
+
+    def batch(self, indices) -> torch.Tensor:
+        """(len(indices), sequence_length, C, H, W) windows."""
+        return self.frames[self.starts[indices].unsqueeze(1) + self.steps]
+
+    def batches(self, batch_size=32):
+        for start in range(0, len(self), batch_size):
+            yield self.batch(torch.arange(start, min(start + batch_size, len(self))))
+
+
+def teacher_probabilities(fold_models, windows: SeriesWindows, temperature=1.0, batch_size=32) -> torch.Tensor:
+    """(num_windows, num_classes) mean over the folds of softmax(logits / temperature)."""
+    probs = []
+    with torch.inference_mode():
+        for batch in windows.batches(batch_size):
+            fold_logits = torch.stack([model(batch) for model in fold_models])
+            probs.append(F.softmax(fold_logits / temperature, dim=2).mean(dim=0))
+    return torch.cat(probs)
+
+
+def _freeze_batch_norm(model: nn.Module):
+    # a few hundred correlated windows are no basis for new batch statistics,
+    # keep the running estimates of the fold the student starts from
+    for module in model.modules():
+        if isinstance(module, nn.modules.batchnorm._BatchNorm):
+            module.eval()
+
+
+def distill_student(
+    initial_model: nn.Module,
+    teacher_probs: torch.Tensor,
+    windows: SeriesWindows,
+    epochs=5,
+    lr=1e-4,
+    temperature=2.0,
+    batch_size=32,
+    seed=0,
+) -> nn.Module:
+    """
+    Trains a copy of `initial_model` to match `teacher_probs` on `windows`,
+    minimizing the KL divergence between the softened distributions (scaled by
+    temperature**2 so the gradients do not shrink with the temperature).
+    Returns the student in eval mode.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    student = copy.deepcopy(initial_model)
+    for parameter in student.parameters():
+        parameter.requires_grad_(True)
+    optimizer = torch.optim.Adam(student.parameters(), lr=lr)
+
+    for _ in range(epochs):
+        student.train()
+        _freeze_batch_norm(student)
+        for indices in torch.randperm(len(windows), generator=generator).split(batch_size):
+            log_probs = F.log_softmax(student(windows.batch(indices)) / temperature, dim=1)
+            loss = F.kl_div(log_probs, teacher_probs[indices], reduction="batchmean") * temperature**2
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+    return student.eval()
+
+
+def save_student(student: nn.Module, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save({name: tensor.detach().cpu() for name, tensor in student.state_dict().items()}, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def report_path(model_dir: str) -> str:
+    return os.path.join(model_dir, "species_models", REPORT_NAME)
+
+
+def read_report(model_dir: str) -> dict:
+    try:
+        with open(report_path(model_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_report(report: dict, model_dir: str):
+    with open(report_path(model_dir), "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def student_rejection_reason(mode: str, teacher_paths, model_dir: str, min_agreement: float, min_confidence: float):
+    """
+    Why the student of ensemble `mode` must not be served, or None if it was
+    distilled from exactly these fold checkpoints and, falling back to the
+    ensemble below `min_confidence`, agreed with it on at least `min_agreement`
+    of the held-out windows.
+    """
+    student_path = student_checkpoint_path(model_dir, mode)
+    if not os.path.exists(student_path):
+        return "no student, run python -m ml_models.distillation"
+    entry = read_report(model_dir).get("models", {}).get(mode)
+    if entry is None or entry["student"] != checkpoint_hash(student_path):
+        return "student not in the distillation report, run python -m ml_models.distillation"
+    if entry["teachers"] != checkpoint_hashes(teacher_paths):
+        return "distilled from different checkpoints, run python -m ml_models.distillation"
+    if not entry.get("holdout_series"):
+        return "not measured on held-out series, run python -m ml_models.distillation"
+    # a higher threshold only hands more windows to the ensemble, a lower one is not covered by the report
+    if entry["min_confidence"] > min_confidence:
+        return f"agreement measured with fallback below {entry['min_confidence']}, not {min_confidence}"
+    if entry["agreement_with_fallback"] < min_agreement:
+        return f"held-out agreement with the ensemble {entry['agreement_with_fallback']:.4f} is below {min_agreement}"
+    return None
+
+
+def evaluate(ensemble, student, windows: SeriesWindows, num_classes, min_confidence, repeats, batch_size=32) -> dict:
+    """
+    Top-1 agreement of `student` with the majority vote of `ensemble` on
+    `windows`, alone and with the windows it predicts below `min_confidence`
+    handed to the ensemble (fallback), and latency of a single-window forward.
+    """
+    from app.ml_pipeline.ensemble import tensor_majority_vote
+
+    ensemble_preds, student_preds, student_confs = [], [], []
+    with torch.inference_mode():
+        for batch in windows.batches(batch_size):
+            fold_preds = ensemble.fold_logits(batch).argmax(dim=2)
+            ensemble_preds.append(tensor_majority_vote(fold_preds, num_classes)[0])
+            confs, preds = torch.max(F.softmax(student(batch), dim=1), 1)
+            student_preds.append(preds)
+            student_confs.append(confs)
+
+        ensemble_preds, student_preds, student_confs = (
+            torch.cat(ensemble_preds), torch.cat(student_preds), torch.cat(student_confs)
+        )
+        fallback = student_confs < min_confidence
+        combined_preds = torch.where(fallback, ensemble_preds, student_preds)
+
+        window = windows.batch(torch.arange(1))
+        ensemble_ms = median_latency_ms(lambda: ensemble.fold_logits(window), repeats)
+        student_ms = median_latency_ms(lambda: student(window), repeats)
+
+    fallback_rate = fallback.float().mean().item()
+    return {
+        "samples": len(windows),
+        "agreement": (student_preds == ensemble_preds).float().mean().item(),
+        "min_confidence": min_confidence,
+        "fallback_rate": fallback_rate,
+        "agreement_with_fallback": (combined_preds == ensemble_preds).float().mean().item(),
+        "ensemble_latency_ms": ensemble_ms,
+        "student_latency_ms": student_ms,
+        # every request runs the student, the ensemble only after a fallback
+        "expected_latency_ms": student_ms + fallback_rate * ensemble_ms,
+    }
+
+
+def main():
+    # the serving side imports this module, so the app is only imported when run as a script
+    from app.core.config import inference_settings
+    from app.ml_pipeline.ensemble import FoldEnsemble
+    from app.ml_pipeline.registry import SPECIES_ENSEMBLES
+    from app.ml_pipeline.backends import ensemble_checkpoint_paths, load_ensemble_models, load_species_model, student_path
+    from app.utils.series import TEST_DATA_DIR, list_series_dirs, load_series
+
+    parser = argparse.ArgumentParser(description="Distill every species fold ensemble into a single-model student")
+    parser.add_argument("--models", default=",".join(SPECIES_ENSEMBLES))
+    parser.add_argument("--series-dir", action="append", default=[], help="additional folder of series frames")
+    parser.add_argument("--holdout-every", type=int, default=3, help="every n-th series is only used for the agreement")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--min-confidence", type=float, default=inference_settings.student_min_confidence)
+    parser.add_argument("--evaluate-only", action="store_true", help="measure the saved students without distilling")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    # the reference series are only there in a checkout with tests/test_data
+    dir_paths = (list_series_dirs() if os.path.isdir(TEST_DATA_DIR) else []) + args.series_dir
+    if not dir_paths:
+        parser.error(f"no series to distill on: {TEST_DATA_DIR} does not exist, pass --series-dir")
+    held_out = [i % args.holdout_every == args.holdout_every - 1 for i in range(len(dir_paths))]
+    series = [load_series(dir_path) for dir_path in dir_paths]
+    training_windows = SeriesWindows([images for images, hold in zip(series, held_out) if not hold])
+    holdout_windows = SeriesWindows([images for images, hold in zip(series, held_out) if hold])
+    holdout_series = [os.path.basename(os.path.normpath(path)) for path, hold in zip(dir_paths, held_out) if hold]
+
+    report = read_report(inference_settings.model_dir)
+    report.setdefault("models", {})
+
+    for mode in args.models.split(","):
+        num_classes = SPECIES_ENSEMBLES[mode]
+        fold_models = load_ensemble_models(mode, num_classes=num_classes)
+        if not args.evaluate_only:
+            teacher_probs = teacher_probabilities(fold_models, training_windows, args.temperature)
+            student = distill_student(
+                fold_models[0], teacher_probs, training_windows, epochs=args.epochs, lr=args.lr, temperature=args.temperature
+            )
+            save_student(student, student_path(mode))
+
+        student = load_species_model(student_path(mode), num_classes=num_classes)
+        entry = {
+            "teachers": checkpoint_hashes(ensemble_checkpoint_paths(mode)),
+            "student": checkpoint_hash(student_path(mode)),
+            "holdout_series": holdout_series,
+            **evaluate(FoldEnsemble(fold_models), student, holdout_windows, num_classes, args.min_confidence, args.repeats),
+        }
+        entry["temperature"] = report["models"].get(mode, {}).get("temperature") if args.evaluate_only else args.temperature
+        report["models"][mode] = entry
+        write_report(report, inference_settings.model_dir)
+
+    print(
+        f"{'model':<22}{'agreement':>10}{'fallback':>10}{'combined':>10}"
+        f"{'ensemble ms':>13}{'student ms':>12}{'expected ms':>13}"
+    )
+    for name, entry in report["models"].items():
+        print(
+            f"{name:<22}{entry['agreement']:>10.4f}{entry['fallback_rate']:>10.2%}{entry['agreement_with_fallback']:>10.4f}"
+            f"{entry['ensemble_latency_ms']:>13.2f}{entry['student_latency_ms']:>12.2f}{entry['expected_latency_ms']:>13.2f}"
+        )
+    print(f"agreement on the {len(holdout_windows)} windows of the held-out series {', '.join(holdout_series)}")
+
+
+if __name__ == "__main__":
+    main()
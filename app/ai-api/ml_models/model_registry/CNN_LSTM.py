@@ -44,7 +44,7 @@ class CNNExtractor(nn.Module):
         return x
 
 class CNNLSTMModel(nn.Module):
-    def __init__(self, cnn_feature_size=64, hidden_size=128, num_classes=5):
+    def __init__(self, cnn_feature_size=64, hidden_size=128, num_classes=5, time_folded=True):
         super(CNNLSTMModel, self).__init__()
         self.cnn_extractor = CNNExtractor()
         
@@ -53,16 +53,35 @@ class CNNLSTMModel(nn.Module):
         self.fc = nn.Linear(hidden_size, num_classes)
         self.dropout = nn.Dropout(0.5) 
 
-    def forward(self, x):
+        # In eval mode fold the time axis into the batch so the CNN runs once
+        # on (B*T, C, H, W). Training keeps the per-timestep loop so the
+        # BatchNorm batch statistics stay per timestep.
+        self.time_folded = time_folded
+
+    def extract_features(self, x):
+        """Per-frame CNN features: (B, T, C, H, W) -> (B, T, cnn_feature_size)."""
         batch_size, sequence_length, C, H, W = x.size()
+
+        if self.time_folded and not self.training:
+            cnn_features = self.cnn_extractor(x.reshape(batch_size * sequence_length, C, H, W))
+            return cnn_features.view(batch_size, sequence_length, -1)
+
         cnn_features = []
 
         for t in range(sequence_length):
             cnn_out = self.cnn_extractor(x[:, t, :, :, :])
             cnn_features.append(cnn_out)
 
-        cnn_features = torch.stack(cnn_features, dim=1)  
+        return torch.stack(cnn_features, dim=1)
+
+    def classify_features(self, cnn_features):
+        """LSTM and classifier head on precomputed features of shape (B, T, cnn_feature_size)."""
         lstm_out, _ = self.lstm(cnn_features)  
         lstm_out = self.dropout(lstm_out[:, -1, :]) 
         out = self.fc(lstm_out)
         return out
+
+    def forward(self, x=None, cnn_features=None):
+        if cnn_features is None:
+            cnn_features = self.extract_features(x)
+        return self.classify_features(cnn_features)
@@ -4,9 +4,11 @@ import torchvision.models as models
 from collections import Counter
 # --- Model Definition ---
 class ConcentrationClassifier(nn.Module):
-    def __init__(self, num_classes=5):
+    def __init__(self, num_classes=5, pretrained=True):
         super().__init__()
-        base = models.efficientnet_b0(weights=models.EfficientNet_B0_Weights.IMAGENET1K_V1)
+        # pretrained=False skips the ImageNet weights, for when a checkpoint overwrites them anyway
+        weights = models.EfficientNet_B0_Weights.IMAGENET1K_V1 if pretrained else None
+        base = models.efficientnet_b0(weights=weights)
         self.backbone = base.features  # Pretrained EfficientNet feature extractor
         self.pooling = nn.AdaptiveAvgPool2d(1)  # Global average pooling
         self.classifier = nn.Linear(base.classifier[1].in_features, num_classes)
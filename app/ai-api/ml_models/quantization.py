@@ -0,0 +1,101 @@
+import os
+import copy
+import json
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from ml_models.artifacts import artifact_path, checkpoint_hash, trace_model, save_artifact
+
+# INT8 variants of the models for CPU inference.
+#
+# The convolution stacks (CNNExtractor, EfficientNet backbone) are statically
+# quantized: FX fuses conv + batch norm + relu and calibrates the activation
+# ranges on sample frames. The LSTM and the Linear heads are dynamically
+# quantized, their activation ranges are computed per call. Quantized models
+# are stored as TorchScript artifacts next to the fp32 ones (variant "int8"),
+# together with a report of how closely they agree with fp32.
+
+QUANTIZED_ENGINE = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+REPORT_NAME = "int8_report.json"
+
+
+def _static_quantize(module: nn.Module, calibration_frames: torch.Tensor, batch_size=64) -> nn.Module:
+    torch.backends.quantized.engine = QUANTIZED_ENGINE
+    prepared = prepare_fx(module, get_default_qconfig_mapping(QUANTIZED_ENGINE), (calibration_frames[:1],))
+    with torch.inference_mode():
+        for chunk in calibration_frames.split(batch_size):
+            prepared(chunk)
+    return convert_fx(prepared)
+
+
+def quantize_species_model(model: nn.Module, calibration_frames: torch.Tensor) -> nn.Module:
+    """
+    INT8 copy of a CNNLSTMModel.
+
+    Args:
+        model (nn.Module): fp32 CNNLSTMModel in eval mode
+        calibration_frames (torch.Tensor): (N, C, H, W) frames used to calibrate the CNN
+    """
+    quantized = copy.deepcopy(model).eval()
+    quantized.cnn_extractor = _static_quantize(quantized.cnn_extractor, calibration_frames)
+    return quantize_dynamic(quantized, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_concentration_model(model: nn.Module, calibration_frames: torch.Tensor) -> nn.Module:
+    """INT8 copy of a ConcentrationClassifier, see quantize_species_model."""
+    quantized = copy.deepcopy(model).eval()
+    quantized.backbone = _static_quantize(quantized.backbone, calibration_frames)
+    return quantize_dynamic(quantized, {nn.Linear}, dtype=torch.qint8)
+
+
+def int8_artifact_path(checkpoint_path: str, artifact_dir: str) -> str:
+    return artifact_path(checkpoint_path, artifact_dir, variant="int8.pt")
+
+
+def save_int8_artifact(quantized: nn.Module, checkpoint_path: str, example_inputs: dict, artifact_dir: str) -> str:
+    path = int8_artifact_path(checkpoint_path, artifact_dir)
+    save_artifact(trace_model(quantized, example_inputs), path)
+    return path
+
+
+def load_int8_artifact(checkpoint_path: str, artifact_dir: str) -> torch.jit.ScriptModule:
+    torch.backends.quantized.engine = QUANTIZED_ENGINE
+    scripted = torch.jit.load(int8_artifact_path(checkpoint_path, artifact_dir), map_location="cpu")
+    scripted.eval()
+    return scripted
+
+
+def checkpoint_hashes(checkpoint_paths) -> dict:
+    return {os.path.basename(path): checkpoint_hash(path) for path in checkpoint_paths}
+
+
+def read_report(artifact_dir: str) -> dict:
+    try:
+        with open(os.path.join(artifact_dir, REPORT_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_report(report: dict, artifact_dir: str):
+    os.makedirs(artifact_dir, exist_ok=True)
+    with open(os.path.join(artifact_dir, REPORT_NAME), "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def int8_rejection_reason(name: str, checkpoint_paths, artifact_dir: str, min_agreement: float):
+    """
+    Why the INT8 artifacts of model `name` must not be served, or None if they
+    were verified for exactly these checkpoints with at least `min_agreement`.
+    """
+    entry = read_report(artifact_dir).get("models", {}).get(name)
+    if entry is None:
+        return "not verified, run python -m tests.verify_quantization"
+    if entry["checkpoints"] != checkpoint_hashes(checkpoint_paths):
+        return "verified for different checkpoints, run python -m tests.verify_quantization"
+    if entry["agreement"] < min_agreement:
+        return f"top-1 agreement with fp32 {entry['agreement']:.4f} is below {min_agreement}"
+    if not all(os.path.exists(int8_artifact_path(path, artifact_dir)) for path in checkpoint_paths):
+        return "artifacts missing"
+    return None
@@ -0,0 +1,115 @@
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Cold start of the ai-api process: interpreter + imports, model registry load
+# and the first species / concentration prediction, each run in a fresh
+# process. Also compares building the concentration model the old way
+# (ImageNet weights, then copying the checkpoint over them) with the
+# checkpoint-first path (meta device + mmap'd checkpoint).
+#
+#   python -m tests.benchmark_cold_start [--runs 3]
+
+
+def read_status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return None
+
+
+def run_cold_start():
+    start = time.perf_counter()
+    import torch
+    from app.main import app  # noqa: F401  (the service's full import graph)
+    from app.ml_pipeline.inference import predict
+    from app.ml_pipeline.registry import model_registry
+    imported = time.perf_counter()
+
+    model_registry.load()
+    loaded = time.perf_counter()
+
+    predict(torch.rand(1, 5, 3, 190, 40), task="species")
+    predict(torch.rand(1, 3, 190, 40), task="concentration")
+    predicted = time.perf_counter()
+
+    return {
+        "imports_s": imported - start,
+        "registry_load_s": loaded - imported,
+        "first_predictions_s": predicted - loaded,
+        "peak_rss_mb": read_status_kb("VmHWM") / 1024,
+    }
+
+
+def run_concentration(path):
+    import torch
+    from app.ml_pipeline.backends import load_concentration_model, concentration_checkpoint_path, device
+    from ml_models.model_registry.CNN_concentration import ConcentrationClassifier
+
+    start = time.perf_counter()
+    if path == "pretrained":
+        model = ConcentrationClassifier(num_classes=2).to(device)
+        model.load_state_dict(torch.load(concentration_checkpoint_path(), weights_only=True, map_location=device))
+        model.eval()
+    else:
+        load_concentration_model(num_classes=2)
+    return {"load_s": time.perf_counter() - start, "peak_rss_mb": read_status_kb("VmHWM") / 1024}
+
+
+def spawn(*args):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-m", "tests.benchmark_cold_start", *args], capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1]}
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["wall_s"] = wall
+    return report
+
+
+def median_report(reports):
+    if any("error" in report for report in reports):
+        return next(report for report in reports if "error" in report)
+    return {key: statistics.median(report[key] for report in reports) for key in reports[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run", choices=["cold_start", "pretrained", "checkpoint"])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.run == "cold_start":
+        print(json.dumps(run_cold_start()))
+        return
+    if args.run:
+        print(json.dumps(run_concentration(args.run)))
+        return
+
+    cold_start = median_report([spawn("--run", "cold_start") for _ in range(args.runs)])
+    if "error" in cold_start:
+        print(f"cold start failed: {cold_start['error']}")
+    else:
+        print(
+            f"process cold start {cold_start['wall_s']:.2f}s wall: imports {cold_start['imports_s']:.2f}s, "
+            f"registry load {cold_start['registry_load_s']:.2f}s, first predictions {cold_start['first_predictions_s']:.2f}s, "
+            f"peak RSS {cold_start['peak_rss_mb']:.0f} MB"
+        )
+
+    print(f"{'concentration model':<24}{'load s':>8}{'peak RSS MB':>13}")
+    for path in ("pretrained", "checkpoint"):
+        report = median_report([spawn("--run", path) for _ in range(args.runs)])
+        if "error" in report:
+            print(f"{path:<24}failed: {report['error']}")
+        else:
+            print(f"{path:<24}{report['load_s']:>8.3f}{report['peak_rss_mb']:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
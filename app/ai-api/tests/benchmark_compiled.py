@@ -0,0 +1,54 @@
+import os
+import argparse
+import torch
+from app.ml_pipeline.registry import ModelRegistry, SPECIES_ENSEMBLES, CONCENTRATION_MODEL
+from app.ml_pipeline.backends import TorchBackend
+from app.utils.stopping_point import find_stopping_point
+from app.utils.series import list_series_dirs, load_series
+from app.utils.timing import median_latency_ms
+
+# Eager vs TorchScript latency per ensemble on the stopping-point window of each
+# tests/test_data series, and a check that both runtimes return identical outputs.
+# Missing artifacts are built into ARTIFACT_DIR on the first run.
+#
+#   python -m tests.benchmark_compiled [--repeats 20]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    registries = {runtime: ModelRegistry(TorchBackend(runtime=runtime)) for runtime in ("eager", "torchscript")}
+    for registry in registries.values():
+        registry.load()
+
+    print(f"{'series':<16}{'model':<22}{'eager ms':>10}{'torchscript ms':>16}{'speedup':>9}{'identical':>11}")
+    all_identical = True
+    with torch.inference_mode():
+        for dir_path in list_series_dirs():
+            images = load_series(dir_path)
+            stopping_point = find_stopping_point(images, threshold=23, mode="sliding_window")
+            window = images[max(stopping_point - 5, 0):stopping_point].unsqueeze(0)
+            image = images[stopping_point].unsqueeze(0)
+
+            runs = {name: (lambda model: model.fold_logits(window)) for name in SPECIES_ENSEMBLES}
+            runs[CONCENTRATION_MODEL] = lambda model: model(image)
+
+            for name, run in runs.items():
+                eager, compiled = (registries[runtime].get(name) for runtime in ("eager", "torchscript"))
+                identical = torch.equal(run(eager), run(compiled))
+                all_identical &= identical
+
+                eager_ms = median_latency_ms(lambda: run(eager), args.repeats)
+                compiled_ms = median_latency_ms(lambda: run(compiled), args.repeats)
+                print(
+                    f"{os.path.basename(dir_path):<16}{name:<22}{eager_ms:>10.2f}{compiled_ms:>16.2f}"
+                    f"{eager_ms / compiled_ms:>8.2f}x{str(identical):>11}"
+                )
+
+    print("outputs identical" if all_identical else "OUTPUTS DIFFER")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import time
+import argparse
+import statistics
+import torch
+from torchvision import transforms
+from torchvision.transforms import InterpolationMode
+from PIL import Image
+from app.core.config import inference_settings
+from app.ml_pipeline import features
+from app.ml_pipeline.features import FRAME_SIZE, decode_frames
+from app.utils.series import list_series_dirs, list_series_images
+
+# Decoding throughput (frames/s) of an 80-frame series (tests/test_data) and a
+# 200-frame series (the test_data frames repeated), for the previous decoding
+# (a transform built per frame, one frame after another, torch.stack) and for
+# decode_frames into a preallocated tensor with 1 to --max-workers threads.
+# Every result must be the same tensor. The decode pool only helps with more
+# than one core.
+#
+#   python -m tests.benchmark_decode [--max-workers 4] [--repeats 3]
+
+
+def stacked_decode(paths):
+    images = []
+    for path in paths:
+        transform = transforms.Compose([
+            transforms.CenterCrop((143, 40)),
+            transforms.Resize(FRAME_SIZE, interpolation=InterpolationMode.BICUBIC, antialias=True),
+            transforms.ToTensor()
+        ])
+        images.append(transform(Image.open(path).convert("RGB")))
+    return torch.stack(images)
+
+
+def pooled_decode(paths, workers):
+    workers_before, pool_before = inference_settings.decode_workers, features._decode_pool
+    inference_settings.decode_workers, features._decode_pool = workers, None
+    try:
+        decode_frames(paths[:workers])  # starts the threads
+        start = time.perf_counter()
+        images = decode_frames(paths)
+        return images, time.perf_counter() - start
+    finally:
+        if features._decode_pool is not None:
+            features._decode_pool.shutdown()
+        inference_settings.decode_workers, features._decode_pool = workers_before, pool_before
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    all_paths = [path for dir_path in list_series_dirs() for path in list_series_images(dir_path)]
+    series = {"80 frames": list_series_images(list_series_dirs()[0])[:80], "200 frames": (all_paths * 3)[:200]}
+    worker_counts = [1] + [w for w in (2, 4, 8) if w <= args.max_workers]
+
+    print(f"{os.cpu_count()} cores")
+    print(f"{'series':<12}{'stacked f/s':>13}" + "".join(f"{f'{w} thread f/s':>15}" for w in worker_counts))
+    for name, paths in series.items():
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            expected = stacked_decode(paths)
+            times.append(time.perf_counter() - start)
+        row = f"{name:<12}{len(paths) / statistics.median(times):>13.0f}"
+
+        for workers in worker_counts:
+            times = []
+            for _ in range(args.repeats):
+                images, elapsed = pooled_decode(paths, workers)
+                assert torch.equal(images, expected), f"{name}, {workers} threads: frames differ"
+                times.append(elapsed)
+            row += f"{len(paths) / statistics.median(times):>15.0f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import os
+import time
+import argparse
+import statistics
+import torch
+from app.ml_pipeline import inference
+from app.ml_pipeline.ensemble import EarlyExit
+from app.ml_pipeline.registry import model_registry
+from app.utils.stopping_point import find_stopping_point
+from app.utils.series import list_series_dirs, load_series
+
+# Early-exit fold voting against evaluating every fold, on the stopping-point
+# window of each tests/test_data series: folds evaluated over both tiers,
+# species prediction latency and agreement of the final prediction with the
+# full ensembles.
+#
+#   python -m tests.benchmark_early_exit [--repeats 10] [--confidence 0.9 0.95 0.99]
+
+
+def timed_predict(window, policy, repeats):
+    inference.early_exit = policy
+    result = inference.predict(window, task="species")  # warm up
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        inference.predict(window, task="species")
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--confidence", type=float, nargs="+", default=[0.9, 0.95, 0.99])
+    args = parser.parse_args()
+
+    model_registry.load()
+    policies = {"majority": EarlyExit("majority")}
+    for confidence in args.confidence:
+        policies[f"confidence {confidence}"] = EarlyExit("confidence", confidence=confidence)
+
+    windows = []
+    for dir_path in list_series_dirs():
+        images = load_series(dir_path)
+        stopping_point = find_stopping_point(images, threshold=23, mode="sliding_window")
+        windows.append((os.path.basename(dir_path), images[max(stopping_point - 5, 0):stopping_point].unsqueeze(0)))
+
+    full = {}
+    with torch.inference_mode():
+        for name, window in windows:
+            full[name] = timed_predict(window, None, args.repeats)
+
+        print(f"{'policy':<18}{'series':<16}{'folds':>7}{'full ms':>9}{'early ms':>10}{'saved':>8}{'same':>6}")
+        for policy_name, policy in policies.items():
+            folds, full_folds_total, saved, agree = [], [], [], []
+            for name, window in windows:
+                full_result, full_ms = full[name]
+                result, early_ms = timed_predict(window, policy, args.repeats)
+                full_folds = 10 if full_result["second_tier_preds"] not in (None, 0, 8) else 5
+                same = result["final_preds"] == full_result["final_preds"]
+                folds.append(result["folds_evaluated"])
+                full_folds_total.append(full_folds)
+                saved.append(1 - early_ms / full_ms)
+                agree.append(same)
+                print(
+                    f"{policy_name:<18}{name:<16}{result['folds_evaluated']:>4}/{full_folds:<2}{full_ms:>9.1f}"
+                    f"{early_ms:>10.1f}{saved[-1]:>8.0%}{'yes' if same else 'NO':>6}"
+                )
+            print(
+                f"{policy_name:<18}{'average':<16}{statistics.mean(folds):>4.1f}/{statistics.mean(full_folds_total):<4.1f}"
+                f"{'':>17}"
+                f"{statistics.mean(saved):>8.0%}{sum(agree) / len(agree):>6.0%}\n"
+            )
+    inference.early_exit = None
+
+
+if __name__ == "__main__":
+    main()
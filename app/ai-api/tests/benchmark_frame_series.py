@@ -0,0 +1,99 @@
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from app.core.config import inference_settings
+from app.ml_pipeline.features import (
+    load_image_series_from_folder, load_prediction_input_with_stopping_point, prepare_input_tensor, decode_frames,
+)
+from app.utils.stopping_point import find_stopping_point
+from tests.benchmark_memory import read_status_kb, reset_peak_rss
+from app.utils.series import list_series_dirs, list_series_images
+from tests.series import link_frames
+
+# Peak RSS and time of loading the species input of an 80-frame series
+# (tests/test_data) and of a 200-frame series (the test_data frames repeated),
+# from the float series of load_image_series_from_folder and from the lazy
+# FrameSeries the prediction requests load, with the frames decoded on each
+# request and read from the frame store. Each load runs in its own process.
+# The stopping point is scanned, not looked up in the delta-E profile, and
+# both loads must return the same input.
+#
+#   python -m tests.benchmark_frame_series
+
+
+def float_series_input(folder):
+    images = load_image_series_from_folder(folder)
+    stopping_point = find_stopping_point(images, threshold=23, mode="sliding_window")
+    return prepare_input_tensor(images, stopping_point=stopping_point)
+
+
+def lazy_series_input(folder):
+    return load_prediction_input_with_stopping_point(folder)[0]
+
+
+LOADERS = {"float": float_series_input, "lazy": lazy_series_input}
+
+
+def configure(frame_store):
+    inference_settings.frame_store = frame_store
+    inference_settings.incremental_stopping_point = False
+
+
+def run_load(loader, folder, frame_store):
+    configure(frame_store)
+    # starts the decode pool, so its threads are not counted
+    decode_frames(list_series_images(list_series_dirs()[0])[:2])
+
+    reset_peak_rss()
+    rss_before = read_status_kb("VmRSS")
+    start = time.perf_counter()
+    LOADERS[loader](folder)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return {"peak_rss_delta_mb": round((read_status_kb("VmHWM") - rss_before) / 1024, 1), "ms": round(elapsed_ms, 1)}
+
+
+def measure(loader, folder, frame_store):
+    output = subprocess.run(
+        [sys.executable, "-m", "tests.benchmark_frame_series", "--loader", loader, "--folder", folder]
+        + (["--frame-store"] if frame_store else []),
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loader", choices=list(LOADERS))
+    parser.add_argument("--folder")
+    parser.add_argument("--frame-store", action="store_true")
+    args = parser.parse_args()
+
+    if args.loader:
+        print(json.dumps(run_load(args.loader, args.folder, args.frame_store)))
+        return
+
+    all_paths = [path for dir_path in list_series_dirs() for path in list_series_images(dir_path)]
+    series = {"80 frames": list_series_images(list_series_dirs()[0])[:80], "200 frames": (all_paths * 3)[:200]}
+
+    print(f"{'series':<12}{'frames from':<13}{'float MB':>10}{'lazy MB':>9}{'float ms':>10}{'lazy ms':>9}")
+    for name, paths in series.items():
+        with tempfile.TemporaryDirectory() as folder:
+            link_frames(folder, paths)
+            for frame_store in (False, True):
+                configure(frame_store)
+                expected, model_input = float_series_input(folder), lazy_series_input(folder)
+                assert model_input is expected is None or model_input.equal(expected), f"{name}: inputs differ"
+
+                results = {loader: measure(loader, folder, frame_store) for loader in LOADERS}
+                source = "frame store" if frame_store else "PNGs"
+                print(
+                    f"{name:<12}{source:<13}{results['float']['peak_rss_delta_mb']:>10}"
+                    f"{results['lazy']['peak_rss_delta_mb']:>9}{results['float']['ms']:>10}{results['lazy']['ms']:>9}"
+                )
+
+
+if __name__ == "__main__":
+    main()
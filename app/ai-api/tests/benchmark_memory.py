@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import torch
+from app.ml_pipeline.inference import predict
+from app.ml_pipeline.registry import model_registry
+from app.utils.stopping_point import find_stopping_point
+from app.utils.series import list_series_dirs, load_series
+
+# Peak RSS and allocations per species / concentration request on tests/test_data,
+# with autograd recording ("before", predict without its inference context)
+# and without it ("after"). Each mode runs in its own process.
+#
+#   python -m tests.benchmark_memory
+
+
+def read_status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return None
+
+
+def reset_peak_rss():
+    # writing 5 to clear_refs resets VmHWM to the current RSS (Linux only)
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def measure(fn):
+    reset_peak_rss()
+    rss_before = read_status_kb("VmRSS")
+    result = fn()
+    peak_delta_kb = read_status_kb("VmHWM") - rss_before
+    del result
+
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True) as prof:
+        result = fn()
+    allocations = [e.self_cpu_memory_usage for e in prof.events() if e.self_cpu_memory_usage > 0]
+    del result
+
+    return {
+        "peak_rss_delta_mb": round(peak_delta_kb / 1024, 2),
+        "allocations": len(allocations),
+        "allocated_mb": round(sum(allocations) / 2**20, 2),
+    }
+
+
+def run_mode(mode):
+    run = predict if mode == "after" else predict.__wrapped__
+    model_registry.load()
+
+    results = {}
+    for dir_path in list_series_dirs():
+        images = load_series(dir_path)
+        stopping_point = find_stopping_point(images, threshold=23, mode="sliding_window")
+        window = images[max(stopping_point - 5, 0):stopping_point].unsqueeze(0)
+        image = images[stopping_point].unsqueeze(0)
+
+        # warm up so one-off allocations (buffers, thread pools) are not counted
+        run(window, task="species")
+        run(image, task="concentration")
+
+        results[os.path.basename(dir_path)] = {
+            "species": measure(lambda: run(window, task="species")),
+            "concentration": measure(lambda: run(image, task="concentration")),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["before", "after"])
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode)))
+        return
+
+    reports = {}
+    for mode in ("before", "after"):
+        output = subprocess.run(
+            [sys.executable, "-m", "tests.benchmark_memory", "--mode", mode],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        reports[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'series':<16}{'task':<15}{'peak RSS MB before/after':>26}{'allocs before/after':>22}{'alloc MB before/after':>24}")
+    for series, tasks in reports["before"].items():
+        for task, before in tasks.items():
+            after = reports["after"][series][task]
+            print(
+                f"{series:<16}{task:<15}"
+                f"{before['peak_rss_delta_mb']:>14} / {after['peak_rss_delta_mb']:<9}"
+                f"{before['allocations']:>11} / {after['allocations']:<8}"
+                f"{before['allocated_mb']:>13} / {after['allocated_mb']:<8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
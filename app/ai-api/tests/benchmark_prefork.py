@@ -0,0 +1,81 @@
+import sys
+import time
+import signal
+import argparse
+import subprocess
+import requests
+from app.utils.memory import memory_report, format_memory_report
+
+# Memory of the pre-fork server (app/serve.py) with the models loaded once in
+# the parent and inherited by the workers, against every worker loading its own
+# copy. Each configuration is started, warmed up by a few species predictions
+# per worker, reported and stopped.
+#
+#   python -m tests.benchmark_prefork [--workers 4] [--port 8099]
+
+
+def wait_until_healthy(url, process, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            if requests.get(f"{url}/health", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{url} did not become healthy within {timeout}s")
+
+
+def wait_for_workers(pid, workers, timeout=300):
+    # /health answers as soon as the first worker is up
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        report = memory_report(pid)
+        if len(report["workers"]) == workers:
+            return
+        time.sleep(0.5)
+
+
+def run(args, *serve_args):
+    url = f"http://127.0.0.1:{args.port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), *serve_args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        start = time.perf_counter()
+        wait_until_healthy(url, process)
+        wait_for_workers(process.pid, args.workers)
+        # let every worker finish its warm-up before measuring
+        time.sleep(args.settle)
+        startup = time.perf_counter() - start
+        return startup, memory_report(process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--settle", type=float, default=5.0, help="seconds to wait for the workers' warm-up")
+    args = parser.parse_args()
+
+    configurations = {
+        "models loaded per worker": ["--no-preload"],
+        "preloaded, copy-on-write": [],
+        "preloaded, shared memory": ["--share-memory"],
+    }
+    for name, serve_args in configurations.items():
+        startup, report = run(args, *serve_args)
+        print(f"\n{name} ({args.workers} workers, up in {startup:.1f}s)")
+        print(format_memory_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import os
+import time
+import argparse
+import statistics
+from skimage.color import rgb2lab
+from app.utils.stopping_point import find_stopping_point, roi_mean_delta_e
+from app.utils.series import list_series_dirs, load_series
+from tests.test_stopping_point import reference_find_stopping_point
+
+# Time of find_stopping_point on each tests/test_data series, for the original
+# loop over every ROI, for skimage rgb2lab per frame with the vectorized numpy
+# ROI means, and for the torch Lab conversion and ROI means batched over the
+# series (what find_stopping_point runs). All must return the same stopping point.
+#
+#   python -m tests.benchmark_stopping_point [--threshold 23] [--repeats 5]
+
+
+def numpy_find_stopping_point(images, threshold):
+    reference = rgb2lab(images[0].permute(1, 2, 0).numpy())
+    for index in range(1, len(images)):
+        lab = rgb2lab(images[index].permute(1, 2, 0).numpy())
+        if (roi_mean_delta_e(reference, lab) > threshold).any():
+            return index
+    return len(images) - 1
+
+
+def median_time_ms(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threshold", type=float, default=23)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'series':<18}{'frames':>7}{'stop':>6}{'loops ms':>10}{'numpy ms':>10}{'torch ms':>10}{'speedup':>9}")
+    for dir_path in list_series_dirs():
+        images = load_series(dir_path)
+        expected, loop_ms = median_time_ms(lambda: reference_find_stopping_point(images, args.threshold), args.repeats)
+        numpy_result, numpy_ms = median_time_ms(lambda: numpy_find_stopping_point(images, args.threshold), args.repeats)
+        stopping_point, torch_ms = median_time_ms(lambda: find_stopping_point(images, args.threshold), args.repeats)
+        assert numpy_result == stopping_point == expected, f"{dir_path}: {numpy_result}, {stopping_point} != {expected}"
+        print(
+            f"{os.path.basename(dir_path):<18}{images.size(0):>7}{stopping_point:>6}"
+            f"{loop_ms:>10.1f}{numpy_ms:>10.1f}{torch_ms:>10.1f}{loop_ms / torch_ms:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import os
+
+
+def link_frames(folder, image_paths):
+    """Links the frames into `folder` under upload file names (%H-%M-%S-%f, 15 minutes apart)."""
+    names = []
+    for index, path in enumerate(image_paths):
+        minutes = index * 15
+        names.append(f"{minutes // 60:02d}-{minutes % 60:02d}-00-000000.png")
+        os.symlink(os.path.abspath(path), os.path.join(folder, names[-1]))
+    return names
@@ -0,0 +1,75 @@
+import os
+import glob
+import time
+import argparse
+import numpy as np
+import torch
+from app.ml_pipeline.features import update_series_profile
+from app.utils.stopping_point import rgb_to_lab, max_roi_delta_e, stopping_point_from_profile
+from app.utils.series import list_series_dirs, load_series
+
+# Stopping points of archived series for a range of delta-E thresholds, read
+# from the per-frame delta-E profiles kept next to the uploads (built once for
+# series uploaded before there were profiles) and, with --test-data, computed
+# for tests/test_data. For each threshold it reports how many series have a
+# stopping point before their last frame, the spread of the stopping frame
+# and how many stop late enough (frame 24, 6 hours) to be predicted.
+#
+#   python -m tests.sweep_thresholds [--uploads-dir storage/uploads] [--test-data] [--thresholds 5 10 15 23 30 40]
+
+MIN_STOPPING_POINT = 24
+
+
+def upload_profiles(uploads_dir):
+    """{series: profile} of every storage/uploads/<qr_data>/<date>/ series."""
+    profiles = {}
+    for folder in sorted(glob.glob(os.path.join(uploads_dir, "*", "*"))):
+        if os.path.isdir(folder):
+            profile = update_series_profile(folder).profile
+            if profile.size:
+                profiles[os.path.relpath(folder, uploads_dir)] = profile
+    return profiles
+
+
+def test_data_profiles():
+    profiles = {}
+    for dir_path in list_series_dirs():
+        images = load_series(dir_path)
+        with torch.inference_mode():
+            reference = rgb_to_lab(images[:1])[0]
+        profiles[os.path.basename(dir_path)] = max_roi_delta_e(reference, images).numpy()
+    return profiles
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads-dir", default="storage/uploads")
+    parser.add_argument("--test-data", action="store_true", help="also sweep the tests/test_data series")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[5, 10, 15, 20, 23, 25, 30, 35, 40])
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    profiles = upload_profiles(args.uploads_dir) if os.path.isdir(args.uploads_dir) else {}
+    if args.test_data:
+        profiles.update(test_data_profiles())
+    if not profiles:
+        print(f"No series in {args.uploads_dir}, run with --test-data to sweep tests/test_data")
+        return
+    print(f"{len(profiles)} series profiles read in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    print(f"{'threshold':>9}{'stopped':>9}{'p10':>6}{'median':>8}{'p90':>6}{'predictable':>13}")
+    for threshold in args.thresholds:
+        stops = np.array([stopping_point_from_profile(profile, threshold) for profile in profiles.values()])
+        lengths = np.array([len(profile) for profile in profiles.values()])
+        stopped = stops < lengths - 1
+        predictable = stopped & (stops >= MIN_STOPPING_POINT)
+        p10, median, p90 = np.percentile(stops[stopped], [10, 50, 90]) if stopped.any() else (np.nan,) * 3
+        print(
+            f"{threshold:>9g}{stopped.mean():>9.0%}{p10:>6.0f}{median:>8.0f}{p90:>6.0f}{predictable.mean():>13.0%}"
+        )
+    print(f"swept {len(args.thresholds)} thresholds in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import os
+import math
+import pytest
+import torch
+from app.ml_pipeline import inference
+from app.ml_pipeline.backends import concentration_checkpoint_path
+from app.ml_pipeline.registry import ModelRegistry, model_registry
+from tests.test_ensemble import reference_windows
+
+# Runs with pytest, or directly: python -m tests.test_backends
+# Needs onnxruntime; ONNX artifacts are exported to ARTIFACT_DIR on the first run.
+
+
+def predict_with(registry, windows, images):
+    torch_registry = inference.model_registry
+    inference.model_registry = registry
+    try:
+        return (
+            inference.predict(windows, task="species"),
+            # the concentration checkpoint is not shipped with the repo
+            inference.predict_concentration(images) if os.path.exists(concentration_checkpoint_path()) else [],
+            inference.majority_vote_with_confidence(registry.get("first_classification"), windows),
+        )
+    finally:
+        inference.model_registry = torch_registry
+
+
+def test_onnxruntime_backend_returns_the_torch_results():
+    pytest.importorskip("onnxruntime")
+    from app.ml_pipeline.backends import OnnxRuntimeBackend
+
+    windows = reference_windows()
+    images = windows[:, -1]
+    onnx_registry = ModelRegistry(OnnxRuntimeBackend(intra_op_threads=2))
+
+    expected = predict_with(model_registry, windows, images)
+    species, concentration, (first_preds, first_confs) = predict_with(onnx_registry, windows, images)
+
+    assert species == expected[0]
+    for result, expected_result in zip(concentration, expected[1]):
+        assert result["concentration"] == expected_result["concentration"]
+        assert math.isclose(result["confidence"], expected_result["confidence"], abs_tol=1e-4)
+    assert first_preds == expected[2][0]
+    for conf, expected_conf in zip(first_confs, expected[2][1]):
+        assert math.isclose(conf, expected_conf, abs_tol=1e-4)
+
+
+if __name__ == "__main__":
+    test_onnxruntime_backend_returns_the_torch_results()
+    print("onnxruntime backend matches the torch backend")
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+import torch
+from app.ml_pipeline.batching import MicroBatcher, BatcherStoppedError
+from app.ml_pipeline.inference import predict
+from tests.test_ensemble import reference_windows
+
+# Runs with pytest, or directly: python -m tests.test_batching
+
+
+async def submit_concurrently(batcher, windows):
+    batcher.start()
+    try:
+        return await asyncio.gather(*[batcher.submit(windows[i:i + 1]) for i in range(windows.size(0))])
+    finally:
+        await batcher.stop()
+
+
+def test_concurrent_requests_share_one_batch_and_get_their_own_results():
+    windows = reference_windows()
+    batcher = MicroBatcher("species", max_batch_size=windows.size(0), max_wait_ms=1000)
+
+    results = asyncio.run(submit_concurrently(batcher, windows))
+
+    stats = batcher.stats()
+    assert stats["batches"] == 1
+    assert stats["max_batch_size_seen"] == windows.size(0)
+    for i, result in enumerate(results):
+        assert result == [predict(windows[i:i + 1], task="species")]
+
+
+def test_batch_is_dispatched_after_max_wait():
+    windows = reference_windows()[:3]
+    batcher = MicroBatcher("species", max_batch_size=16, max_wait_ms=1)
+
+    results = asyncio.run(submit_concurrently(batcher, windows))
+
+    assert len(results) == 3
+    assert batcher.stats()["samples"] == 3
+
+
+def test_stop_fails_the_waiting_requests():
+    windows = reference_windows()[:3]
+    # the batch waits for more requests until it is stopped
+    batcher = MicroBatcher("species", max_batch_size=16, max_wait_ms=10_000)
+
+    async def submit_and_stop():
+        batcher.start()
+        requests = [asyncio.create_task(batcher.submit(windows[i:i + 1])) for i in range(windows.size(0))]
+        await asyncio.sleep(0.1)
+        await asyncio.wait_for(batcher.stop(), 1)
+        results = await asyncio.wait_for(asyncio.gather(*requests, return_exceptions=True), 1)
+        with pytest.raises(BatcherStoppedError):
+            await batcher.submit(windows[:1])
+        return results
+
+    results = asyncio.run(submit_and_stop())
+    assert all(isinstance(result, BatcherStoppedError) for result in results)
+
+
+if __name__ == "__main__":
+    test_concurrent_requests_share_one_batch_and_get_their_own_results()
+    test_batch_is_dispatched_after_max_wait()
+    test_stop_fails_the_waiting_requests()
+    print("micro-batcher returns per-request results")
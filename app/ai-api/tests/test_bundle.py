@@ -0,0 +1,46 @@
+import os
+import tempfile
+import pytest
+import torch
+from ml_models.artifacts import DEFAULT_MODEL_DIR
+from ml_models.bundle import BundleError, ModelBundle, build_bundle, list_checkpoints, model_key, validate_bundle
+
+# Runs with pytest, or directly: python -m tests.test_bundle
+
+
+def test_bundle_round_trips_every_checkpoint():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "models.bundle")
+        build_bundle(DEFAULT_MODEL_DIR, path)
+        assert validate_bundle(path, DEFAULT_MODEL_DIR) == []
+
+        bundle = ModelBundle(path)
+        for checkpoint_path in list_checkpoints(DEFAULT_MODEL_DIR):
+            bundled = bundle.state_dict(model_key(checkpoint_path, DEFAULT_MODEL_DIR))
+            for name, tensor in torch.load(checkpoint_path, weights_only=True, map_location="cpu").items():
+                assert bundled[name].shape == tensor.shape and torch.equal(bundled[name], tensor), name
+
+
+def test_validate_reports_corruption():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "models.bundle")
+        build_bundle(DEFAULT_MODEL_DIR, path)
+
+        # flip one bit in the last tensor's data
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 1]))
+        assert len(validate_bundle(path, DEFAULT_MODEL_DIR)) == 1
+
+        with open(path, "r+b") as f:
+            f.write(b"NOTABNDL")
+        with pytest.raises(BundleError):
+            ModelBundle(path)
+
+
+if __name__ == "__main__":
+    test_bundle_round_trips_every_checkpoint()
+    test_validate_reports_corruption()
+    print("model bundle matches the checkpoints")
@@ -0,0 +1,81 @@
+import os
+import torch
+from ml_models.model_registry.CNN_LSTM import CNNLSTMModel
+from app.ml_pipeline.registry import SPECIES_ENSEMBLES
+from app.utils.series import list_series_dirs, load_series
+
+# Runs with pytest, or directly: python -m tests.test_cnn_lstm
+
+SPECIES_MODELS_DIR = os.path.join(os.path.dirname(__file__), "..", "ml_models", "species_models")
+
+
+def load_fold(mode, fold, num_classes):
+    model = CNNLSTMModel(cnn_feature_size=64, hidden_size=128, num_classes=num_classes)
+    model_path = os.path.join(SPECIES_MODELS_DIR, f"{mode}_fold{fold}.pth")
+    model.load_state_dict(torch.load(model_path, weights_only=True, map_location="cpu"), strict=True)
+    return model.eval()
+
+
+def sample_windows():
+    # the first, middle and last 5-frame window of every reference series
+    windows = []
+    for dir_path in list_series_dirs():
+        images = load_series(dir_path)
+        for start in (0, (len(images) - 5) // 2, len(images) - 5):
+            windows.append(images[start:start + 5])
+    return torch.stack(windows)
+
+
+def test_time_folded_forward_matches_per_timestep_forward():
+    windows = sample_windows()
+
+    with torch.no_grad():
+        for mode, num_classes in SPECIES_ENSEMBLES.items():
+            for fold in range(1, 6):
+                model = load_fold(mode, fold, num_classes)
+
+                model.time_folded = False
+                expected = model(windows)
+
+                model.time_folded = True
+                folded = model(windows)
+
+                torch.testing.assert_close(folded, expected)
+                assert torch.equal(folded.argmax(dim=1), expected.argmax(dim=1)), f"{mode} fold {fold}"
+
+
+def test_precomputed_features_feed_the_lstm_head():
+    windows = sample_windows()
+    model = load_fold("first_classification", 1, SPECIES_ENSEMBLES["first_classification"])
+
+    with torch.no_grad():
+        cnn_features = model.extract_features(windows)
+        assert cnn_features.shape == (windows.size(0), 5, 64)
+        assert torch.equal(model(cnn_features=cnn_features), model(windows))
+
+
+def test_bf16_model_keeps_the_fp32_interface():
+    from ml_models.bfloat16 import BF16_MODES, BFloat16Model
+
+    windows = sample_windows()[:8]
+    with torch.no_grad():
+        for bf16_mode in BF16_MODES:
+            model = load_fold("first_classification", 1, SPECIES_ENSEMBLES["first_classification"])
+            expected = model(windows)
+            bf16 = BFloat16Model(model, bf16_mode)
+
+            logits = bf16(windows)
+            assert logits.dtype == torch.float32 and logits.shape == expected.shape
+            # bf16 keeps 8 mantissa bits, compare the probabilities rather than the raw logits
+            torch.testing.assert_close(logits.softmax(dim=1), expected.softmax(dim=1), atol=0.1, rtol=0)
+
+            cnn_features = bf16.extract_features(windows)
+            assert cnn_features.dtype == torch.float32
+            torch.testing.assert_close(bf16.classify_features(cnn_features), logits)
+
+
+if __name__ == "__main__":
+    test_time_folded_forward_matches_per_timestep_forward()
+    test_precomputed_features_feed_the_lstm_head()
+    test_bf16_model_keeps_the_fp32_interface()
+    print("time-folded CNNLSTMModel matches the per-timestep forward")
@@ -0,0 +1,39 @@
+import torch
+from app.core.config import inference_settings
+from app.ml_pipeline import features
+from app.ml_pipeline.features import decode_frames, load_frame_from_source
+from app.utils.series import list_series_dirs, list_series_images, load_series
+
+# Runs with pytest, or directly: python -m tests.test_decode
+
+
+def decode_with_workers(workers, *args, **kwargs):
+    workers_before, pool_before = inference_settings.decode_workers, features._decode_pool
+    inference_settings.decode_workers, features._decode_pool = workers, None
+    try:
+        return decode_frames(*args, **kwargs)
+    finally:
+        if features._decode_pool is not None:
+            features._decode_pool.shutdown()
+        inference_settings.decode_workers, features._decode_pool = workers_before, pool_before
+
+
+def test_parallel_decoding_matches_the_sequential_frames():
+    dir_path = list_series_dirs()[0]
+    paths = list_series_images(dir_path)
+    expected = load_series(dir_path)
+
+    for workers in (1, 3):
+        assert torch.equal(decode_with_workers(workers, paths), expected)
+
+        # straight into a preallocated tensor, as floats or uint8 frames
+        out = torch.empty_like(expected)
+        assert decode_with_workers(workers, paths, out=out) is out
+        assert torch.equal(out, expected)
+        frames = decode_with_workers(workers, paths[:10], dtype=torch.uint8)
+        assert torch.equal(frames, torch.stack([load_frame_from_source(path) for path in paths[:10]]))
+
+
+if __name__ == "__main__":
+    test_parallel_decoding_matches_the_sequential_frames()
+    print("parallel decoding == sequential decoding")
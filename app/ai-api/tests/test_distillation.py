@@ -0,0 +1,104 @@
+import os
+import tempfile
+import torch
+from app.ml_pipeline import inference
+from app.ml_pipeline.backends import TorchBackend, student_name
+from app.ml_pipeline.registry import ModelRegistry, model_registry
+from ml_models.artifacts import checkpoint_hash
+from ml_models.quantization import checkpoint_hashes
+from ml_models.distillation import SeriesWindows, student_checkpoint_path, student_rejection_reason, write_report
+from tests.test_ensemble import reference_windows
+
+# Runs with pytest, or directly: python -m tests.test_distillation
+
+
+class FixedStudentBackend(TorchBackend):
+    """Torch backend whose students return the same logits for every window."""
+
+    def __init__(self, logits):
+        super().__init__()
+        self.logits = logits
+
+    def load_student(self, mode, num_classes):
+        self.runtimes[student_name(mode)] = "fixed"
+        logits = self.logits(num_classes)
+        return lambda images: logits.expand(images.size(0), -1)
+
+
+def predict_with(registry, windows):
+    registry_before = inference.model_registry
+    inference.model_registry = registry
+    try:
+        return inference.predict(windows, task="species")
+    finally:
+        inference.model_registry = registry_before
+
+
+def test_series_windows_are_the_sliding_windows():
+    series = [torch.rand(7, 3, 4, 2), torch.rand(5, 3, 4, 2)]
+    windows = SeriesWindows(series)
+    expected = [images[i:i + 5] for images in series for i in range(images.size(0) - 4)]
+    assert len(windows) == len(expected) == 4
+    assert torch.equal(windows.batch(torch.arange(len(windows))), torch.stack(expected))
+
+
+def test_students_below_the_held_out_agreement_are_not_served():
+    with tempfile.TemporaryDirectory() as model_dir:
+        teacher_paths = []
+        for name in ("ef_kp_fold_1.pth", "ef_kp_fold_2.pth", "ef_kp_student.pth"):
+            path = os.path.join(model_dir, "species_models", name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(name.encode())
+            teacher_paths.append(path)
+        teacher_paths.pop()
+
+        entry = {
+            "teachers": checkpoint_hashes(teacher_paths),
+            "student": checkpoint_hash(student_checkpoint_path(model_dir, "ef_kp")),
+            "holdout_series": ["E.F_L_0001_top"],
+            "min_confidence": 0.9,
+            "agreement_with_fallback": 0.97,
+        }
+
+        def reason(min_agreement=0.95, min_confidence=0.9, **changes):
+            write_report({"models": {"ef_kp": {**entry, **changes}}}, model_dir)
+            return student_rejection_reason("ef_kp", teacher_paths, model_dir, min_agreement, min_confidence)
+
+        assert reason() is None
+        # a higher fallback threshold than the measured one only adds ensemble votes
+        assert reason(min_confidence=0.95) is None
+        assert "below 0.98" in reason(min_agreement=0.98)
+        assert "fallback below 0.9" in reason(min_confidence=0.8)
+        assert "held-out" in reason(holdout_series=[])
+
+
+def test_unsure_students_fall_back_to_the_ensembles():
+    windows = reference_windows()
+    registry = ModelRegistry(FixedStudentBackend(lambda num_classes: torch.zeros(1, num_classes)), students=True)
+
+    result = predict_with(registry, windows)
+    assert result.pop("student_fallback") == [True] * windows.size(0)
+    assert result == predict_with(model_registry, windows)
+
+
+def test_confident_students_answer_without_the_ensembles():
+    windows = reference_windows()
+    # every student predicts its last class with a confidence of ~1
+    registry = ModelRegistry(
+        FixedStudentBackend(lambda num_classes: torch.arange(num_classes, dtype=torch.float32).unsqueeze(0) * 100),
+        students=True,
+    )
+
+    result = predict_with(registry, windows)
+    assert result["student_fallback"] == [False] * windows.size(0)
+    assert result["first_tier_preds"] == [4] * windows.size(0)
+    assert result["final_preds"] == ["Ecoli"] * windows.size(0)
+
+
+if __name__ == "__main__":
+    test_series_windows_are_the_sliding_windows()
+    test_students_below_the_held_out_agreement_are_not_served()
+    test_unsure_students_fall_back_to_the_ensembles()
+    test_confident_students_answer_without_the_ensembles()
+    print("students fall back to their ensembles below the confidence threshold")
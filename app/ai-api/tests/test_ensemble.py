@@ -0,0 +1,164 @@
+import torch
+import numpy as np
+import torch.nn.functional as F
+from collections import Counter
+from app.ml_pipeline.registry import model_registry, SPECIES_ENSEMBLES
+from app.ml_pipeline.inference import majority_vote, majority_vote_with_confidence, predict
+from app.utils.stopping_point import find_stopping_point
+from app.utils.series import list_series_dirs, load_series
+
+# Runs with pytest, or directly: python -m tests.test_ensemble
+
+
+def reference_majority_vote_with_confidence(fold_models, images):
+    """Per-sample Counter vote the tensor vote has to reproduce exactly."""
+    fold_predictions = []
+    fold_confidences = []
+    for model in fold_models:
+        probs = F.softmax(model(images), dim=1)
+        confs, preds = torch.max(probs, 1)
+        fold_predictions.append([int(p) for p in preds.cpu().numpy()])
+        fold_confidences.append(confs.detach().cpu().numpy())
+
+    voted_preds = []
+    avg_confidences = []
+    for j in range(images.size(0)):
+        sample_preds = [fold_predictions[f][j] for f in range(len(fold_models))]
+        most_common = Counter(sample_preds).most_common(1)[0][0]
+        voted_preds.append(int(most_common))
+        avg_confidences.append(float(np.mean([
+            fold_confidences[f][j] for f in range(len(fold_models)) if fold_predictions[f][j] == most_common
+        ])))
+    return voted_preds, avg_confidences
+
+
+def reference_windows():
+    windows = []
+    for dir_path in list_series_dirs():
+        images = load_series(dir_path)
+        stopping_point = find_stopping_point(images, threshold=23, mode="sliding_window")
+        windows.append(images[max(stopping_point - 5, 0):stopping_point])
+    return torch.stack(windows)
+
+
+def test_vote_matches_reference_on_test_data():
+    windows = reference_windows()
+    with torch.no_grad():
+        for mode in SPECIES_ENSEMBLES:
+            ensemble = model_registry.get(mode)
+            for i in range(windows.size(0)):
+                sample = windows[i:i + 1]
+                assert majority_vote_with_confidence(ensemble, sample) == \
+                    reference_majority_vote_with_confidence(ensemble, sample), mode
+            # whole batch at once
+            expected = reference_majority_vote_with_confidence(ensemble, windows)
+            assert majority_vote_with_confidence(ensemble, windows) == expected, mode
+            assert majority_vote(ensemble, windows) == expected[0], mode
+
+
+def test_vote_breaks_ties_like_counter():
+    from app.ml_pipeline.ensemble import tensor_majority_vote
+
+    generator = torch.Generator().manual_seed(0)
+    fold_preds = torch.randint(0, 3, (5, 2000), generator=generator)
+    fold_confs = torch.rand(5, 2000, generator=generator)
+    voted, confs = tensor_majority_vote(fold_preds, 3, fold_confs)
+
+    for j in range(fold_preds.size(1)):
+        sample_preds = fold_preds[:, j].tolist()
+        most_common = Counter(sample_preds).most_common(1)[0][0]
+        assert voted[j].item() == most_common
+        expected = float(np.mean([fold_confs[f, j].numpy() for f in range(5) if sample_preds[f] == most_common]))
+        assert confs[j].item() == expected
+
+
+def test_majority_early_exit_only_stops_when_the_vote_is_fixed():
+    from itertools import product
+    from app.ml_pipeline.ensemble import EarlyExit
+
+    policy = EarlyExit("majority")
+    for prefix_length in range(1, 5):
+        prefixes = list(product(range(3), repeat=prefix_length))
+        fold_preds = torch.tensor(prefixes).t()
+        decided = policy.decided(fold_preds, torch.ones(fold_preds.shape), 3, 5 - prefix_length)
+        for prefix, is_decided in zip(prefixes, decided.tolist()):
+            winners = {
+                Counter(prefix + rest).most_common(1)[0][0] for rest in product(range(3), repeat=5 - prefix_length)
+            }
+            # decided only when no outcome of the remaining folds can change the winner
+            if is_decided:
+                assert len(winners) == 1, prefix
+
+
+def test_majority_early_exit_matches_full_vote():
+    from app.ml_pipeline.ensemble import EarlyExit
+
+    windows = reference_windows()
+    with torch.no_grad():
+        for mode in SPECIES_ENSEMBLES:
+            ensemble = model_registry.get(mode)
+            for i in range(windows.size(0)):
+                sample = windows[i:i + 1]
+                voted_preds, _, folds_evaluated = EarlyExit("majority").vote(ensemble, sample)
+                assert voted_preds.tolist() == majority_vote(ensemble, sample), mode
+                assert 3 <= folds_evaluated.item() <= len(ensemble)
+
+
+def test_majority_early_exit_waits_for_the_confidence_gate():
+    from app.ml_pipeline.ensemble import EarlyExit
+
+    # three agreeing folds at 0.56 fix the winner, but two more folds at 0.9
+    # would lift the mean confidence over the gate
+    fold_preds = torch.zeros((3, 1), dtype=torch.long)
+    fold_confs = torch.full((3, 1), 0.56)
+    policy = EarlyExit("majority")
+    assert policy.decided(fold_preds, fold_confs, 5, 2).item()
+    assert not policy.decided(fold_preds, fold_confs, 5, 2, gate=0.6).item()
+    assert policy.decided(torch.zeros((3, 1), dtype=torch.long), torch.full((3, 1), 0.9), 5, 2, gate=0.6).item()
+
+    windows = reference_windows()
+    with torch.no_grad():
+        for mode in SPECIES_ENSEMBLES:
+            ensemble = model_registry.get(mode)
+            full_preds, full_confs = majority_vote_with_confidence(ensemble, windows)
+            voted_preds, mean_confs, _ = policy.vote(ensemble, windows, gate=0.6)
+            assert voted_preds.tolist() == full_preds, mode
+            assert [conf >= 0.6 for conf in mean_confs.tolist()] == [conf >= 0.6 for conf in full_confs], mode
+
+
+def test_early_exit_vote_does_not_depend_on_the_batch():
+    from app.ml_pipeline.ensemble import EarlyExit
+
+    windows = reference_windows()
+    with torch.no_grad():
+        for policy in (EarlyExit("majority"), EarlyExit("confidence", confidence=0.9)):
+            for mode in SPECIES_ENSEMBLES:
+                ensemble = model_registry.get(mode)
+                batched_preds, batched_confs, batched_folds = policy.vote(ensemble, windows, gate=0.6)
+                for i in range(windows.size(0)):
+                    preds, confs, folds = policy.vote(ensemble, windows[i:i + 1], gate=0.6)
+                    assert batched_preds[i].item() == preds.item(), (policy.policy, mode)
+                    assert batched_folds[i].item() == folds.item(), (policy.policy, mode)
+                    # batched and single forwards only differ by float rounding
+                    assert abs(batched_confs[i].item() - confs.item()) < 1e-5, (policy.policy, mode)
+
+
+def test_batched_predict_matches_single_predictions():
+    windows = reference_windows()
+    with torch.no_grad():
+        batched = predict(windows, task="species")
+        for i in range(windows.size(0)):
+            single = predict(windows[i:i + 1], task="species")
+            for key, value in single.items():
+                assert batched[key][i] == value, key
+
+
+if __name__ == "__main__":
+    test_vote_breaks_ties_like_counter()
+    test_vote_matches_reference_on_test_data()
+    test_majority_early_exit_only_stops_when_the_vote_is_fixed()
+    test_majority_early_exit_matches_full_vote()
+    test_majority_early_exit_waits_for_the_confidence_gate()
+    test_early_exit_vote_does_not_depend_on_the_batch()
+    test_batched_predict_matches_single_predictions()
+    print("ensemble voting matches the reference implementation")
@@ -0,0 +1,54 @@
+import torch
+from app.ml_pipeline.ensemble import FoldEnsemble
+from app.ml_pipeline.feature_cache import FrameFeatureCache
+from app.ml_pipeline.registry import model_registry
+from app.utils.series import list_series_dirs, load_series
+
+# Runs with pytest, or directly: python -m tests.test_feature_cache
+
+
+def cached_ensemble(max_frames=2048):
+    folds = list(model_registry.get("first_classification"))
+    return FoldEnsemble(folds), FoldEnsemble(folds, FrameFeatureCache(len(folds), max_frames=max_frames))
+
+
+def test_sliding_window_only_runs_the_cnn_on_the_new_frame():
+    images = load_series(list_series_dirs()[0])
+    ensemble, cached = cached_ensemble()
+
+    with torch.inference_mode():
+        for end in range(5, 12):
+            window = images[end - 5:end].unsqueeze(0)
+            assert torch.equal(cached.fold_logits(window), ensemble.fold_logits(window))
+
+    stats = cached.feature_cache.stats()
+    # 5 frames for the first window, then one new frame per window, for each of the 5 folds
+    assert stats["misses"] == (5 + 6) * 5
+    assert stats["hits"] == 6 * 4 * 5
+    assert stats["frames"] == 11 and stats["series"] == 1
+
+
+def test_series_extended_longest_ago_is_evicted():
+    a, b, c, d = [load_series(dir_path)[:6] for dir_path in list_series_dirs()[:4]]
+    _, cached = cached_ensemble(max_frames=16)
+
+    with torch.inference_mode():
+        for images in (a, b, c):
+            cached.fold_logits(images[:5].unsqueeze(0))
+        # extending a leaves b as the series extended longest ago
+        cached.fold_logits(a[1:6].unsqueeze(0))
+        assert cached.feature_cache.stats()["evicted_series"] == 0
+        cached.fold_logits(d[:5].unsqueeze(0))
+
+    stats = cached.feature_cache.stats()
+    assert stats["evicted_series"] == 1
+    assert stats["series"] == 3 and stats["frames"] == 16
+    cached_frames = cached.feature_cache._frames
+    assert not any(FrameFeatureCache.frame_id(frame) in cached_frames for frame in b[:5])
+    assert all(FrameFeatureCache.frame_id(frame) in cached_frames for frame in a)
+
+
+if __name__ == "__main__":
+    test_sliding_window_only_runs_the_cnn_on_the_new_frame()
+    test_series_extended_longest_ago_is_evicted()
+    print("sliding windows reuse the cached per-frame CNN features")
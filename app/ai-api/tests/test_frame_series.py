@@ -0,0 +1,50 @@
+import torch
+from app.ml_pipeline.features import FrameSeries, prepare_input_tensor, decode_frames
+from app.utils.stopping_point import find_stopping_point
+from app.utils.series import list_series_dirs, list_series_images, load_series
+
+# Runs with pytest, or directly: python -m tests.test_frame_series
+
+
+class CountingFrameSeries(FrameSeries):
+    """Counts the frames converted to float."""
+
+    materialized = 0
+
+    def __getitem__(self, index):
+        frames = super().__getitem__(index)
+        self.materialized += frames.size(0) if frames.dim() == 4 else 1
+        return frames
+
+
+def test_lazy_series_gives_the_float_series_results():
+    for dir_path in list_series_dirs()[:3]:
+        images = load_series(dir_path)
+        series = FrameSeries(decode_frames(list_series_images(dir_path), dtype=torch.uint8))
+        assert len(series) == images.size(0) and torch.equal(series.to_tensor(), images)
+
+        stopping_point = find_stopping_point(series, threshold=23)
+        assert stopping_point == find_stopping_point(images, threshold=23)
+        assert find_stopping_point(series, 3, use_prev_image=True) == find_stopping_point(images, 3, use_prev_image=True)
+        for method in ("sliding_window", "image"):
+            expected = prepare_input_tensor(images, method=method, stopping_point=stopping_point)
+            model_input = prepare_input_tensor(series, method=method, stopping_point=stopping_point)
+            # None before frame 24
+            assert model_input is expected is None or torch.equal(model_input, expected)
+
+
+def test_only_the_model_input_is_materialized():
+    dir_path = list_series_dirs()[0]
+    stopping_point = find_stopping_point(load_series(dir_path), threshold=23)
+    frames = decode_frames(list_series_images(dir_path), dtype=torch.uint8)
+
+    for method, expected in (("sliding_window", 5), ("image", 1)):
+        series = CountingFrameSeries(frames)
+        prepare_input_tensor(series, method=method, stopping_point=stopping_point)
+        assert series.materialized == expected
+
+
+if __name__ == "__main__":
+    test_lazy_series_gives_the_float_series_results()
+    test_only_the_model_input_is_materialized()
+    print("lazy frame series == float series, only the model input is materialized")
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import torch
+from app.core.config import inference_settings
+from app.ml_pipeline.features import load_image_series_from_folder, load_frame_from_source
+from app.utils.frame_store import FrameStore
+from app.utils.series import list_series_dirs, list_series_images, load_series
+from tests.series import link_frames
+
+# Runs with pytest, or directly: python -m tests.test_frame_store
+
+
+def test_stored_series_is_the_decoded_series():
+    dir_path = list_series_dirs()[0]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        link_frames(tmp_dir, list_series_images(dir_path))
+        frame_store_before = inference_settings.frame_store
+        inference_settings.frame_store = True
+        try:
+            images = load_image_series_from_folder(tmp_dir)
+        finally:
+            inference_settings.frame_store = frame_store_before
+        assert torch.equal(images, load_series(dir_path))
+
+
+def test_frames_are_decoded_once():
+    image_paths = list_series_images(list_series_dirs()[0])[:30]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        names = link_frames(tmp_dir, image_paths)
+        decoded = []
+
+        def decode(new_names):
+            decoded.extend(new_names)
+            return torch.stack([load_frame_from_source(os.path.join(tmp_dir, name)) for name in new_names]).numpy()
+
+        # one upload at a time, every request opens the store again
+        for count in range(1, len(names) + 1):
+            frames = FrameStore(tmp_dir, (3, 190, 40)).sync(names[:count], decode).frames()
+            assert frames.shape == (count, 3, 190, 40) and frames.dtype == torch.uint8
+        assert decoded == names
+        assert torch.equal(frames[-1], load_frame_from_source(image_paths[-1]))
+
+        # a frame went missing from the middle of the series
+        kept = names[:10] + names[11:]
+        decoded.clear()
+        frames = FrameStore(tmp_dir, (3, 190, 40)).sync(kept, decode).frames(start=10)
+        assert decoded == kept
+        assert torch.equal(frames[0], load_frame_from_source(image_paths[11]))
+
+        # the frame is back, before the last stored frame, so the store is rebuilt
+        decoded.clear()
+        FrameStore(tmp_dir, (3, 190, 40)).sync(names, decode)
+        assert decoded == names
+
+
+if __name__ == "__main__":
+    test_stored_series_is_the_decoded_series()
+    test_frames_are_decoded_once()
+    print("the frame store holds the decoded frames, each decoded once")
@@ -0,0 +1,128 @@
+import os
+import asyncio
+import tempfile
+from app.ml_pipeline import memo
+from app.ml_pipeline.memo import PredictionMemo, DiskMemoStore, model_version, start_prediction_memo
+from app.ml_pipeline.executor import InferenceExecutor
+from app.routers.prediction import predict_species_core
+from app.utils.stopping_point import find_stopping_point
+from app.utils.series import list_series_dirs, list_series_images, load_series
+from tests.series import link_frames
+
+# Runs with pytest, or directly: python -m tests.test_memo
+
+DATE = "2025-07-06"
+
+
+def upload_series(storage_dir, qr_data, image_paths):
+    """Links the frames into storage/uploads/<qr_data>/<DATE>/ under the upload file names."""
+    folder = os.path.join(storage_dir, "storage", "uploads", qr_data, DATE)
+    os.makedirs(folder)
+    link_frames(folder, image_paths)
+
+
+async def predict_twice(prediction_memo, qr_data):
+    memo_before = memo.prediction_memo
+    memo.prediction_memo = prediction_memo
+    try:
+        return [await predict_species_core(qr_data, "local", DATE) for _ in range(2)]
+    finally:
+        memo.prediction_memo = memo_before
+
+
+def in_directory(directory, coroutine):
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        return asyncio.run(coroutine)
+    finally:
+        os.chdir(cwd)
+
+
+def test_only_final_stopping_points_are_memoized():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        prediction_memo = PredictionMemo(DiskMemoStore(tmp_dir), version="v1")
+
+        async def run():
+            # the last of 40 frames may only be the stopping point because no frame differed yet
+            assert not await prediction_memo.put("species", "local", "qr", DATE, 39, 40, {"species": "Ecoli"})
+            assert await prediction_memo.get("species", "local", "qr", DATE) is None
+            assert await prediction_memo.put("species", "local", "qr", DATE, 30, 40, {"species": "Ecoli"})
+            assert await prediction_memo.get("species", "local", "qr", DATE) == {"species": "Ecoli"}
+            assert await prediction_memo.get("concentration", "local", "qr", DATE) is None
+            # retrained models or other settings do not see the entry
+            assert await PredictionMemo(DiskMemoStore(tmp_dir), version="v2").get("species", "local", "qr", DATE) is None
+
+        asyncio.run(run())
+        stats = prediction_memo.stats()["tasks"]
+        assert stats["species"] == {"hits": 1, "misses": 1, "stores": 1, "errors": 0, "hit_rate": 0.5}
+        assert stats["concentration"]["misses"] == 1
+
+
+def test_model_version_is_set_once_at_startup():
+    class FailingExecutor:
+        async def run(self, stage, fn, *args):
+            raise OSError("checkpoint unreadable")
+
+    memo_before = memo.prediction_memo
+    executor = InferenceExecutor("thread", max_workers=1)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            memo.prediction_memo = PredictionMemo(DiskMemoStore(tmp_dir))
+            # without a version nothing is looked up or stored
+            assert not asyncio.run(memo.prediction_memo.put("species", "local", "qr", DATE, 30, 40, {"species": "Ecoli"}))
+            asyncio.run(start_prediction_memo(executor))
+            assert memo.prediction_memo.version == model_version()
+
+            memo.prediction_memo = PredictionMemo(DiskMemoStore(tmp_dir))
+            asyncio.run(start_prediction_memo(FailingExecutor()))
+            assert memo.prediction_memo is None
+    finally:
+        executor.shutdown()
+        memo.prediction_memo = memo_before
+
+
+def test_model_version_follows_the_served_runtimes():
+    assert model_version(runtimes={"first_classification": "eager"}) != model_version(runtimes={"first_classification": "int8"})
+
+
+def test_memoized_series_is_not_loaded_again():
+    image_paths = list_series_images(list_series_dirs()[0])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        upload_series(tmp_dir, "complete", image_paths)
+        prediction_memo = PredictionMemo(DiskMemoStore(os.path.join(tmp_dir, "memo")), version="v1")
+
+        first, second = in_directory(tmp_dir, predict_twice(prediction_memo, "complete"))
+        assert first["species"] is not None
+        assert second == first
+        assert prediction_memo.stats()["tasks"]["species"] == {
+            "hits": 1, "misses": 1, "stores": 1, "errors": 0, "hit_rate": 0.5
+        }
+
+        # the memo is answered without the frames
+        os.rename(os.path.join(tmp_dir, "storage"), os.path.join(tmp_dir, "moved"))
+        (third, _) = in_directory(tmp_dir, predict_twice(prediction_memo, "complete"))
+        assert third == first
+
+
+def test_stopping_point_on_the_last_frame_is_not_memoized():
+    series_dir = list_series_dirs()[0]
+    stopping_point = find_stopping_point(load_series(series_dir), threshold=23)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # a later frame could still move a stopping point on the last frame
+        upload_series(tmp_dir, "partial", list_series_images(series_dir)[:stopping_point + 1])
+        prediction_memo = PredictionMemo(DiskMemoStore(os.path.join(tmp_dir, "memo")), version="v1")
+
+        first, second = in_directory(tmp_dir, predict_twice(prediction_memo, "partial"))
+        assert first["species"] is not None
+        assert second == first
+        assert prediction_memo.stats()["tasks"]["species"]["stores"] == 0
+
+
+if __name__ == "__main__":
+    test_only_final_stopping_points_are_memoized()
+    test_model_version_is_set_once_at_startup()
+    test_model_version_follows_the_served_runtimes()
+    test_memoized_series_is_not_loaded_again()
+    test_stopping_point_on_the_last_frame_is_not_memoized()
+    print("final predictions are memoized per series and model version")
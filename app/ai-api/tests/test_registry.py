@@ -0,0 +1,38 @@
+import pytest
+from app.ml_pipeline import inference
+from app.ml_pipeline.backends import TorchBackend
+from app.ml_pipeline.registry import ModelRegistry, ModelUnavailableError, CONCENTRATION_MODEL
+from tests.test_ensemble import reference_windows
+
+# Runs with pytest, or directly: python -m tests.test_registry
+
+
+class MissingConcentrationBackend(TorchBackend):
+    """A deployment without the concentration checkpoint."""
+
+    def load_concentration_model(self, name, num_classes):
+        raise FileNotFoundError("concentration_models/binary_concentration_classifier.pth")
+
+
+def test_missing_model_only_fails_its_own_requests():
+    windows = reference_windows()[:4]
+    expected = inference.predict(windows, task="species")
+
+    registry = ModelRegistry(MissingConcentrationBackend())
+    registry.load()
+    assert registry.loaded
+    assert list(registry.report()["unavailable"]) == [CONCENTRATION_MODEL]
+
+    registry_before = inference.model_registry
+    inference.model_registry = registry
+    try:
+        assert inference.predict(windows, task="species") == expected
+        with pytest.raises(ModelUnavailableError):
+            inference.predict(windows[:, -1], task="concentration")
+    finally:
+        inference.model_registry = registry_before
+
+
+if __name__ == "__main__":
+    test_missing_model_only_fails_its_own_requests()
+    print("a model that fails to load only fails its own requests")
@@ -0,0 +1,19 @@
+from app.serve import RespawnPolicy
+
+# Runs with pytest, or directly: python -m tests.test_serve
+
+
+def test_respawn_backs_off_and_gives_up_on_a_crash_loop():
+    policy = RespawnPolicy(max_crashes=4, window_s=60, first_delay_s=1, max_delay_s=5)
+
+    assert [policy.delay_after_exit(now=t) for t in (0, 1, 2, 3)] == [1, 2, 4, 5]
+    assert policy.delay_after_exit(now=4) is None
+
+    # exits older than the window no longer count
+    policy = RespawnPolicy(max_crashes=4, window_s=60, first_delay_s=1, max_delay_s=5)
+    assert [policy.delay_after_exit(now=t) for t in (0, 100, 200)] == [1, 1, 1]
+
+
+if __name__ == "__main__":
+    test_respawn_backs_off_and_gives_up_on_a_crash_loop()
+    print("crashing workers are replaced with a backoff, a crash loop stops the server")
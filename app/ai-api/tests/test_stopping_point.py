@@ -0,0 +1,152 @@
+import os
+import tempfile
+import numpy as np
+import torch
+from skimage.color import rgb2lab
+from app.utils.stopping_point import find_stopping_point, rgb_to_lab, DeltaEProfile, PROFILE_NAME
+from app.utils.series import list_series_dirs, list_series_images, load_series
+
+# Runs with pytest, or directly: python -m tests.test_stopping_point
+
+
+def reference_find_stopping_point(image_tensor, threshold, use_roi_size=10, use_stride_size=5, use_prev_image=None):
+    """find_stopping_point (mode "sliding_window") as it was written, with one numpy call per ROI."""
+    for index in range(len(image_tensor)):
+        image = rgb2lab(image_tensor[index].permute(1, 2, 0).numpy())
+        if index == 0:
+            prev_image = image
+            continue
+
+        roi_size = use_roi_size
+        stride = use_stride_size
+        h, w = image.shape[:2]
+        for i in range(0, h-roi_size+1, stride):
+            for j in range(0, w-roi_size+1, stride):
+                roi_current = image[i:i+roi_size, j:j+roi_size]
+                roi_prev = prev_image[i:i+roi_size, j:j+roi_size]
+                delta_E = np.sqrt(np.sum((roi_current - roi_prev) ** 2, axis=2))
+                if np.mean(delta_E) > threshold:
+                    return index
+            if use_prev_image:
+                prev_image = image
+
+    return index
+
+
+def test_torch_lab_matches_skimage():
+    frames = torch.cat([load_series(dir_path)[::20] for dir_path in list_series_dirs()])
+    # and a grid over the whole sRGB cube, as a single column of pixels
+    levels = torch.arange(0, 256, 15, dtype=torch.float32) / 255
+    grid = torch.cartesian_prod(levels, levels, levels).t().reshape(1, 3, -1, 1)
+
+    for images in (frames, grid):
+        lab = rgb_to_lab(images)
+        for i in range(images.size(0)):
+            expected = rgb2lab(images[i].permute(1, 2, 0).numpy())
+            np.testing.assert_allclose(lab[i].permute(1, 2, 0).numpy(), expected, atol=1e-3)
+
+
+def test_vectorized_rois_match_the_roi_loops():
+    for dir_path in list_series_dirs():
+        images = load_series(dir_path)
+        for threshold in (5, 15, 23, 40):
+            assert find_stopping_point(images, threshold) == reference_find_stopping_point(images, threshold)
+        assert find_stopping_point(images, 3, use_prev_image=True) == reference_find_stopping_point(
+            images, 3, use_prev_image=True
+        )
+
+
+def test_profile_lookup_matches_the_full_scan():
+    for dir_path in list_series_dirs()[:3]:
+        images = load_series(dir_path)
+        names = [os.path.basename(path) for path in list_series_images(dir_path)]
+        stopping_points = {threshold: find_stopping_point(images, threshold) for threshold in (5, 15, 23, 40)}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # one upload at a time, every request gets a new profile that reads the saved one
+            for count in range(1, len(names) + 1):
+                profile = DeltaEProfile(tmp_dir).update(names[:count], lambda start: images[start:count])
+                for threshold, stopping_point in stopping_points.items():
+                    assert profile.stopping_point(threshold) == min(stopping_point, count - 1)
+            assert os.path.exists(os.path.join(tmp_dir, PROFILE_NAME))
+            assert len(profile.profile) == len(names) and profile.profile[0] == 0
+
+
+def test_mismatching_profile_is_rebuilt():
+    dir_path = list_series_dirs()[0]
+    images = load_series(dir_path)
+    names = [os.path.basename(path) for path in list_series_images(dir_path)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        DeltaEProfile(tmp_dir).update(names, lambda start: images[start:])
+
+        # a frame went missing from the middle of the series
+        kept = list(range(10)) + list(range(11, len(names)))
+        loaded = []
+
+        def load_frames(start):
+            loaded.append(start)
+            return images[kept][start:]
+
+        profile = DeltaEProfile(tmp_dir).update([names[i] for i in kept], load_frames)
+        assert loaded == [0]
+        assert profile.stopping_point(23) == find_stopping_point(images[kept], threshold=23)
+
+        # other ROI parameters do not reuse the profile
+        profile = DeltaEProfile(tmp_dir, roi_size=20, stride=10).update(names, lambda start: images[start:])
+        assert profile.stopping_point(23) == find_stopping_point(images, 23, use_roi_size=20, use_stride_size=10)
+
+
+
+def test_corrupt_profile_is_rebuilt():
+    dir_path = list_series_dirs()[0]
+    images = load_series(dir_path)
+    names = [os.path.basename(path) for path in list_series_images(dir_path)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        DeltaEProfile(tmp_dir).update(names, lambda start: images[start:])
+        # a torn write leaves a truncated npz behind
+        path = os.path.join(tmp_dir, PROFILE_NAME)
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) // 2)
+
+        loaded = []
+
+        def load_frames(start):
+            loaded.append(start)
+            return images[start:]
+
+        profile = DeltaEProfile(tmp_dir).update(names, load_frames)
+        assert loaded == [0]
+        assert profile.stopping_point(23) == find_stopping_point(images, threshold=23)
+        assert DeltaEProfile(tmp_dir).load()
+
+
+def test_concurrent_updates_keep_one_readable_profile():
+    from concurrent.futures import ThreadPoolExecutor
+
+    dir_path = list_series_dirs()[0]
+    images = load_series(dir_path)
+    names = [os.path.basename(path) for path in list_series_images(dir_path)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # the upload and the prediction stage update the profile of the same series
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            counts = [len(names) - 3 + i % 4 for i in range(24)]
+            profiles = list(pool.map(
+                lambda count: DeltaEProfile(tmp_dir).update(names[:count], lambda start: images[start:count]), counts
+            ))
+
+        for count, profile in zip(counts, profiles):
+            assert profile.stopping_point(23) == min(find_stopping_point(images, threshold=23), count - 1)
+        assert DeltaEProfile(tmp_dir).load()
+        assert [name for name in os.listdir(tmp_dir) if name.endswith(".npz")] == [PROFILE_NAME]
+
+if __name__ == "__main__":
+    test_torch_lab_matches_skimage()
+    test_vectorized_rois_match_the_roi_loops()
+    test_profile_lookup_matches_the_full_scan()
+    test_mismatching_profile_is_rebuilt()
+    test_corrupt_profile_is_rebuilt()
+    test_concurrent_updates_keep_one_readable_profile()
+    print("vectorized and profile stopping points == the ROI loops")
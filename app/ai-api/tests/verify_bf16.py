@@ -0,0 +1,131 @@
+import copy
+import argparse
+import torch
+import torch.nn.functional as F
+from app.ml_pipeline.ensemble import FoldEnsemble, tensor_majority_vote
+from app.ml_pipeline import inference
+from app.ml_pipeline.registry import ModelRegistry, SPECIES_ENSEMBLES, CONCENTRATION_MODEL, model_registry
+from app.ml_pipeline.backends import TorchBackend, load_ensemble_models, load_concentration_model
+from app.utils.stopping_point import find_stopping_point
+from ml_models.bfloat16 import BF16_MODES, BFloat16Model, bf16_supported
+from app.utils.series import list_series_dirs, load_series
+from tests.verify_quantization import sliding_windows
+from app.utils.timing import median_latency_ms
+
+# Measures the bfloat16 modes against fp32 on the nine tests/test_data series:
+# top-1 agreement of the voted class on every 5-frame window (species
+# ensembles) or frame (concentration), the largest difference of the winning
+# softmax confidence, and the latency of a single-window forward. Then the
+# species and concentration predictions of each series' stopping-point window
+# with every model in bf16 (BF16_MODE) are compared to fp32. Enable bf16 per
+# model with BF16_MODELS where the agreement is 1 and the latency is lower.
+#
+#   python -m tests.verify_bf16 [--models first_classification,concentration] [--modes autocast,weights]
+
+
+def to_bf16(models, mode):
+    # BFloat16Model converts the weights of the module it wraps in "weights" mode
+    return [BFloat16Model(copy.deepcopy(model), mode) for model in models]
+
+
+def max_confidence_delta(fp32_logits, bf16_logits):
+    fp32_probs, bf16_probs = F.softmax(fp32_logits, dim=-1), F.softmax(bf16_logits, dim=-1)
+    winner = fp32_probs.argmax(dim=-1, keepdim=True)
+    return (fp32_probs.gather(-1, winner) - bf16_probs.gather(-1, winner)).abs().max().item()
+
+
+def verify_species(mode, num_classes, series, bf16_mode, repeats, batch_size=32):
+    fp32 = FoldEnsemble(load_ensemble_models(mode, num_classes=num_classes))
+    bf16 = FoldEnsemble(to_bf16(fp32, bf16_mode))
+
+    agree, total, delta = 0, 0, 0.0
+    for images in series:
+        for chunk in sliding_windows(images).split(batch_size):
+            fp32_logits, bf16_logits = fp32.fold_logits(chunk), bf16.fold_logits(chunk)
+            fp32_votes = tensor_majority_vote(fp32_logits.argmax(dim=2), num_classes)[0]
+            bf16_votes = tensor_majority_vote(bf16_logits.argmax(dim=2), num_classes)[0]
+            agree += (fp32_votes == bf16_votes).sum().item()
+            total += chunk.size(0)
+            delta = max(delta, max_confidence_delta(fp32_logits, bf16_logits))
+
+    window = sliding_windows(series[0])[:1]
+    return {
+        "agreement": agree / total,
+        "max_confidence_delta": delta,
+        "fp32_latency_ms": median_latency_ms(lambda: fp32.fold_logits(window), repeats),
+        "bf16_latency_ms": median_latency_ms(lambda: bf16.fold_logits(window), repeats),
+    }
+
+
+def verify_concentration(series, bf16_mode, repeats, batch_size=64):
+    fp32 = load_concentration_model(num_classes=2)
+    (bf16,) = to_bf16([fp32], bf16_mode)
+
+    frames = torch.cat(series)
+    agree, delta = 0, 0.0
+    for chunk in frames.split(batch_size):
+        fp32_logits, bf16_logits = fp32(chunk), bf16(chunk)
+        agree += (fp32_logits.argmax(dim=1) == bf16_logits.argmax(dim=1)).sum().item()
+        delta = max(delta, max_confidence_delta(fp32_logits, bf16_logits))
+
+    image = frames[:1]
+    return {
+        "agreement": agree / frames.size(0),
+        "max_confidence_delta": delta,
+        "fp32_latency_ms": median_latency_ms(lambda: fp32(image), repeats),
+        "bf16_latency_ms": median_latency_ms(lambda: bf16(image), repeats),
+    }
+
+
+def compare_predictions(series, models):
+    bf16_registry = ModelRegistry(TorchBackend(bf16_models=models))
+    same = 0
+    for images in series:
+        stopping_point = find_stopping_point(images, threshold=23, mode="sliding_window")
+        window = images[max(stopping_point - 5, 0):stopping_point].unsqueeze(0)
+        image = images[stopping_point]
+        results = []
+        for registry in (model_registry, bf16_registry):
+            inference.model_registry = registry
+            results.append((
+                inference.predict(window, task="species")["final_preds"],
+                inference.predict(image, task="concentration")["concentration"],
+            ))
+        inference.model_registry = model_registry
+        same += results[0] == results[1]
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", default=",".join(list(SPECIES_ENSEMBLES) + [CONCENTRATION_MODEL]))
+    parser.add_argument("--modes", default=",".join(BF16_MODES))
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    if not bf16_supported():
+        print("this CPU has no native bf16 arithmetic (AVX512-BF16 / AMX), bf16 is emulated here")
+
+    series = [load_series(dir_path) for dir_path in list_series_dirs()]
+
+    print(f"{'model':<22}{'mode':<10}{'agreement':>10}{'max dconf':>11}{'fp32 ms':>10}{'bf16 ms':>10}{'speedup':>9}")
+    with torch.inference_mode():
+        for name in args.models.split(","):
+            for bf16_mode in args.modes.split(","):
+                if name == CONCENTRATION_MODEL:
+                    entry = verify_concentration(series, bf16_mode, args.repeats)
+                else:
+                    entry = verify_species(name, SPECIES_ENSEMBLES[name], series, bf16_mode, args.repeats)
+                print(
+                    f"{name:<22}{bf16_mode:<10}{entry['agreement']:>10.4f}{entry['max_confidence_delta']:>11.4f}"
+                    f"{entry['fp32_latency_ms']:>10.2f}{entry['bf16_latency_ms']:>10.2f}"
+                    f"{entry['fp32_latency_ms'] / entry['bf16_latency_ms']:>8.2f}x"
+                )
+
+        models = args.models.split(",")
+        same = compare_predictions(series, models)
+        print(f"\nbf16 {', '.join(models)}: {same}/{len(series)} stopping-point predictions identical to fp32")
+
+
+if __name__ == "__main__":
+    main()
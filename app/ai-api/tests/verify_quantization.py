@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import torch
+from app.core.config import inference_settings
+from app.ml_pipeline.ensemble import FoldEnsemble, tensor_majority_vote
+from app.ml_pipeline.registry import SPECIES_ENSEMBLES, CONCENTRATION_MODEL
+from app.ml_pipeline.backends import (
+    ensemble_checkpoint_paths,
+    concentration_checkpoint_path,
+    load_ensemble_models,
+    load_concentration_model,
+)
+from ml_models.artifacts import species_example_inputs, concentration_example_inputs
+from ml_models.quantization import (
+    QUANTIZED_ENGINE,
+    quantize_species_model,
+    quantize_concentration_model,
+    save_int8_artifact,
+    load_int8_artifact,
+    checkpoint_hashes,
+    read_report,
+    write_report,
+)
+from app.utils.memory import process_memory
+from app.utils.series import list_series_dirs, load_series
+from app.utils.timing import median_latency_ms
+
+# Builds the INT8 artifacts, calibrated on every other frame of the
+# tests/test_data series except every --holdout-every'th one, and measures them
+# against fp32 on every 5-frame window (species ensembles) or frame
+# (concentration) of the held-out series only: top-1 agreement of the voted
+# class, latency of a single-window forward, size of the weights and resident
+# memory of a fresh process that loads the model and runs one forward.
+#
+# The results are written to ARTIFACT_DIR/int8_report.json. The registry only
+# serves a model listed in INT8_MODELS as INT8 if its agreement in this report
+# is at least INT8_MIN_AGREEMENT.
+#
+#   python -m tests.verify_quantization [--models first_classification,concentration] [--holdout-every 3]
+
+
+def file_size_mb(paths):
+    return sum(os.path.getsize(path) for path in paths) / 2**20
+
+
+def load_runtime(name, runtime):
+    """The fp32 or INT8 model (or fold ensemble) `name`, as verified."""
+    if name == CONCENTRATION_MODEL:
+        if runtime == "int8":
+            return load_int8_artifact(concentration_checkpoint_path(), inference_settings.artifact_dir)
+        return load_concentration_model(num_classes=2, runtime="eager")
+    if runtime == "int8":
+        return FoldEnsemble([
+            load_int8_artifact(path, inference_settings.artifact_dir) for path in ensemble_checkpoint_paths(name)
+        ])
+    return FoldEnsemble(load_ensemble_models(name, num_classes=SPECIES_ENSEMBLES[name], runtime="eager"))
+
+
+def measure_resident_memory(name, runtime):
+    """RSS / unique memory this process gains by loading `name` and running one forward."""
+    before = process_memory()
+    model = load_runtime(name, runtime)
+    with torch.inference_mode():
+        if name == CONCENTRATION_MODEL:
+            model(torch.zeros(1, 3, 190, 40))
+        else:
+            model.fold_logits(torch.zeros(1, 5, 3, 190, 40))
+    after = process_memory()
+    if "rss_bytes" not in before:
+        return {"rss_mb": None, "unique_mb": None}
+    return {
+        "rss_mb": (after["rss_bytes"] - before["rss_bytes"]) / 2**20,
+        "unique_mb": (after["unique_bytes"] - before["unique_bytes"]) / 2**20,
+    }
+
+
+def resident_memory(name, runtime):
+    """measure_resident_memory in a fresh process, so the other runtime's pages are not counted."""
+    output = subprocess.run(
+        [sys.executable, "-m", "tests.verify_quantization", "--memory-of", name, "--runtime", runtime],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def memory_entry(name):
+    fp32, int8 = resident_memory(name, "fp32"), resident_memory(name, "int8")
+    return {
+        "fp32_rss_mb": fp32["rss_mb"],
+        "int8_rss_mb": int8["rss_mb"],
+        "fp32_unique_mb": fp32["unique_mb"],
+        "int8_unique_mb": int8["unique_mb"],
+    }
+
+
+def sliding_windows(images, sequence_length=5):
+    return torch.stack([images[i - sequence_length:i] for i in range(sequence_length, images.size(0) + 1)])
+
+
+def ensemble_votes(ensemble, windows, num_classes, batch_size=32):
+    votes = []
+    for chunk in windows.split(batch_size):
+        fold_preds = ensemble.fold_logits(chunk).argmax(dim=2)
+        votes.append(tensor_majority_vote(fold_preds, num_classes)[0])
+    return torch.cat(votes)
+
+
+def verify_species(mode, num_classes, series, calibration_frames, repeats):
+    checkpoint_paths = ensemble_checkpoint_paths(mode)
+    fp32 = FoldEnsemble(load_ensemble_models(mode, num_classes=num_classes, runtime="eager"))
+
+    int8_paths = [
+        save_int8_artifact(
+            quantize_species_model(model, calibration_frames), path, species_example_inputs(),
+            inference_settings.artifact_dir,
+        )
+        for model, path in zip(fp32, checkpoint_paths)
+    ]
+    int8 = FoldEnsemble([load_int8_artifact(path, inference_settings.artifact_dir) for path in checkpoint_paths])
+
+    agree, total = 0, 0
+    for images in series:
+        windows = sliding_windows(images)
+        agree += (ensemble_votes(fp32, windows, num_classes) == ensemble_votes(int8, windows, num_classes)).sum().item()
+        total += windows.size(0)
+
+    window = sliding_windows(series[0])[:1]
+    return {
+        "checkpoints": checkpoint_hashes(checkpoint_paths),
+        "samples": total,
+        "agreement": agree / total,
+        "fp32_latency_ms": median_latency_ms(lambda: fp32.fold_logits(window), repeats),
+        "int8_latency_ms": median_latency_ms(lambda: int8.fold_logits(window), repeats),
+        "fp32_size_mb": file_size_mb(checkpoint_paths),
+        "int8_size_mb": file_size_mb(int8_paths),
+        **memory_entry(mode),
+    }
+
+
+def verify_concentration(series, calibration_frames, repeats, batch_size=64):
+    checkpoint_path = concentration_checkpoint_path()
+    fp32 = load_concentration_model(num_classes=2, runtime="eager")
+
+    int8_path = save_int8_artifact(
+        quantize_concentration_model(fp32, calibration_frames), checkpoint_path, concentration_example_inputs(),
+        inference_settings.artifact_dir,
+    )
+    int8 = load_int8_artifact(checkpoint_path, inference_settings.artifact_dir)
+
+    frames = torch.cat(series)
+    agree = sum(
+        (fp32(chunk).argmax(dim=1) == int8(chunk).argmax(dim=1)).sum().item() for chunk in frames.split(batch_size)
+    )
+
+    image = frames[:1]
+    return {
+        "checkpoints": checkpoint_hashes([checkpoint_path]),
+        "samples": frames.size(0),
+        "agreement": agree / frames.size(0),
+        "fp32_latency_ms": median_latency_ms(lambda: fp32(image), repeats),
+        "int8_latency_ms": median_latency_ms(lambda: int8(image), repeats),
+        "fp32_size_mb": file_size_mb([checkpoint_path]),
+        "int8_size_mb": file_size_mb([int8_path]),
+        **memory_entry(CONCENTRATION_MODEL),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", default=",".join(list(SPECIES_ENSEMBLES) + [CONCENTRATION_MODEL]))
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--holdout-every", type=int, default=3, help="every n-th series is only used for the agreement")
+    parser.add_argument("--memory-of", help=argparse.SUPPRESS)
+    parser.add_argument("--runtime", choices=["fp32", "int8"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.memory_of:
+        print(json.dumps(measure_resident_memory(args.memory_of, args.runtime)))
+        return
+
+    dir_paths = list_series_dirs()
+    held_out = [i % args.holdout_every == args.holdout_every - 1 for i in range(len(dir_paths))]
+    series = [load_series(dir_path) for dir_path in dir_paths]
+    calibration_frames = torch.cat([images[::2] for images, hold in zip(series, held_out) if not hold])
+    holdout_series = [images for images, hold in zip(series, held_out) if hold]
+
+    report = read_report(inference_settings.artifact_dir)
+    report["engine"] = QUANTIZED_ENGINE
+    report["holdout_series"] = [os.path.basename(path) for path, hold in zip(dir_paths, held_out) if hold]
+    report.setdefault("models", {})
+
+    with torch.inference_mode():
+        for name in args.models.split(","):
+            if name == CONCENTRATION_MODEL:
+                entry = verify_concentration(holdout_series, calibration_frames, args.repeats)
+            else:
+                entry = verify_species(name, SPECIES_ENSEMBLES[name], holdout_series, calibration_frames, args.repeats)
+            report["models"][name] = entry
+            write_report(report, inference_settings.artifact_dir)
+
+    print(f"agreement on the held-out series {', '.join(report['holdout_series'])}")
+    print(
+        f"{'model':<22}{'agreement':>10}{'fp32 ms':>10}{'int8 ms':>10}{'fp32 MB':>10}{'int8 MB':>10}"
+        f"{'fp32 RSS MB':>13}{'int8 RSS MB':>13}  status"
+    )
+    for name, entry in report["models"].items():
+        status = "ok" if entry["agreement"] >= inference_settings.int8_min_agreement else (
+            f"refused (< {inference_settings.int8_min_agreement})"
+        )
+        rss = [entry.get(key) for key in ("fp32_rss_mb", "int8_rss_mb")]
+        print(
+            f"{name:<22}{entry['agreement']:>10.4f}{entry['fp32_latency_ms']:>10.2f}{entry['int8_latency_ms']:>10.2f}"
+            f"{entry['fp32_size_mb']:>10.2f}{entry['int8_size_mb']:>10.2f}"
+            + "".join(f"{value:>13.1f}" if value is not None else f"{'n/a':>13}" for value in rss)
+            + f"  {status}"
+        )
+
+
+if __name__ == "__main__":
+    main()